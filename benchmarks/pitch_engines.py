@@ -0,0 +1,62 @@
+# Compares the pitch analysis engines in noodler.audio.notes on synthetic chords: how long a block
+# takes, how long the whole signal takes a block at a time, and how often the loudest keys are the
+# chord's notes.
+#
+# Usage: python benchmarks/pitch_engines.py [seconds]
+import os
+import sys
+import time
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from noodler.audio import notes
+from signals import CHORDS, chord_labels, synthesize
+
+SAMPLING_RATE = 44100
+WINDOW_WIDTHS = [1024, 2048, 4096]
+THRESHOLD = 0.1
+# The fraction of frames where the chord's notes are its loudest keys, ignoring the first and last
+# tenth of a second of each chord, where frames overlap two of them.
+def accuracy(engine, window_width, matrix, labels):
+    hop = notes.ENGINES[engine].hop_length(window_width)
+    centers = numpy.arange(matrix.shape[1]) * hop
+    inside = (centers % SAMPLING_RATE > SAMPLING_RATE // 10) & (centers % SAMPLING_RATE < SAMPLING_RATE - SAMPLING_RATE // 10)
+    inside &= centers < len(labels)
+    hits = 0
+    for t in numpy.flatnonzero(inside):
+        chord = CHORDS[labels[centers[t]]]
+        loudest = numpy.argsort(matrix[:, t])[-len(chord):]
+        hits += set(loudest.tolist()) == set(chord)
+    return hits / max(inside.sum(), 1)
+
+def main():
+    seconds = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    y = synthesize("chords", seconds, SAMPLING_RATE, 1).samples()[0]
+    labels = chord_labels(len(y), SAMPLING_RATE)
+    print("{:<10} {:>7} {:>5} {:>10} {:>12} {:>9}".format("engine", "window", "hop", "block ms", "signal s", "accuracy"))
+    for window_width in WINDOW_WIDTHS:
+        for engine in notes.ENGINES:
+            # Warm up librosa's caches, e.g. the constant-Q filters.
+            notes.analyze_block(engine, y, SAMPLING_RATE, THRESHOLD, window_width, 0)
+            start = time.perf_counter()
+            notes.analyze_block(engine, y, SAMPLING_RATE, THRESHOLD, window_width, 1)
+            block = time.perf_counter() - start
+            start = time.perf_counter()
+            blocks = [
+                notes.analyze_block(engine, y, SAMPLING_RATE, THRESHOLD, window_width, index)[0]
+                for index in range(notes.block_count(engine, len(y), window_width))
+            ]
+            signal = time.perf_counter() - start
+            matrix = numpy.concatenate(blocks, axis=1)
+            print("{:<10} {:>7} {:>5} {:>10.1f} {:>12.2f} {:>9.2f}".format(
+                engine,
+                window_width,
+                notes.ENGINES[engine].hop_length(window_width),
+                block * 1000,
+                signal,
+                accuracy(engine, window_width, matrix, labels),
+            ))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# Synthetic test signals for the benchmarks. They're generated a block at a time straight into a
+# PcmBuffer, like a decoded song, so that even hours of audio don't have to fit in memory.
+import os
+import sys
+import numpy
+import soundfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from noodler.audio.pcm import PcmBuffer
+from noodler.utils import utils
+
+# Frames generated at a time.
+BLOCK_FRAMES = 1 << 20
+# Piano keys of the chords played, one after the other, a second each.
+CHORDS = [
+    [27, 31, 34],  # C3 E3 G3
+    [39, 43, 46],  # C4 E4 G4
+    [8, 20, 27],  # F1 F2 C3
+    [56, 60, 63, 67],  # F5 A5 C6 E6
+]
+
+# Each signal returns frames [first, first + count) of channel at sampling_rate, in mono. Channels
+# differ slightly, so that stereo isn't just mono twice.
+
+# A 440 Hz sine, a little lower in every further channel.
+def sine(first, count, sampling_rate, channel):
+    t = (first + numpy.arange(count)) / sampling_rate
+    return 0.5 * numpy.sin(2 * numpy.pi * (440.0 - channel) * t)
+
+# White noise, the same for the same frames regardless of how the signal is split into blocks.
+def noise(first, count, sampling_rate, channel):
+    generator = numpy.random.default_rng([first, channel])
+    return generator.uniform(-0.5, 0.5, count)
+
+# The CHORDS, each held for a second, as piano-like tones with decaying harmonics.
+def chords(first, count, sampling_rate, channel):
+    frames = first + numpy.arange(count)
+    t = frames % sampling_rate / sampling_rate
+    labels = frames // sampling_rate % len(CHORDS)
+    y = numpy.zeros(count)
+    for (label, chord) in enumerate(CHORDS):
+        playing = labels == label
+        tone = numpy.zeros(playing.sum())
+        for key in chord:
+            frequency = 440.0 * 2.0 ** ((utils.piano_key_to_midi(key) - 69) / 12.0)
+            for harmonic in range(1, 4):
+                tone += numpy.sin(2 * numpy.pi * frequency * harmonic * t[playing]) / harmonic ** 2
+        y[playing] = 0.2 * numpy.exp(-2.0 * t[playing]) * tone / len(chord)
+    # Every further channel is a little quieter.
+    return y * (1.0 - 0.1 * channel)
+
+# Signals by the name they're selected with.
+SIGNALS = {
+    "sine": sine,
+    "noise": noise,
+    "chords": chords,
+}
+
+# Returns seconds of signal at sampling_rate with channels channels, in a temporary PcmBuffer.
+def synthesize(signal, seconds, sampling_rate, channels, directory = None):
+    frame_count = int(seconds * sampling_rate)
+    buffer = PcmBuffer.allocate(frame_count, channels, directory)
+    for first in range(0, frame_count, BLOCK_FRAMES):
+        count = min(BLOCK_FRAMES, frame_count - first)
+        for channel in range(channels):
+            buffer.frames[first:first + count, channel] = SIGNALS[signal](first, count, sampling_rate, channel)
+    buffer.set_available_frames(frame_count)
+    return buffer
+
+# Returns, for every frame of a chords signal, the index in CHORDS of the chord playing.
+def chord_labels(frame_count, sampling_rate):
+    return numpy.arange(frame_count) // sampling_rate % len(CHORDS)
+
+# Writes buffer to a 16-bit WAV file at path, a block at a time.
+def write_wav(buffer, sampling_rate, path):
+    with soundfile.SoundFile(path, "w", samplerate=sampling_rate, channels=buffer.shape[1], subtype="PCM_16") as f:
+        for first in range(0, buffer.shape[0], BLOCK_FRAMES):
+            f.write(buffer.frames[first:first + BLOCK_FRAMES])
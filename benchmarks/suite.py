@@ -0,0 +1,317 @@
+# Benchmarks the hot paths of opening, showing, playing and analyzing a song on synthetic signals, and
+# writes the results as JSON so that runs on different commits can be compared. It needs neither an
+# audio device nor a display: the audio process's callback path is called directly, and everything that
+# draws uses Qt's offscreen platform.
+#
+# Usage: python benchmarks/suite.py [--signals sine noise chords] [--rates 44100 48000] [--channels 1 2]
+#                                   [--minutes 1 10 120] [--cases peaks load] [--repeats 3] [--output FILE]
+#        python benchmarks/suite.py --compare OLD.json NEW.json
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import librosa
+import numpy
+from PyQt6.QtWidgets import QApplication
+
+REPOSITORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPOSITORY)
+
+from noodler.audio import audio, notes, peaks, source, stretch, transcription
+from noodler.gui import audio_view, main_window, waveform
+from noodler.utils import utils
+from signals import SIGNALS, synthesize, write_wav
+
+# Width of the simulated screen, in pixels.
+VIEW_WIDTH = 1200
+VIEW_HEIGHT = 400
+# Viewports queried per run of peaks.query.
+QUERIES = 100
+# Seconds of playback simulated per run of the playback cases, at most.
+PLAYBACK_SECONDS = 600
+STRETCHED_SECONDS = 10
+PLAY_RATE = 0.75
+# Pitch blocks analyzed per run, from the middle of the song.
+PITCH_BLOCKS = 8
+PITCH_WINDOW_WIDTH = 2048
+PITCH_THRESHOLD = 0.1
+# Seconds of the song whose piptrack is grouped by note per run.
+GROUP_SECONDS = 30
+# Ratios of new to old time beyond which --compare calls a case slower or faster.
+SLOWER = 1.1
+FASTER = 0.9
+
+# Song is a synthesized signal, with a WAV file of it made on demand for the cases that decode.
+class Song:
+    def __init__(self, signal, minutes, sampling_rate, channels, directory):
+        self.signal = signal
+        self.minutes = minutes
+        self.sampling_rate = sampling_rate
+        self.channels = channels
+        self.directory = directory
+        self.buffer = synthesize(signal, minutes * 60, sampling_rate, channels, directory)
+        self.wav_path = None
+
+    def parameters(self):
+        return {"signal": self.signal, "minutes": self.minutes, "sampling_rate": self.sampling_rate, "channels": self.channels}
+
+    def wav(self):
+        if self.wav_path is None:
+            self.wav_path = os.path.join(self.directory, "{signal}-{minutes}-{sampling_rate}-{channels}.wav".format(**self.parameters()))
+            write_wav(self.buffer, self.sampling_rate, self.wav_path)
+        return self.wav_path
+
+    def pyramid(self):
+        pyramid = peaks.PeakPyramid(self.buffer.shape[0])
+        pyramid.update(self.buffer.samples(), self.buffer.shape[0])
+        return pyramid
+
+    def delete(self):
+        self.buffer.delete()
+        if self.wav_path is not None:
+            os.remove(self.wav_path)
+
+# Returns the seconds each of repeats calls of run took.
+def timed(run, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return times
+
+# Each case benchmarks one hot path on a song. It returns the seconds each of repeats runs took, by the
+# name of what was measured.
+
+# Decoding the song's file into a PcmBuffer, as when it's opened for the first time.
+def decode(song, repeats):
+    path = song.wav()
+    def run():
+        decoder = source.StreamingDecoder(path)
+        decoder.start()
+        decoder.wait()
+        decoder.buffer.delete()
+    return {"decode": timed(run, repeats)}
+
+# Summarizing the whole song into a PeakPyramid, and querying it for viewports of VIEW_WIDTH pixels at
+# zoom levels from the whole song down to a sample per pixel.
+def peak_pyramid(song, repeats):
+    audio_data = song.buffer.samples()
+    frame_count = song.buffer.shape[0]
+    pyramid = song.pyramid()
+    generator = numpy.random.default_rng(0)
+    spans = numpy.geomspace(VIEW_WIDTH, frame_count, QUERIES).astype(numpy.int64)
+    firsts = (generator.random(QUERIES) * (frame_count - spans)).astype(numpy.int64)
+    def query():
+        for (first, span) in zip(firsts.tolist(), spans.tolist()):
+            pyramid.query(audio_data, first, first + span, VIEW_WIDTH)
+    return {
+        "peaks.update": timed(lambda: peaks.PeakPyramid(frame_count).update(audio_data, frame_count), repeats),
+        "peaks.query": timed(query, repeats),
+    }
+
+# Rendering a screenful of waveform tiles, at the widths the song is shown at initially, zoomed in to
+# about a pixel per BASE_BLOCK frames, and zoomed all the way in.
+def waveform_tiles(song, repeats):
+    audio_data = song.buffer.samples()
+    pyramid = song.pyramid()
+    widths = [VIEW_WIDTH, song.buffer.shape[0] / peaks.PeakPyramid.BASE_BLOCK, song.buffer.shape[0]]
+    tiles = -(-VIEW_WIDTH // waveform.WaveformItem.TILE_WIDTH)
+    def run():
+        for width in widths:
+            first = int(width / waveform.WaveformItem.TILE_WIDTH / 2)
+            for index in range(first, min(first + tiles, int(numpy.ceil(width / waveform.WaveformItem.TILE_WIDTH)))):
+                waveform.render_tile(pyramid, audio_data, width, VIEW_HEIGHT, index)
+    return {"waveform.tiles": timed(run, repeats)}
+
+# Building the waveform view of the song and drawing it for the first time.
+def scene(song, repeats):
+    audio_data = song.buffer.samples()
+    pyramid = song.pyramid()
+    player = audio.AudioPlayer()
+    player.set_audio_buffer(song.buffer, song.sampling_rate, 1.0)
+    def run():
+        view = audio_view.AudioWaveformView(audio_data, pyramid, player, lambda start, end: None, lambda timestamp: None)
+        view.resize(VIEW_WIDTH, VIEW_HEIGHT)
+        view.grab()
+        view.close()
+        view.deleteLater()
+    times = timed(run, repeats)
+    QApplication.processEvents()
+    return {"scene": times}
+
+# The audio process's callback path: looping playback of the whole song, at most PLAYBACK_SECONDS of
+# it, a buffer at a time, and STRETCHED_SECONDS of playback at PLAY_RATE.
+def playback(song, repeats):
+    frames = song.buffer.frames
+    end_frame = min(song.buffer.shape[0], PLAYBACK_SECONDS * song.sampling_rate)
+    callbacks = end_frame // audio.FRAMES_PER_BUFFER
+    def play():
+        wrap = audio.create_wrap_region(frames, 0, end_frame, audio.FRAMES_PER_BUFFER)
+        current_frame = 0
+        for _ in range(callbacks):
+            (data, current_frame) = audio.extract_audio_data(frames, wrap, 0, end_frame, current_frame, audio.FRAMES_PER_BUFFER)
+    def play_stretched():
+        stretcher = stretch.TimeStretcher(frames, 0, song.buffer.shape[0], True)
+        stretcher.reset(0)
+        for _ in range(int(STRETCHED_SECONDS * song.sampling_rate * PLAY_RATE) // audio.FRAMES_PER_BUFFER):
+            stretcher.read(audio.FRAMES_PER_BUFFER, PLAY_RATE)
+    return {"playback": timed(play, repeats), "playback.stretched": timed(play_stretched, repeats)}
+
+# Pitch tracking: grouping GROUP_SECONDS of piptrack by note, and PITCH_BLOCKS blocks of each engine.
+def pitch(song, repeats):
+    audio_data = song.buffer.samples()
+    y = peaks.mono(audio_data[..., :GROUP_SECONDS * song.sampling_rate])
+    (pitches, magnitudes) = librosa.piptrack(y=y, sr=song.sampling_rate, threshold=PITCH_THRESHOLD)
+    results = {"pitch.group_by_note": timed(lambda: utils.group_by_note(pitches, magnitudes), repeats)}
+    for engine in notes.ENGINES:
+        count = notes.block_count(engine, song.buffer.shape[0], PITCH_WINDOW_WIDTH)
+        first = max(count // 2 - PITCH_BLOCKS // 2, 0)
+        blocks = range(first, min(first + PITCH_BLOCKS, count))
+        # Warm up librosa's caches, e.g. the constant-Q filters.
+        notes.analyze_block(engine, audio_data, song.sampling_rate, PITCH_THRESHOLD, PITCH_WINDOW_WIDTH, first)
+        results["pitch.blocks." + engine] = timed(lambda: [
+            notes.analyze_block(engine, audio_data, song.sampling_rate, PITCH_THRESHOLD, PITCH_WINDOW_WIDTH, index)
+            for index in blocks
+        ], repeats)
+    return results
+
+# Transcribing the whole song in this process.
+def transcribe(song, repeats):
+    return {"transcription": timed(lambda: transcription.transcribe_in_process(song.buffer, song.sampling_rate), repeats)}
+
+# Opening the song's file in the main window: until it's playable, i.e. load returns, and until it's
+# completely decoded and summarized. Cold loads start from an empty cache, cached ones don't.
+def load(song, repeats):
+    app = QApplication.instance()
+    window = main_window.MainWindow(audio.AudioPlayer())
+    window.resize(VIEW_WIDTH, VIEW_HEIGHT)
+    window.show()
+    path = song.wav()
+    def run(playable_times, complete_times):
+        start = time.perf_counter()
+        window.load(path)
+        playable_times.append(time.perf_counter() - start)
+        while window.load_pipeline is not None:
+            app.processEvents()
+            time.sleep(0.001)
+        complete_times.append(time.perf_counter() - start)
+    results = {"load.cold.playable": [], "load.cold.complete": [], "load.cached.playable": [], "load.cached.complete": []}
+    # The first load in a process also pays for lazy imports and the like.
+    run([], [])
+    for _ in range(repeats):
+        window.pcm_cache.prune(0)
+        run(results["load.cold.playable"], results["load.cold.complete"])
+    for _ in range(repeats):
+        run(results["load.cached.playable"], results["load.cached.complete"])
+    window.close()
+    window.deleteLater()
+    app.processEvents()
+    return results
+
+# Cases by the name they're selected with.
+CASES = {
+    "decode": decode,
+    "peaks": peak_pyramid,
+    "waveform": waveform_tiles,
+    "scene": scene,
+    "playback": playback,
+    "pitch": pitch,
+    "transcription": transcribe,
+    "load": load,
+}
+
+def git(*args):
+    try:
+        return subprocess.run(["git"] + list(args), cwd=REPOSITORY, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def environment():
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+        "numpy": numpy.__version__,
+        "librosa": librosa.__version__,
+    }
+
+def run(args):
+    app = QApplication([])
+    directory = tempfile.mkdtemp(prefix="noodler-benchmarks-")
+    # The main window caches decoded audio in the working directory.
+    working_directory = os.getcwd()
+    os.chdir(directory)
+    results = []
+    try:
+        for minutes in args.minutes:
+            for sampling_rate in args.rates:
+                for channels in args.channels:
+                    for signal in args.signals:
+                        song = Song(signal, minutes, sampling_rate, channels, directory)
+                        for case in args.cases:
+                            for (name, times) in CASES[case](song, args.repeats).items():
+                                result = dict(song.parameters(), case=name, seconds=times, best=min(times), median=statistics.median(times))
+                                results.append(result)
+                                print("{case:<22} {signal:<7} {minutes:>4} min {sampling_rate:>6} Hz {channels} ch {best:>10.4f} s".format(**result), file=sys.stderr)
+                        song.delete()
+    finally:
+        os.chdir(working_directory)
+        shutil.rmtree(directory, ignore_errors=True)
+    report = {"environment": environment(), "repeats": args.repeats, "results": results}
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+
+# Prints the best times of the cases in both reports side by side.
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    def key(result):
+        return (result["case"], result["signal"], result["minutes"], result["sampling_rate"], result["channels"])
+    old_results = {key(result): result for result in old["results"]}
+    print("{} -> {}".format((old["environment"]["commit"] or "?")[:10], (new["environment"]["commit"] or "?")[:10]))
+    for result in new["results"]:
+        if key(result) not in old_results:
+            continue
+        before = old_results[key(result)]["best"]
+        ratio = result["best"] / before if before > 0 else float("inf")
+        verdict = "slower" if ratio > SLOWER else "faster" if ratio < FASTER else ""
+        print("{case:<22} {signal:<7} {minutes:>4} min {sampling_rate:>6} Hz {channels} ch".format(**result), "{:>10.4f} {:>10.4f} {:>6.2f}x {}".format(before, result["best"], ratio, verdict))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--signals", nargs="+", choices=list(SIGNALS), default=list(SIGNALS))
+    parser.add_argument("--rates", nargs="+", type=int, default=[44100, 48000])
+    parser.add_argument("--channels", nargs="+", type=int, default=[1, 2])
+    parser.add_argument("--minutes", nargs="+", type=float, default=[1])
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES))
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", help="write the results here rather than to standard output")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two results files instead of running")
+    args = parser.parse_args()
+    if args.compare is not None:
+        compare(*args.compare)
+    else:
+        run(args)
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
-from PyQt6.QtWidgets import QApplication
-from noodler import audio
-from noodler import gui
+import argparse
+import sys
+
+def run_gui():
+    from PyQt6.QtWidgets import QApplication
+    from noodler import audio
+    from noodler import gui
 
-if __name__ == '__main__':
     audio_player = audio.AudioPlayer()
     audio_player.start()
 
@@ -10,4 +13,20 @@ if __name__ == '__main__':
     app.setStyle('macos')
     window = gui.MainWindow(audio_player)
     window.show()
-    app.exec()
\ No newline at end of file
+    app.exec()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog="noodler")
+    commands = parser.add_subparsers(dest="command")
+    analyze_parser = commands.add_parser(
+        "analyze",
+        help="decode and analyze every audio file in a directory ahead of time, without opening a window",
+    )
+    analyze_parser.add_argument("directory")
+    analyze_parser.add_argument("--workers", "-j", type=int, default=None, help="worker processes (default: one per CPU)")
+    args = parser.parse_args()
+
+    if args.command == "analyze":
+        from noodler.audio import library
+        sys.exit(1 if library.analyze(args.directory, args.workers) > 0 else 0)
+    run_gui()
@@ -1,32 +1,48 @@
 from multiprocessing import Process, Queue
-import queue
+from multiprocessing.sharedctypes import RawArray
 import librosa
 import pyaudio
 import numpy
-from threading import Thread
 import time
+from .pcm import PcmBuffer
+from .stretch import TimeStretcher
+
+# The number of frames requested by each PortAudio callback. Fixing it lets the audio process prepare
+# everything the callback needs ahead of time.
+FRAMES_PER_BUFFER = 1024
 
 # Audio is played in a separate process to ensure that playback is not impacted
 # by the UI. If audio is played from the same process as the UI, certain expensive operations
 # (like zooming in on the waveform) can cause the playback to stutter.
 
-# AudioState is the state required by the audio system to play audio.
+# AudioState is the state required by the audio system to play audio. It only describes where the
+# samples live (see PcmBuffer), so it stays small no matter how long the song is.
 class AudioState:
-    def __init__(self, data = None, sampling_rate = None, play_rate = None):
-        # This object can get quite big. If that's a problem, we'll instead transmit the filename.
-        # In that case, the audio process will need to be responsible for modifications, e.g. play rate.
-        self.data = data 
+    def __init__(self, path, shape, dtype, sampling_rate, play_rate, generation):
+        self.path = path
+        self.shape = shape
+        self.dtype = dtype
         self.sampling_rate = sampling_rate
+        # The play rate is applied while playing (see TimeStretcher), so it can be changed without
+        # replacing the audio, and takes effect immediately even during playback.
         self.play_rate = play_rate
+        # Incremented every time the GUI process sets new audio, so that the audio process can tell
+        # states apart.
+        self.generation = generation
+
+    def open(self):
+        return PcmBuffer.open(self.path, self.shape, self.dtype)
 
 class PlayAudioCommand:
     TYPE = "play"
 
-    def __init__(self, start_timestamp, end_timestamp, current_timestamp, loop = True):
+    def __init__(self, start_timestamp, end_timestamp, current_timestamp, loop = True, generation = 0):
         self.start_timestamp = start_timestamp
         self.end_timestamp = end_timestamp
         self.current_timestamp = current_timestamp
         self.loop = loop
+        # Identifies this playback in the PlaybackPosition published by the audio process.
+        self.generation = generation
 
     def type(self):
         return PlayAudioCommand.TYPE
@@ -43,70 +59,210 @@ class RestartAudioCommand:
     def type(self):
         return RestartAudioCommand.TYPE
 
-# PlaybackState is the state of active audio playback which can be sent from the audio process back to the GUI process
-# for UI purposes.
-class PlaybackState:
-    def __init__(self, timestamp, playing):
-        self.timestamp = timestamp
+class SetPlayRateCommand:
+    TYPE = "set_play_rate"
+
+    def __init__(self, play_rate):
+        self.play_rate = play_rate
 
-        # This is needed so that the audio process can communicate that audio has stopped playing, e.g.
-        # when it reaches the end of the loop but looping is disabled.
-        self.playing = playing
+    def type(self):
+        return SetPlayRateCommand.TYPE
 
-class AudioPlayer:
+class SetAudioStateCommand:
+    TYPE = "set_audio_state"
+
+    def __init__(self, audio_state):
+        self.audio_state = audio_state
+
+    def type(self):
+        return SetAudioStateCommand.TYPE
+
+# PlaybackPosition is the state of active audio playback, published by the audio process on every
+# callback and read directly by the GUI process for UI purposes, e.g. to move the cursor. It lives in
+# shared memory, so publishing it doesn't involve any IPC objects.
+#
+# The values are guarded by a sequence counter (a seqlock): the writer makes the counter odd while it
+# writes, and readers retry if the counter was odd or changed while they were reading.
+class PlaybackPosition:
+    SEQUENCE = 0
+    GENERATION = 1
+    # The first frame of the buffer most recently handed to PortAudio.
+    FRAME = 2
+    # This is needed so that the audio process can communicate that audio has stopped playing, e.g.
+    # when it reaches the end of the loop but looping is disabled.
+    PLAYING = 3
+    # time.monotonic() when FRAME was published, and how long after that it reaches the DAC according
+    # to PortAudio. time.monotonic() is system-wide, so it can be compared across processes.
+    PUBLISHED_AT = 4
+    OUTPUT_LATENCY = 5
+    SIZE = 6
 
     def __init__(self):
-        # The audio state queue is only ever written to by the GUI process and only ever read from
-        # by the audio process to determine the state necessary to play audio.
-        self.audio_state_queue = Queue()
+        self.values = RawArray("d", PlaybackPosition.SIZE)
+
+    def publish(self, generation, frame, playing, output_latency):
+        values = self.values
+        values[PlaybackPosition.SEQUENCE] += 1
+        values[PlaybackPosition.GENERATION] = generation
+        values[PlaybackPosition.FRAME] = frame
+        values[PlaybackPosition.PLAYING] = 1.0 if playing else 0.0
+        values[PlaybackPosition.PUBLISHED_AT] = time.monotonic()
+        values[PlaybackPosition.OUTPUT_LATENCY] = output_latency
+        values[PlaybackPosition.SEQUENCE] += 1
+
+    # Returns a consistent snapshot of the values, indexed like the constants above.
+    def read(self):
+        values = self.values
+        while True:
+            sequence = values[PlaybackPosition.SEQUENCE]
+            snapshot = values[:]
+            if sequence % 2 == 0 and values[PlaybackPosition.SEQUENCE] == sequence:
+                return snapshot
 
+class AudioPlayer:
+
+    def __init__(self):
         # The audio command queue is used by the GUI process to tell the audio process to play, stop,
-        # etc. the audio.
+        # etc. the audio, and to hand it new audio state. It's the only input of the audio process,
+        # which lets the audio process block on it rather than poll, and keeps state updates ordered
+        # with respect to the commands that depend on them.
         self.audio_command_queue = Queue()
 
-        # The playback state queue is only ever written to by the audio process and only ever read from
-        # by the GUI process to update the UI based on audio playback, e.g. move the cursor based on the 
+        # The playback position is only ever written to by the audio process and only ever read from
+        # by the GUI process to update the UI based on audio playback, e.g. move the cursor based on the
         # playback timestamp.
-        self.playback_state_queue = Queue()
+        self.playback_position = PlaybackPosition()
 
         # These values are set by the GUI process, and will eventually be propagated to the audio process.
         # There's no guarantee that these values are the same values currently being used by the audio
         # process. 
         self.audio_state = None
+        self.audio_buffer = None
+        self.owns_audio_buffer = False
+        self.generation = 0
         self.start_timestamp = None
         self.end_timestamp = None
 
         # This value can be set by the GUI process. Its value will be propagated to the audio process when audio playback begins.
-        # While audio playback is occurring, this value will be updated by the audio process.
-        self.current_timestamp = None
+        # While audio playback is occurring, reading it returns the position published by the audio process.
+        self._current_timestamp = None
 
         self.ready = False
-        self.playing = False
+        self._playing = False
         self.loop = True
 
+        # Incremented on every play command, so that positions published for an earlier playback
+        # aren't mistaken for the current one.
+        self.playback_generation = 0
+        self.playback_command = None
+
     def start(self):
-        p = Process(target=audio_process, args=(self.audio_state_queue, self.audio_command_queue, self.playback_state_queue))
+        p = Process(target=audio_process, args=(self.audio_command_queue, self.playback_position))
         p.start()
 
-        t = Thread(target=self._playback_state_worker, args=[])
-        t.start()
-
-    def _playback_state_worker(self):
-        while True:
-            playback_state = get_if_present(self.playback_state_queue)
-            if playback_state != None:
-                if self.playing and not playback_state.playing:
-                    self.playing = False
-                self.current_timestamp = playback_state.timestamp
-            time.sleep(0.02)
+    @property
+    def playing(self):
+        self._update_playback_state()
+        return self._playing
+
+    @playing.setter
+    def playing(self, playing):
+        self._playing = playing
+
+    @property
+    def current_timestamp(self):
+        if self._playing:
+            timestamp = self._extrapolate_timestamp()
+            if timestamp is not None:
+                return timestamp
+        return self._current_timestamp
+
+    @current_timestamp.setter
+    def current_timestamp(self, current_timestamp):
+        self._current_timestamp = current_timestamp
+
+    # Picks up the end of playback if the audio process stopped on its own, i.e. because it reached the
+    # end of the selection with looping disabled.
+    def _update_playback_state(self):
+        if not self._playing:
+            return
+        values = self.playback_position.read()
+        if values[PlaybackPosition.GENERATION] == self.playback_generation and not values[PlaybackPosition.PLAYING]:
+            self._playing = False
+            self._current_timestamp = self.playback_command.start_timestamp
+
+    # Estimates the timestamp that is audible right now from the most recently published position.
+    # Returns None if the audio process hasn't published anything for the current playback yet.
+    def _extrapolate_timestamp(self):
+        values = self.playback_position.read()
+        if values[PlaybackPosition.GENERATION] != self.playback_generation:
+            return None
+        command = self.playback_command
+        if not values[PlaybackPosition.PLAYING]:
+            return command.start_timestamp
+        audible_at = values[PlaybackPosition.PUBLISHED_AT] + values[PlaybackPosition.OUTPUT_LATENCY]
+        timestamp = librosa.samples_to_time(values[PlaybackPosition.FRAME], sr=self.audio_state.sampling_rate)
+        timestamp += (time.monotonic() - audible_at) * self.audio_state.play_rate
+        if timestamp < command.start_timestamp:
+            return command.start_timestamp
+        if timestamp >= command.end_timestamp:
+            loop_width = command.end_timestamp - command.start_timestamp
+            if not command.loop or loop_width <= 0.0:
+                return command.end_timestamp
+            return command.start_timestamp + (timestamp - command.start_timestamp) % loop_width
+        return timestamp
 
     def set_audio_state(self, data, sampling_rate, play_rate):
-        self.audio_state = AudioState(data, sampling_rate, play_rate)
+        self.set_audio_buffer(PcmBuffer.create(data), sampling_rate, play_rate)
+        # Nobody else knows about this buffer, so it can be deleted once it's replaced.
+        self.owns_audio_buffer = True
+
+    # Like set_audio_state, but plays an existing buffer (which may still be filling up, see
+    # StreamingDecoder) rather than copying the audio.
+    def set_audio_buffer(self, audio_buffer, sampling_rate, play_rate):
+        self.replace_audio_buffer(audio_buffer, sampling_rate, play_rate)
         self.start_timestamp = 0.0
-        self.end_timestamp = librosa.get_duration(y=data, sr=sampling_rate) * play_rate
+        self.end_timestamp = self.audio_buffer.shape[0] / sampling_rate
         self.current_timestamp = 0.0
         self.ready = True
-        self.audio_state_queue.put(self.audio_state)
+
+    # Like set_audio_buffer, but keeps the selection and current timestamp, e.g. when switching
+    # between renders of the same song.
+    def replace_audio_buffer(self, audio_buffer, sampling_rate, play_rate):
+        # The previous buffer's file can go away immediately: anyone still using it (the audio process,
+        # or the GUI holding the unprocessed audio) keeps its mapping.
+        if self.audio_buffer is not None and self.owns_audio_buffer:
+            self.audio_buffer.delete()
+        rate_changed = self.audio_state is not None and self.audio_state.play_rate != play_rate
+        self.owns_audio_buffer = False
+        self.audio_buffer = audio_buffer
+        self.generation += 1
+        self.audio_state = AudioState(
+            self.audio_buffer.path,
+            self.audio_buffer.shape,
+            self.audio_buffer.dtype.str,
+            sampling_rate,
+            play_rate,
+            self.generation,
+        )
+        self.audio_command_queue.put(SetAudioStateCommand(self.audio_state))
+        if rate_changed:
+            # A new state only applies to the next stream, but the cursor follows the new rate right
+            # away, so the stream that's already playing has to as well.
+            self.audio_command_queue.put(SetPlayRateCommand(play_rate))
+
+    # Sends the current buffer to the audio process again after its file was moved, e.g. into the
+    # PcmCache (see PcmCache.store): if the audio process hadn't mapped it before, it couldn't find it.
+    def audio_buffer_moved(self):
+        owns_audio_buffer = self.owns_audio_buffer
+        # It's the same buffer, so it must not be deleted as the one being replaced.
+        self.owns_audio_buffer = False
+        self.replace_audio_buffer(self.audio_buffer, self.audio_state.sampling_rate, self.audio_state.play_rate)
+        self.owns_audio_buffer = owns_audio_buffer
+
+    def set_play_rate(self, play_rate):
+        self.audio_state.play_rate = play_rate
+        self.audio_command_queue.put(SetPlayRateCommand(play_rate))
 
     def set_start_timestamp(self, start_timestamp):
         self.start_timestamp = start_timestamp
@@ -133,24 +289,53 @@ class AudioPlayer:
         # These should probably be synchronized in some way, but it will be safe as long as 
         # AudioPlayer is only accessed from a single thread.
         self.playing = True
-        self.audio_command_queue.put(PlayAudioCommand(self.start_timestamp, self.end_timestamp, self.current_timestamp, self.loop))
+        self.playback_generation += 1
+        self.playback_command = PlayAudioCommand(
+            self.start_timestamp, 
+            self.end_timestamp, 
+            self.current_timestamp, 
+            self.loop, 
+            self.playback_generation,
+        )
+        self.audio_command_queue.put(self.playback_command)
 
     def stop(self):
+        # Keep the cursor where playback was stopped.
+        self._current_timestamp = self.current_timestamp
         self.playing = False
         self.audio_command_queue.put(StopAudioCommand())
 
     def restart(self):
         self.audio_command_queue.put(RestartAudioCommand())
 
-def audio_process(audio_state_queue: Queue, audio_command_queue: Queue, playback_state_queue: Queue):
+def audio_process(audio_command_queue: Queue, playback_position: PlaybackPosition):
 
     stream = None
+    play_command = None
     audio_state = None
+    audio_frames = None
+    # The state the open stream plays, which new audio states only replace for the next stream.
+    stream_state = None
 
     p = pyaudio.PyAudio()
     while True:
-        command = get_if_present(audio_command_queue)
-        if command is not None and audio_state is not None:
+        # Block until the GUI process has something for us. Playback itself happens on PortAudio's
+        # callback thread, so there's nothing to do here in the meantime.
+        command = audio_command_queue.get()
+        if command.type() == SetAudioStateCommand.TYPE:
+            try:
+                audio_frames = command.audio_state.open().frames
+                audio_state = command.audio_state
+            except FileNotFoundError:
+                # The GUI process already replaced this state and removed its file, or moved it (see
+                # AudioPlayer.audio_buffer_moved); either way, a newer state is next in the queue.
+                pass
+        elif audio_state is not None:
+            if command.type() == SetPlayRateCommand.TYPE:
+                # The callback of an open stream reads this on every buffer.
+                audio_state.play_rate = command.play_rate
+                if stream_state is not None:
+                    stream_state.play_rate = command.play_rate
             if command.type() == StopAudioCommand.TYPE:
                 if stream is not None:
                     stream.close()
@@ -160,76 +345,98 @@ def audio_process(audio_state_queue: Queue, audio_command_queue: Queue, playback
                     stream.close()
                     stream = play_internal(
                         p, 
-                        playback_state_queue, 
-                        command.start_timestamp, 
-                        command.end_timestamp, 
-                        command.current_timestamp, 
+                        playback_position, 
+                        play_command.start_timestamp, 
+                        play_command.end_timestamp, 
+                        play_command.start_timestamp, 
+                        play_command.loop,
                         audio_state,
+                        audio_frames,
+                        play_command.generation,
                     )
+                    stream_state = audio_state
             if command.type() == PlayAudioCommand.TYPE:
+                play_command = command
                 stream = play_internal(
                     p, 
-                    playback_state_queue, 
+                    playback_position, 
                     command.start_timestamp, 
                     command.end_timestamp, 
                     command.current_timestamp, 
                     command.loop,
                     audio_state,
+                    audio_frames,
+                    command.generation,
                 )
-        update = get_if_present(audio_state_queue)
-        if update is not None:
-            audio_state = update
+                stream_state = audio_state
     p.terminate()
 
-def get_if_present(q):
-    try:
-        return q.get_nowait()
-    except queue.Empty:
-        return None
-
-def play_internal(p, playback_queue, start_timestamp, end_timestamp, current_timestamp, loop, audio_state):
-    current_frame = librosa.time_to_samples(current_timestamp / audio_state.play_rate, sr=audio_state.sampling_rate)
+def play_internal(p, playback_position, start_timestamp, end_timestamp, current_timestamp, loop, audio_state, audio_frames, generation):
+    # The loop bounds can't change while a stream is open, so everything derived from them is computed
+    # here rather than in the callback.
+    frame_total = audio_frames.shape[0]
+    start_frame = min(librosa.time_to_samples(start_timestamp, sr=audio_state.sampling_rate), frame_total)
+    end_frame = min(librosa.time_to_samples(end_timestamp, sr=audio_state.sampling_rate), frame_total)
+    current_frame = librosa.time_to_samples(current_timestamp, sr=audio_state.sampling_rate)
+    wrap = create_wrap_region(audio_frames, start_frame, end_frame, FRAMES_PER_BUFFER) if loop else None
+    stretcher = TimeStretcher(audio_frames, start_frame, end_frame, loop)
+    stretching = False
     def pyaudio_callback(in_data, frame_count, time_info, status):
-        nonlocal audio_state, start_timestamp, end_timestamp, current_timestamp, current_frame
-        start_frame = librosa.time_to_samples(start_timestamp / audio_state.play_rate, sr=audio_state.sampling_rate)
-        if current_frame < start_frame:
-            # a bit hacky, we can't have other classes write to current_frame while music is playing
-            # but we want to ensure that it's updated if e.g. the loop shifts
+        nonlocal current_frame, stretching
+        # Some host APIs don't report timing information, in which case this is just 0.
+        output_latency = min(max(time_info["output_buffer_dac_time"] - time_info["current_time"], 0.0), 1.0)
+        if abs(audio_state.play_rate - 1.0) > 0.01:
+            # The stretcher allocates, but at normal speed playback stays on the allocation-free path below.
+            if not stretching:
+                stretcher.reset(max(current_frame, start_frame))
+                stretching = True
+            (data, buffer_frame) = stretcher.read(frame_count, audio_state.play_rate)
+            if stretcher.finished():
+                playback_position.publish(generation, buffer_frame, False, output_latency)
+                return (data, pyaudio.paComplete)
+            playback_position.publish(generation, buffer_frame, True, output_latency)
+            return (data, pyaudio.paContinue)
+        if stretching:
+            current_frame = int(stretcher.position())
+            stretching = False
+        if current_frame < start_frame or (wrap is not None and current_frame >= end_frame):
             current_frame = start_frame
-        end_frame = librosa.time_to_samples(end_timestamp / audio_state.play_rate, sr=audio_state.sampling_rate)
-        (data, current_frame) = extract_audio_data(audio_state.data, start_frame, end_frame, current_frame, frame_count, loop)
-        current_timestamp = librosa.samples_to_time(current_frame, sr=audio_state.sampling_rate) * audio_state.play_rate
+        buffer_frame = current_frame
+        (data, current_frame) = extract_audio_data(audio_frames, wrap, start_frame, end_frame, current_frame, frame_count)
         if current_frame >= end_frame:
-            playback_queue.put(PlaybackState(start_timestamp, False))
-        elif playback_queue.empty():
-            playback_queue.put(PlaybackState(current_timestamp, True))
-        status = pyaudio.paContinue
-        return (data, status)
-    stream = p.open(rate=audio_state.sampling_rate, channels=len(audio_state.data.shape), format=pyaudio.paFloat32, output=True, stream_callback=pyaudio_callback)
+            playback_position.publish(generation, buffer_frame, False, output_latency)
+            return (data, pyaudio.paComplete)
+        playback_position.publish(generation, buffer_frame, True, output_latency)
+        return (data, pyaudio.paContinue)
+    stream = p.open(
+        rate=audio_state.sampling_rate,
+        channels=audio_frames.shape[1],
+        format=pyaudio.paFloat32,
+        output=True,
+        frames_per_buffer=FRAMES_PER_BUFFER,
+        stream_callback=pyaudio_callback,
+    )
     return stream
 
-def extract_audio_data(data, start_frame, end_frame, current_frame, frame_count, loop):
-    if len(data.shape) == 1:
-        return extract_audio_data_mono(data, start_frame, end_frame, current_frame, frame_count, loop)
-    else:
-        (left, _) = extract_audio_data_mono(data[0], start_frame, end_frame, current_frame, frame_count, loop)
-        (right, current_frame) = extract_audio_data_mono(data[1], start_frame, end_frame, current_frame, frame_count, loop)
-        result = numpy.empty((left.size + right.size,), dtype=left.dtype)
-        result[0::2] = left
-        result[1::2] = right
-        return (result, current_frame)
-
-def extract_audio_data_mono(data, start_frame, end_frame, current_frame, frame_count, loop):
-    new_start_frame = current_frame + frame_count
-    extracted_data = []
-    if end_frame != None and new_start_frame >= end_frame:
-        if loop:
-            extracted_data = numpy.concatenate((data[current_frame:end_frame], data[start_frame:(start_frame + new_start_frame - end_frame)]))
-            current_frame = start_frame + new_start_frame - end_frame
-        else:
-            extracted_data = data[current_frame:end_frame]
-            current_frame = end_frame
-    else:
-        extracted_data = data[current_frame:new_start_frame]
-        current_frame += frame_count
-    return (extracted_data, current_frame)
\ No newline at end of file
+# The wrap region holds the frames played around the loop boundary: wrap[i] is the frame played i frames
+# after end_frame - size. With it, a buffer that crosses the boundary is still a single contiguous slice.
+# Returns None if the loop is empty.
+def create_wrap_region(frames, start_frame, end_frame, size):
+    loop_length = end_frame - start_frame
+    if loop_length <= 0:
+        return None
+    indices = numpy.arange(end_frame - size, end_frame + size)
+    return frames.take(start_frame + (indices - start_frame) % loop_length, axis=0)
+
+# Returns (data, current_frame), where data is a view of at most frame_count interleaved frames and
+# current_frame is the frame to continue from. This is called from the PortAudio callback, so it must not
+# copy or allocate sample data. Loops if a wrap region (see create_wrap_region) is given.
+def extract_audio_data(frames, wrap, start_frame, end_frame, current_frame, frame_count):
+    new_current_frame = current_frame + frame_count
+    if new_current_frame < end_frame:
+        return (frames[current_frame:new_current_frame], new_current_frame)
+    if wrap is None:
+        return (frames[current_frame:end_frame], end_frame)
+    offset = current_frame - (end_frame - len(wrap) // 2)
+    new_current_frame = start_frame + (new_current_frame - start_frame) % (end_frame - start_frame)
+    return (wrap[offset:offset + frame_count], new_current_frame)
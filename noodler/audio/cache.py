@@ -0,0 +1,285 @@
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import time
+import numpy
+from .pcm import PcmBuffer
+
+try:
+    import fcntl
+except ImportError:
+    # Windows.
+    fcntl = None
+    import msvcrt
+
+CACHE_PATH = "cache"
+
+# 4 GB, roughly 3 hours of 44.1 kHz stereo audio.
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024 * 1024
+
+# PcmCache keeps decoded audio on disk so that reopening a file maps the cached PcmBuffer instead of
+# decoding it again. Entries are keyed by a hash of the file's contents (see key), so moving or touching
+# a file doesn't invalidate them; the hash itself is remembered per (path, size, mtime) so that it only
+# has to be computed once. Audio derived from a file, e.g. by effects, can be cached under keys that
+# extend the file's key.
+#
+# The cache is bounded by max_bytes. When it grows past that, the least recently used entries are
+# evicted.
+#
+# Several processes can use the same cache directory at once, e.g. the window and a library analysis
+# (see library.analyze). Each change to the index is made while holding a lock on a lock file, to the
+# index as it's on disk at the time, so that no process undoes another's changes or removes files it
+# doesn't know about yet. The lock file itself stays; the operating system releases the lock when its
+# holder exits, even if it dies while holding it.
+class PcmCache:
+    INDEX_FILE = "index.json"
+    LOCK_FILE = "index.lock"
+    # Audio reserved by another process and not written to for this long was left behind by a process
+    # that died before storing it.
+    STALE_RESERVATION_SECONDS = 24 * 60 * 60.0
+
+    def __init__(self, directory = CACHE_PATH, max_bytes = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.index = None
+        # Identifies the version of the index file that self.index was loaded from.
+        self.index_stamp = None
+        self._refresh_index()
+        # Paths returned by reserve that haven't been stored yet.
+        self.reserved = set()
+
+    # Returns the key under which the decoded contents of path are cached. The first time a file is
+    # seen, this reads all of it; see known_key and content_key to do that in the background.
+    def key(self, path):
+        key = self.known_key(path)
+        if key is None:
+            key = content_key(path)
+            self.remember_key(path, key)
+        return key
+
+    # Returns the key of path if it was computed before and the file hasn't changed since, or None.
+    def known_key(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        self._refresh_index()
+        known = self.index["files"].get(path)
+        if known is not None and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime:
+            return known["key"]
+        return None
+
+    # Remembers key, from content_key, as the key of path, so that it doesn't have to be computed again.
+    def remember_key(self, path, key):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self._updating_index() as index:
+            index["files"][path] = {"size": stat.st_size, "mtime": stat.st_mtime, "key": key}
+
+    # Returns a key for path that only depends on its path, size and mtime, which is cheap to compute.
+    # Audio decoded from path can be reserved under it until its actual key is known.
+    def provisional_key(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        return hashlib.sha256("{}\0{}\0{}".format(path, stat.st_size, stat.st_mtime).encode("utf-8")).hexdigest()
+
+    # Returns (buffer, sampling_rate) for the audio cached under key, or None if it isn't cached.
+    def open(self, key):
+        with self._updating_index() as index:
+            entry = index["entries"].get(key)
+            if entry is None or not os.path.exists(self._pcm_path(key)):
+                return None
+            entry["last_used"] = time.time()
+            return (PcmBuffer.open(self._pcm_path(key), entry["shape"], numpy.float32), entry["sampling_rate"])
+
+    # Returns a new path that the audio to be cached under key should be written to, e.g. by a decoder.
+    # It only becomes a cache entry once it's passed to store, e.g. after decoding completed. Until then,
+    # a cached copy that is already in use is never overwritten.
+    def reserve(self, key):
+        fd, reserved_path = tempfile.mkstemp(prefix=key + ".", suffix=".partial", dir=self.directory)
+        os.close(fd)
+        self.reserved.add(reserved_path)
+        return reserved_path
+
+    # Adds buffer, which must have been allocated at a path returned by reserve, to the cache.
+    def store(self, key, buffer, sampling_rate):
+        # Under the lock, so that no other process sees the file before its entry, and removes it.
+        with self._updating_index() as index:
+            try:
+                # Mappings follow the file, so this doesn't disturb anyone already using the buffer.
+                os.replace(buffer.path, self._pcm_path(key))
+            except OSError:
+                # Windows can't rename a file that's mapped. The audio just won't be cached.
+                return
+            self.reserved.discard(buffer.path)
+            buffer.path = self._pcm_path(key)
+            index["entries"][key] = {
+                "shape": list(buffer.shape),
+                "sampling_rate": sampling_rate,
+                "bytes": os.path.getsize(buffer.path),
+                "last_used": time.time(),
+            }
+            # Keep the audio key was derived from as well, e.g. the song a render is of.
+            self._prune(index, self.max_bytes, source_key(key))
+
+    # Returns the path of a file named name that belongs to the entry for key, e.g. data computed from
+    # the cached audio, to be written by the caller. It's removed along with the entry. Returns None if
+    # there's no entry for key.
+    def attach(self, key, name):
+        with self._updating_index() as index:
+            entry = index["entries"].get(key)
+            if entry is None:
+                return None
+            if name not in entry.setdefault("attachments", []):
+                entry["attachments"].append(name)
+            return self._attachment_path(key, name)
+
+    # Returns the path of the file attached to the entry for key under name, or None if there is none.
+    def attachment(self, key, name):
+        self._refresh_index()
+        entry = self.index["entries"].get(key)
+        if entry is None or name not in entry.get("attachments", []) or not os.path.exists(self._attachment_path(key, name)):
+            return None
+        return self._attachment_path(key, name)
+
+    # Evicts least recently used entries until the cache takes up at most max_bytes, never evicting
+    # the entry for keep or audio derived from it. Also removes audio that was reserved but never
+    # stored, e.g. because decoding was cancelled: that reserved through this PcmCache right away, and
+    # that of other processes once it's stale.
+    def prune(self, max_bytes, keep = None):
+        with self._updating_index() as index:
+            self._prune(index, max_bytes, keep)
+
+    def _prune(self, index, max_bytes, keep):
+        entries = index["entries"]
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".partial"):
+                # See reserve.
+                key = name.rsplit(".", 2)[0]
+                if self._kept(key, keep):
+                    continue
+                if path in self.reserved:
+                    self.reserved.discard(path)
+                    self._remove_file(path)
+                elif self._stale(path, PcmCache.STALE_RESERVATION_SECONDS):
+                    self._remove_file(path)
+            elif name.endswith(".pcm"):
+                key = name[:-len(".pcm")]
+                if not self._kept(key, keep) and key not in entries:
+                    self._remove_file(path)
+        total = sum(entry["bytes"] for entry in entries.values())
+        for key in sorted(entries, key=lambda key: entries[key]["last_used"]):
+            if total <= max_bytes:
+                break
+            if self._kept(key, keep):
+                continue
+            total -= entries[key]["bytes"]
+            for name in entries[key].get("attachments", []):
+                self._remove_file(self._attachment_path(key, name))
+            del entries[key]
+            self._remove_file(self._pcm_path(key))
+        index["files"] = {path: known for (path, known) in index["files"].items() if os.path.exists(path)}
+
+    def size(self):
+        self._refresh_index()
+        return sum(entry["bytes"] for entry in self.index["entries"].values())
+
+    def _kept(self, key, keep):
+        return keep is not None and (key == keep or key.startswith(keep + "-"))
+
+    def _pcm_path(self, key):
+        return os.path.join(self.directory, key + ".pcm")
+
+    def _attachment_path(self, key, name):
+        return os.path.join(self.directory, key + "." + name)
+
+    def _remove_file(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            # Still mapped on Windows; the next prune will try again.
+            pass
+
+    # Whether the file at path was last modified more than seconds ago. A file that's gone isn't.
+    def _stale(self, path, seconds):
+        try:
+            return time.time() - os.path.getmtime(path) > seconds
+        except OSError:
+            return False
+
+    # Loads the index again if another process (or PcmCache) changed it since it was last loaded.
+    def _refresh_index(self):
+        try:
+            stat = os.stat(os.path.join(self.directory, PcmCache.INDEX_FILE))
+            stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            stamp = None
+        if self.index is None or stamp != self.index_stamp:
+            self.index = self._load_index()
+            self.index_stamp = stamp
+
+    # Holds the lock while the index as it's on disk is changed, then saves it. Yields the index.
+    @contextlib.contextmanager
+    def _updating_index(self):
+        with self._index_lock():
+            self._refresh_index()
+            yield self.index
+            self._save_index()
+
+    @contextlib.contextmanager
+    def _index_lock(self):
+        fd = os.open(os.path.join(self.directory, PcmCache.LOCK_FILE), os.O_CREAT | os.O_RDWR)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            else:
+                while True:
+                    try:
+                        # Locks the file's first byte, waiting up to 10 seconds for it.
+                        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        pass
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                else:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(fd)
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self.directory, PcmCache.INDEX_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"files": {}, "entries": {}}
+
+    def _save_index(self):
+        # Write to a temporary file first so that a crash can't leave a half-written index behind.
+        index_path = os.path.join(self.directory, PcmCache.INDEX_FILE)
+        with open(index_path + ".tmp", "w") as f:
+            json.dump(self.index, f)
+        os.replace(index_path + ".tmp", index_path)
+        stat = os.stat(index_path)
+        self.index_stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+# Returns the key of the contents of the file at path (see PcmCache.key). This reads the whole file, but
+# doesn't touch the cache, so it can run on any thread.
+def content_key(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Returns the key of the file that the audio cached under key was derived from (see render.render_key), which
+# is key itself for a file's own audio.
+def source_key(key):
+    return key.split("-", 1)[0]
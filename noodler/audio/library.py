@@ -0,0 +1,169 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import librosa
+import numpy
+import os
+import shutil
+import tempfile
+import time
+from . import source, transcription
+from .cache import PcmCache, content_key
+from .pcm import PcmBuffer
+from .peaks import PeakPyramid
+
+# Analyzing a library precomputes, without a window or an audio device, what opening each song in it
+# would otherwise compute in the background: its decoded audio, PeakPyramid and transcription.
+# They're written to the PcmCache the window reads on open, so analyzed songs show up complete right
+# away.
+#
+# Songs are analyzed in parallel, one per worker process, as are the hashes of files the cache hasn't
+# seen yet (see PcmCache.key). Files that can't be read are reported and skipped. Workers only write
+# files in a staging
+# directory; the cache's index is only ever changed by the parent, which moves the files into the cache
+# as songs complete. Songs whose audio and attachments are all cached already are skipped, so running
+# an analysis again only picks up new or changed files.
+
+# The name under which a song's PeakPyramid is attached to its entry in the PcmCache.
+PEAKS_ATTACHMENT = "peaks.npz"
+# The same for its transcription.NoteIndex.
+NOTES_ATTACHMENT = "notes.npz"
+
+ATTACHMENTS = [PEAKS_ATTACHMENT, NOTES_ATTACHMENT]
+
+AUDIO_EXTENSIONS = (".aac", ".aiff", ".flac", ".m4a", ".mp3", ".mp4", ".ogg", ".wav")
+
+# Returns the paths of the audio files in and below directory, in order.
+def find_audio_files(directory):
+    paths = []
+    for (root, directories, names) in os.walk(directory):
+        directories.sort()
+        paths.extend(os.path.join(root, name) for name in sorted(names) if name.lower().endswith(AUDIO_EXTENSIONS))
+    return paths
+
+# Computes the attachments named in missing for the song at path, in a worker process. If shape is
+# None, the song is decoded to pcm_path first; otherwise its audio is already there. Attachments are
+# written to staging_directory. Returns (shape, sampling_rate, attachments), where attachments maps
+# each name in missing to the file it was written to.
+def analyze_file(path, pcm_path, shape, sampling_rate, missing, staging_directory):
+    if shape is None:
+        try:
+            decoder = source.StreamingDecoder(path, pcm_path)
+        except source.StreamingDecoder.UNSTREAMABLE:
+            audio_data, sampling_rate = librosa.load(path, sr=None, mono=False)
+            buffer = PcmBuffer.create_at(pcm_path, audio_data)
+        else:
+            decoder.start()
+            # Raises if decoding failed, so that the song is reported as failed rather than cached
+            # truncated.
+            decoder.wait()
+            buffer = decoder.buffer
+            sampling_rate = decoder.sampling_rate
+    else:
+        buffer = PcmBuffer.open(pcm_path, shape, numpy.float32)
+    audio_data = buffer.samples()
+    prefix = os.path.join(staging_directory, os.path.basename(pcm_path) + ".")
+    attachments = {}
+    if PEAKS_ATTACHMENT in missing:
+        pyramid = PeakPyramid(buffer.shape[0])
+        pyramid.update(audio_data, buffer.shape[0])
+        attachments[PEAKS_ATTACHMENT] = prefix + PEAKS_ATTACHMENT
+        pyramid.save(attachments[PEAKS_ATTACHMENT])
+    if NOTES_ATTACHMENT in missing:
+        attachments[NOTES_ATTACHMENT] = prefix + NOTES_ATTACHMENT
+        transcription.transcribe_in_process(buffer, sampling_rate).save(attachments[NOTES_ATTACHMENT])
+    return (tuple(buffer.shape), sampling_rate, attachments)
+
+# Analyzes the audio files in and below directory with workers processes, printing progress and the
+# throughput as it goes. Returns the number of files that failed.
+def analyze(directory, workers = None, pcm_cache = None, log = print):
+    if pcm_cache is None:
+        pcm_cache = PcmCache()
+    started = time.perf_counter()
+    paths = find_audio_files(directory)
+    failed = 0
+    staging_directory = tempfile.mkdtemp(prefix="analyze-", dir=pcm_cache.directory)
+    analyzed = []
+    audio_seconds = 0.0
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            keys = {}
+            hashing = {}
+            for path in paths:
+                try:
+                    keys[path] = pcm_cache.known_key(path)
+                except OSError as e:
+                    log("{}: failed: {!r}".format(path, e))
+                    failed += 1
+                    continue
+                if keys[path] is None:
+                    hashing[pool.submit(content_key, path)] = path
+            for future in as_completed(hashing):
+                path = hashing[future]
+                try:
+                    keys[path] = future.result()
+                    pcm_cache.remember_key(path, keys[path])
+                except OSError as e:
+                    log("{}: failed: {!r}".format(path, e))
+                    failed += 1
+                    del keys[path]
+
+            # Keys of the songs to analyze, with the path and what to compute for each. Copies of the
+            # same file are analyzed once.
+            pending = {}
+            for path in paths:
+                key = keys.get(path)
+                if key is None or key in pending:
+                    continue
+                cached = pcm_cache.open(key)
+                missing = [name for name in ATTACHMENTS if pcm_cache.attachment(key, name) is None]
+                if cached is not None and not missing:
+                    continue
+                pending[key] = (path, cached, missing)
+            log("{} audio files, {} to analyze".format(len(paths), len(pending)))
+            if not pending:
+                return failed
+
+            analysis_started = time.perf_counter()
+            futures = {}
+            for (key, (path, cached, missing)) in pending.items():
+                if cached is None:
+                    # Staged rather than reserved, since every store prunes the cache's reserved files.
+                    (pcm_path, shape, sampling_rate) = (os.path.join(staging_directory, key + ".pcm"), None, None)
+                else:
+                    (pcm_path, shape, sampling_rate) = (cached[0].path, cached[0].shape, cached[1])
+                future = pool.submit(analyze_file, path, pcm_path, shape, sampling_rate, missing, staging_directory)
+                futures[future] = (key, path, pcm_path, cached is None)
+            for (done, future) in enumerate(as_completed(futures), 1):
+                (key, path, pcm_path, decoded) = futures[future]
+                try:
+                    (shape, sampling_rate, attachments) = future.result()
+                except Exception as e:
+                    # repr, since some exceptions, e.g. audioread's NoBackendError, have no message.
+                    log("[{}/{}] {}: failed: {!r}".format(done, len(futures), path, e))
+                    failed += 1
+                    continue
+                if decoded:
+                    pcm_cache.store(key, PcmBuffer.open(pcm_path, shape, numpy.float32), sampling_rate)
+                for (name, attachment_path) in attachments.items():
+                    cached_path = pcm_cache.attach(key, name)
+                    if cached_path is not None:
+                        os.replace(attachment_path, cached_path)
+                analyzed.append(key)
+                audio_seconds += shape[0] / sampling_rate
+                log("[{}/{}] {}: {}".format(done, len(futures), path, ", ".join(
+                    (["decoded"] if decoded else []) + [name.split(".")[0] for name in attachments]
+                )))
+    finally:
+        shutil.rmtree(staging_directory, ignore_errors=True)
+    elapsed = time.perf_counter() - analysis_started
+    log("Analyzed {} files ({:.0f} min of audio) in {:.1f} s: {:.2f} files/s, {:.1f}x real time; {:.1f} s in total".format(
+        len(analyzed),
+        audio_seconds / 60,
+        elapsed,
+        len(analyzed) / elapsed,
+        audio_seconds / elapsed,
+        time.perf_counter() - started,
+    ))
+    evicted = [key for key in analyzed if key not in pcm_cache.index["entries"]]
+    if evicted:
+        log("The cache is too small for the whole library; {} analyzed files were evicted again".format(len(evicted)))
+    return failed
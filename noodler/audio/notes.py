@@ -0,0 +1,112 @@
+import librosa
+import numpy
+from .peaks import mono
+from ..utils import utils
+
+# Pitch tracking by note, computed a block of frames at a time rather than for a whole song at once, so
+# that what's shown at any timestamp only costs the analysis of the block around it.
+#
+# Frames are numbered as in an analysis of the whole song: frame t is centered on sample
+# t * hop_length, and the song is padded with silence on both ends. The analysis itself is done by one
+# of the ENGINES.
+
+# Frames per block.
+BLOCK_FRAMES = 128
+
+# PiptrackEngine groups librosa's piptrack by note (see utils.group_by_note). Its frames are the same
+# as those of a piptrack of the whole song with librosa's defaults, since piptrack's threshold is
+# relative to each frame's own maximum.
+class PiptrackEngine:
+    # Frames whose loudest bin is below this are shown as quiet rather than scaled up.
+    QUIET = 50.0
+
+    def hop_length(self, window_width):
+        return window_width // 4
+
+    # Returns (notes, maxima) for frames [first, last), where notes[k, t] is the magnitude of note k
+    # (0 - 87) at frame first + t, and maxima[t] is the largest magnitude of any single frequency bin
+    # at that frame.
+    def analyze(self, audio_data, sr, threshold, window_width, first, last):
+        hop = self.hop_length(window_width)
+        start = first * hop - window_width // 2
+        samples = padded_mono(audio_data, start, start + (last - 1 - first) * hop + window_width)
+        pitches, magnitudes = librosa.piptrack(
+            y=samples,
+            sr=sr,
+            threshold=threshold,
+            n_fft=window_width,
+            win_length=window_width,
+            hop_length=hop,
+            center=False,
+        )
+        return (utils.group_by_note(pitches, magnitudes).astype(numpy.float32), magnitudes.max(axis=0))
+
+# ConstantQEngine uses a constant-Q transform with exactly one bin per piano key, so there's nothing to
+# group. Its filters get longer towards the bass, to resolve semitones there, so window_width only sets
+# the time between frames. Bins below threshold times the loudest bin of their frame are left out, as
+# with piptrack.
+class ConstantQEngine:
+    QUIET = 2.0
+    # librosa's CQT downsamples the audio an octave at a time, and the resampling filters reach this far
+    # beyond the CQT filters themselves.
+    RESAMPLING_MARGIN_SECONDS = 0.25
+
+    # The largest power of two up to a quarter of window_width, like piptrack's hop; librosa's CQT is
+    # much faster with those.
+    def hop_length(self, window_width):
+        return 1 << (max(window_width // 4, 1).bit_length() - 1)
+
+    def analyze(self, audio_data, sr, threshold, window_width, first, last):
+        hop = self.hop_length(window_width)
+        frequencies = librosa.midi_to_hz(utils.piano_key_to_midi(numpy.arange(88)))
+        # Analyze enough extra frames on either side for the longest filter and the resampling, so that
+        # the block's frames see the same audio as in a transform of the whole song. Near the ends of the
+        # song, the audio is cut off there rather than padded, so that librosa pads it (and resamples
+        # its edges) the same way as the whole song's.
+        (lengths, _) = librosa.filters.wavelet_lengths(freqs=frequencies, sr=sr)
+        margin = int(numpy.ceil((lengths.max() / 2 + ConstantQEngine.RESAMPLING_MARGIN_SECONDS * sr) / hop))
+        start = max(first - margin, 0)
+        samples = mono(audio_data[..., start * hop:(last + margin) * hop])
+        spectrum = numpy.abs(librosa.cqt(
+            samples,
+            sr=sr,
+            hop_length=hop,
+            fmin=frequencies[0],
+            n_bins=88,
+            bins_per_octave=12,
+        ))[:, first - start:last - start]
+        maxima = spectrum.max(axis=0)
+        spectrum[spectrum < threshold * maxima] = 0.0
+        return (spectrum.astype(numpy.float32), maxima)
+
+# Pitch analysis engines, by the name the pitch tracking dock shows them under.
+ENGINES = {
+    "piptrack": PiptrackEngine(),
+    "cqt": ConstantQEngine(),
+}
+
+# Returns the number of frames engine computes for a song of audio_frame_count frames.
+def frame_count(engine, audio_frame_count, window_width):
+    return 1 + audio_frame_count // ENGINES[engine].hop_length(window_width)
+
+# Returns the frame that's centered closest to timestamp.
+def frame_at(engine, timestamp, sr, window_width):
+    return int(timestamp * sr / ENGINES[engine].hop_length(window_width) + 0.5)
+
+def block_count(engine, audio_frame_count, window_width):
+    return -(-frame_count(engine, audio_frame_count, window_width) // BLOCK_FRAMES)
+
+# Pitch-tracks block index of audio_data (in librosa's layout) with engine. Returns (notes, maxima) as
+# from the engine's analyze. Doesn't use anything tied to the GUI thread.
+def analyze_block(engine, audio_data, sr, threshold, window_width, index):
+    first = index * BLOCK_FRAMES
+    last = min(first + BLOCK_FRAMES, frame_count(engine, audio_data.shape[-1], window_width))
+    return ENGINES[engine].analyze(audio_data, sr, threshold, window_width, first, last)
+
+# Returns the mono mix of audio_data's frames [start, end), with silence where they reach past either
+# end of it.
+def padded_mono(audio_data, start, end):
+    audio_frame_count = audio_data.shape[-1]
+    samples = numpy.zeros(end - start, dtype=numpy.float32)
+    samples[max(-start, 0):max(min(end, audio_frame_count) - start, 0)] = mono(audio_data[..., max(start, 0):max(min(end, audio_frame_count), 0)])
+    return samples
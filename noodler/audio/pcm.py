@@ -0,0 +1,109 @@
+import atexit
+import numpy
+import os
+import tempfile
+
+# Every buffer file starts with a small header. Its first value is the number of frames that have been
+# written so far, which lets a buffer be played and displayed while it's still being filled.
+HEADER_SIZE = 64
+AVAILABLE_FRAMES = 0
+
+# Paths of the temporary buffers this process created and hasn't deleted yet. They're song-sized, so
+# whatever is left of them is removed when the process exits (see remove_temporary_files).
+temporary_paths = set()
+
+# PcmBuffer holds decoded audio in a memory-mapped file. The GUI process writes the samples once and
+# the audio process maps the same file, so only a small descriptor (see AudioState) ever has to cross
+# the process boundary. Both processes share the same pages through the OS page cache instead of each
+# holding its own copy of the song.
+#
+# Samples are stored as interleaved float32 frames, i.e. with shape (frames, channels), which is the
+# layout PortAudio expects. That way the audio process can hand out slices of the buffer as is.
+class PcmBuffer:
+    def __init__(self, path, shape, dtype, mode, temporary = False):
+        self.path = path
+        # Only temporary buffers are removed by delete(). Others, e.g. those in the PcmCache, outlive the
+        # song being open.
+        self.temporary = temporary
+        self.shape = tuple(shape)
+        self.dtype = numpy.dtype(dtype)
+        self.frames = numpy.memmap(path, dtype=self.dtype, mode=mode, offset=HEADER_SIZE, shape=self.shape)
+        # The frames were mapped first, so the file already exists by now.
+        header_mode = "r+" if mode == "w+" else mode
+        self.header = numpy.memmap(path, dtype=numpy.int64, mode=header_mode, shape=(HEADER_SIZE // 8,))
+
+    # Copies data, given in librosa's (channels, samples) or (samples,) layout, into a new buffer backed
+    # by a temporary file.
+    @staticmethod
+    def create(data, directory=None):
+        channels = 1 if data.ndim == 1 else data.shape[0]
+        buffer = PcmBuffer.allocate(data.shape[-1], channels, directory)
+        buffer.write(data)
+        return buffer
+
+    # Like create, but at the given path, and the file is kept when the buffer is no longer used.
+    @staticmethod
+    def create_at(path, data):
+        channels = 1 if data.ndim == 1 else data.shape[0]
+        buffer = PcmBuffer.allocate_at(path, data.shape[-1], channels)
+        buffer.write(data)
+        return buffer
+
+    # Creates a silent buffer with room for frame_count frames, to be filled in later. The file is sparse,
+    # so this is cheap even for long songs.
+    @staticmethod
+    def allocate(frame_count, channels, directory=None):
+        fd, path = tempfile.mkstemp(prefix="noodler-", suffix=".pcm", dir=directory)
+        os.close(fd)
+        temporary_paths.add(path)
+        return PcmBuffer(path, (frame_count, channels), numpy.float32, "w+", temporary=True)
+
+    # Like allocate, but at the given path, and the file is kept when the buffer is no longer used.
+    @staticmethod
+    def allocate_at(path, frame_count, channels):
+        return PcmBuffer(path, (frame_count, channels), numpy.float32, "w+")
+
+    # Maps an existing buffer read-only, e.g. from the audio process.
+    @staticmethod
+    def open(path, shape, dtype):
+        return PcmBuffer(path, shape, dtype, "r")
+
+    # The samples in librosa's (channels, samples) layout. This is a view, not a copy.
+    def samples(self):
+        return self.frames.T
+
+    # Fills the buffer with data, given in librosa's layout.
+    def write(self, data):
+        channels = self.shape[1]
+        self.frames[...] = data.reshape(channels, -1).T
+        self.set_available_frames(self.shape[0])
+
+    def available_frames(self):
+        return int(self.header[AVAILABLE_FRAMES])
+
+    def set_available_frames(self, frame_count):
+        self.header[AVAILABLE_FRAMES] = frame_count
+
+    # Removes the backing file. Existing mappings (including numpy views of self.frames) remain valid
+    # until they are garbage collected, so this is safe to call while the other process is still playing.
+    def delete(self):
+        if not self.temporary:
+            return
+        try:
+            os.remove(self.path)
+        except OSError:
+            # Windows refuses to remove a file that is still mapped. It's tried again on exit.
+            return
+        temporary_paths.discard(self.path)
+
+# Removes the temporary buffers that are still around, e.g. the open song's, once the process exits.
+# Worker processes (see multiprocessing) exit without running this, so they leave the buffers of the
+# process that started them alone.
+@atexit.register
+def remove_temporary_files():
+    for path in list(temporary_paths):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    temporary_paths.clear()
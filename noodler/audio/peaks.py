@@ -0,0 +1,145 @@
+import os
+import numpy
+
+# PeakPyramid summarizes a song for drawing its waveform: the minimum, maximum and RMS of its mono mix
+# over blocks of BASE_BLOCK frames, then over blocks twice that size, and so on up to a single block for
+# the whole song. Any range of the song can then be drawn at any width from the level whose blocks are
+# just below a pixel wide, so drawing takes time proportional to the number of pixels rather than the
+# number of frames.
+#
+# The pyramid can be built up incrementally with update, e.g. while a song is being decoded, and saved
+# so that it only has to be computed once per file (see PcmCache.attach).
+class PeakPyramid:
+    BASE_BLOCK = 64
+
+    def __init__(self, frame_count):
+        self.frame_count = frame_count
+        # Per level, arrays of the minimum, maximum and sum of squares of each block.
+        self.mins = []
+        self.maxes = []
+        self.squares = []
+        block_count = max(-(-frame_count // PeakPyramid.BASE_BLOCK), 1)
+        while True:
+            self.mins.append(numpy.zeros(block_count, dtype=numpy.float32))
+            self.maxes.append(numpy.zeros(block_count, dtype=numpy.float32))
+            self.squares.append(numpy.zeros(block_count, dtype=numpy.float32))
+            if block_count == 1:
+                break
+            block_count = -(-block_count // 2)
+        # Frames up to here have been summarized.
+        self.complete_frames = 0
+
+    @staticmethod
+    def load(path):
+        with numpy.load(path) as data:
+            pyramid = PeakPyramid(int(data["frame_count"]))
+            for level in range(len(pyramid.mins)):
+                pyramid.mins[level] = data["mins_{}".format(level)]
+                pyramid.maxes[level] = data["maxes_{}".format(level)]
+                pyramid.squares[level] = data["squares_{}".format(level)]
+        pyramid.complete_frames = pyramid.frame_count
+        return pyramid
+
+    def save(self, path):
+        arrays = {"frame_count": numpy.array(self.frame_count)}
+        for level in range(len(self.mins)):
+            arrays["mins_{}".format(level)] = self.mins[level]
+            arrays["maxes_{}".format(level)] = self.maxes[level]
+            arrays["squares_{}".format(level)] = self.squares[level]
+        # Write to a temporary file first so that a crash can't leave a half-written pyramid behind.
+        with open(path + ".tmp", "wb") as f:
+            numpy.savez(f, **arrays)
+        os.replace(path + ".tmp", path)
+
+    def complete(self):
+        return self.complete_frames >= self.frame_count
+
+    def block_size(self, level):
+        return PeakPyramid.BASE_BLOCK << level
+
+    # Summarizes audio_data (in librosa's layout) up to end_frame, continuing from where the previous
+    # update stopped.
+    def update(self, audio_data, end_frame):
+        block = PeakPyramid.BASE_BLOCK
+        first_block = self.complete_frames // block
+        if end_frame < self.frame_count:
+            end_frame = end_frame // block * block
+        end_frame = min(end_frame, self.frame_count)
+        last_block = -(-end_frame // block)
+        if last_block <= first_block:
+            return
+        samples = mono(audio_data[..., first_block * block:end_frame])
+        padding = (last_block - first_block) * block - len(samples)
+        # Pad a partial last block with its own last sample, which doesn't change its minimum or maximum;
+        # rms divides by the actual number of frames in it.
+        blocks = numpy.pad(samples, (0, padding), mode="edge").reshape(-1, block)
+        self.mins[0][first_block:last_block] = blocks.min(axis=1)
+        self.maxes[0][first_block:last_block] = blocks.max(axis=1)
+        squares = numpy.square(blocks)
+        squares[-1, block - padding:] = 0.0
+        self.squares[0][first_block:last_block] = squares.sum(axis=1)
+        # Recompute every block above the updated ones from its two children.
+        for level in range(1, len(self.mins)):
+            first_block //= 2
+            last_block = -(-last_block // 2)
+            children = slice(2 * first_block, 2 * last_block)
+            self.mins[level][first_block:last_block] = pairs(self.mins[level - 1][children], numpy.minimum)
+            self.maxes[level][first_block:last_block] = pairs(self.maxes[level - 1][children], numpy.maximum)
+            self.squares[level][first_block:last_block] = pairs(self.squares[level - 1][children], numpy.add)
+        self.complete_frames = end_frame
+
+    # Returns (mins, maxes, rmses): arrays with one value per pixel for frames first_frame up to (excluding)
+    # last_frame drawn pixels wide. Where pixels are narrower than BASE_BLOCK frames, the values are
+    # computed from audio_data directly, down to individual samples.
+    def query(self, audio_data, first_frame, last_frame, pixels):
+        frames_per_pixel = (last_frame - first_frame) / pixels
+        if frames_per_pixel < PeakPyramid.BASE_BLOCK:
+            samples = mono(audio_data[..., first_frame:last_frame])
+            edges = numpy.minimum((numpy.arange(pixels + 1) * frames_per_pixel).astype(numpy.int64), len(samples))
+            return reduce_ranges(edges, samples, samples, numpy.square(samples), numpy.ones(len(samples)))
+        level = min(int(numpy.log2(frames_per_pixel / PeakPyramid.BASE_BLOCK)), len(self.mins) - 1)
+        block = self.block_size(level)
+        edges = ((first_frame + numpy.arange(pixels + 1) * frames_per_pixel) // block).astype(numpy.int64)
+        # Round the last edge up rather than down, so that a partial block at the end isn't left out.
+        edges[-1] = -(-last_frame // block)
+        first_block = edges[0]
+        last_block = min(max(edges[-1], edges[-2] + 1), len(self.mins[level]))
+        edges = numpy.minimum(edges - first_block, last_block - first_block)
+        counts = numpy.full(last_block - first_block, block, dtype=numpy.float32)
+        if last_block == len(self.mins[level]):
+            counts[-1] = self.frame_count - (last_block - 1) * block
+        return reduce_ranges(
+            edges,
+            self.mins[level][first_block:last_block],
+            self.maxes[level][first_block:last_block],
+            self.squares[level][first_block:last_block],
+            counts,
+        )
+
+# Averages audio_data, in librosa's layout, to mono.
+def mono(audio_data):
+    if audio_data.ndim == 1:
+        return numpy.asarray(audio_data, dtype=numpy.float32)
+    return numpy.mean(audio_data, axis=0, dtype=numpy.float32)
+
+# Combines each pair of consecutive values with ufunc; an odd last value is kept as is.
+def pairs(values, ufunc):
+    if len(values) % 2 == 1:
+        values = numpy.append(values, values[-1:] if ufunc is not numpy.add else [0.0])
+    return ufunc(values[0::2], values[1::2])
+
+# Reduces the values between consecutive edges to one minimum, maximum and RMS each. Where two edges are
+# equal, the value at that edge is used, so ranges narrower than a value repeat it.
+def reduce_ranges(edges, mins, maxes, squares, counts):
+    starts = numpy.minimum(edges[:-1], len(mins) - 1)
+    reduced_mins = numpy.minimum.reduceat(mins, starts)
+    reduced_maxes = numpy.maximum.reduceat(maxes, starts)
+    reduced_squares = numpy.add.reduceat(squares, starts)
+    reduced_counts = numpy.add.reduceat(counts, starts)
+    # reduceat reduces up to the next start, but the last range ends at the last edge.
+    end = max(edges[-1], starts[-1] + 1)
+    reduced_mins[-1] = mins[starts[-1]:end].min()
+    reduced_maxes[-1] = maxes[starts[-1]:end].max()
+    reduced_squares[-1] = squares[starts[-1]:end].sum()
+    reduced_counts[-1] = counts[starts[-1]:end].sum()
+    return (reduced_mins, reduced_maxes, numpy.sqrt(reduced_squares / reduced_counts))
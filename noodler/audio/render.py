@@ -0,0 +1,175 @@
+from collections import OrderedDict
+from concurrent.futures import as_completed
+import librosa
+import numpy
+from .pcm import PcmBuffer
+
+# 1 GB, roughly 45 minutes of 44.1 kHz stereo audio.
+DEFAULT_MEMORY_BUDGET = 1024 * 1024 * 1024
+
+# Renders are split into segments of SEGMENT_SECONDS, each rendered with MARGIN_SECONDS of extra audio
+# on either side so that effects with some temporal context (like HPSS' median filter) see the same
+# input they would in a single pass. Adjacent segments are crossfaded over CROSSFADE_SECONDS.
+SEGMENT_SECONDS = 20.0
+MARGIN_SECONDS = 1.0
+CROSSFADE_SECONDS = 0.1
+# Segments start on a multiple of this many frames, librosa's default STFT hop, so that their STFT
+# frames line up with those of a single pass.
+SEGMENT_ALIGNMENT = 512
+
+# Effects are referred to by name so that they can be sent to worker processes. Each takes a single
+# channel and a dict of parameters.
+EFFECTS = {
+    "harmonic": lambda y, params: librosa.effects.harmonic(y=y),
+    # Note that the phase vocoder's phases don't carry over between segments, so a segmented stretch
+    # matches a single pass in its spectrum rather than sample by sample.
+    "time_stretch": lambda y, params: librosa.effects.time_stretch(y=y, rate=params["rate"]),
+}
+
+# Returns the key under which audio rendered from the source with key source_key, with the given
+# effect parameters, is cached. Parameters are sorted by name, so the order they're given in doesn't
+# matter.
+def render_key(source_key, **params):
+    return "-".join([source_key] + ["{}={}".format(name, params[name]) for name in sorted(params)])
+
+# The length of an effect's output relative to its input.
+def output_scale(effect, params):
+    if effect == "time_stretch":
+        return 1.0 / params["rate"]
+    return 1.0
+
+# Splits frame_count frames into (start, end) segments, ordered so that those overlapping the priority
+# range come first, followed by the rest in order of their distance from it.
+def plan_segments(frame_count, sampling_rate, priority_start, priority_end):
+    segment_frames = int(SEGMENT_SECONDS * sampling_rate)
+    segments = [(start, min(start + segment_frames, frame_count)) for start in range(0, frame_count, segment_frames)]
+    def distance(segment):
+        (start, end) = segment
+        return max(priority_start - end, start - priority_end, 0)
+    return sorted(segments, key=distance)
+
+# Renders one channel of one segment; this runs in a worker process. The worker maps the source buffer
+# itself, so only the segment's output has to be sent back.
+def render_segment(path, shape, effect, params, start, end, channel):
+    frames = PcmBuffer.open(path, shape, numpy.float32).frames
+    y = numpy.ascontiguousarray(frames[start:end, channel])
+    return EFFECTS[effect](y, params).astype(numpy.float32)
+
+# Weights for overlap-adding output positions [start, end) of a segment whose core is [core_start,
+# core_end): 1 inside the core, ramping linearly to 0 over the crossfades with its neighbours, so that
+# the weights of all segments sum to 1 everywhere.
+def crossfade_weights(start, end, core_start, core_end, half_fade, total):
+    positions = numpy.arange(start, end) + 0.5
+    weights = numpy.ones(end - start, dtype=numpy.float32)
+    if core_start > 0:
+        weights *= numpy.clip((positions - (core_start - half_fade)) / (2 * half_fade), 0.0, 1.0)
+    if core_end < total:
+        weights *= numpy.clip(((core_end + half_fade) - positions) / (2 * half_fade), 0.0, 1.0)
+    return weights
+
+# Applies effect to source, writing the result to output, using a process pool (e.g. a
+# ProcessPoolExecutor). Channels and segments are rendered in parallel, with the segments overlapping
+# [priority_start, priority_end) (in source frames, e.g. the loop) first. on_progress(complete) is
+# called once those are done, and again with complete set once everything is.
+#
+# If the effect doesn't change the length of the audio, output starts out as a copy of source, and each
+# segment replaces its part of it as it's rendered. That way output can be played right away. Returns
+# False if cancelled through token. If a segment fails, the rest are cancelled and its exception is
+# raised.
+def render_segmented(pool, source, output, effect, params, sampling_rate, priority_start, priority_end, token, on_progress):
+    frame_count = source.shape[0]
+    channels = source.shape[1]
+    scale = output_scale(effect, params)
+    output_count = output.shape[0]
+    margin = int(MARGIN_SECONDS * sampling_rate)
+    half_fade = int(CROSSFADE_SECONDS * sampling_rate / 2)
+    dry = scale == 1.0
+    if dry:
+        output.frames[...] = source.frames
+    else:
+        output.frames[...] = 0.0
+
+    segments = plan_segments(frame_count, sampling_rate, priority_start, priority_end)
+    futures = {}
+    for (core_start, core_end) in segments:
+        start = max(core_start - half_fade - margin, 0) // SEGMENT_ALIGNMENT * SEGMENT_ALIGNMENT
+        end = min(core_end + half_fade + margin, frame_count)
+        for channel in range(channels):
+            future = pool.submit(render_segment, source.path, source.shape, effect, params, start, end, channel)
+            futures[future] = (start, core_start, core_end, channel)
+    priority = {future for (future, (_, core_start, core_end, _)) in futures.items() if core_start < priority_end and core_end > priority_start}
+
+    for future in as_completed(futures):
+        if token.cancelled():
+            for other in futures:
+                other.cancel()
+            return False
+        (start, core_start, core_end, channel) = futures[future]
+        try:
+            rendered = future.result()
+        except Exception:
+            for other in futures:
+                other.cancel()
+            raise
+        out_core_start = int(round(core_start * scale))
+        out_core_end = output_count if core_end == frame_count else int(round(core_end * scale))
+        out_half_fade = int(round(half_fade * scale))
+        out_start = max(out_core_start - out_half_fade, 0)
+        out_end = min(out_core_end + out_half_fade, output_count)
+        offset = out_start - int(round(start * scale))
+        out_end = min(out_end, out_start + len(rendered) - offset)
+        weights = crossfade_weights(out_start, out_end, out_core_start, out_core_end, out_half_fade, output_count)
+        contribution = rendered[offset:offset + out_end - out_start]
+        if dry:
+            # Replace this segment's share of the dry audio, so that once all segments covering a frame are
+            # done, only rendered audio is left.
+            contribution = contribution - source.frames[out_start:out_end, channel]
+        output.frames[out_start:out_end, channel] += weights * contribution
+        if future in priority:
+            priority.remove(future)
+            if len(priority) == 0:
+                on_progress(False)
+    output.set_available_frames(output_count)
+    on_progress(True)
+    return True
+
+# RenderCache remembers rendered effects, so that switching back to effect parameters that were used
+# before doesn't render them again. Renders are stored in a PcmCache, which keeps them on disk, and the
+# most recently used ones are also kept mapped, up to memory_budget bytes. Renders that no longer fit
+# the budget are spilled: flushed to disk and unmapped, so that the OS can reclaim their memory. They
+# are mapped again from the PcmCache when needed.
+class RenderCache:
+    def __init__(self, pcm_cache, memory_budget = DEFAULT_MEMORY_BUDGET):
+        self.pcm_cache = pcm_cache
+        self.memory_budget = memory_budget
+        # key -> (buffer, sampling_rate), least recently used first.
+        self.resident = OrderedDict()
+
+    # Returns (buffer, sampling_rate) for the render cached under key, or None if there isn't one.
+    def get(self, key):
+        if key in self.resident:
+            self.resident.move_to_end(key)
+            return self.resident[key]
+        cached = self.pcm_cache.open(key)
+        if cached is not None:
+            self._add_resident(key, cached)
+        return cached
+
+    # Returns a new buffer to render into. It's added to the cache under key by commit, once rendering
+    # is complete.
+    def reserve(self, key, shape):
+        return PcmBuffer.allocate_at(self.pcm_cache.reserve(key), shape[0], shape[1])
+
+    def commit(self, key, buffer, sampling_rate):
+        self.pcm_cache.store(key, buffer, sampling_rate)
+        self._add_resident(key, (buffer, sampling_rate))
+
+    def _add_resident(self, key, render):
+        self.resident[key] = render
+        self.resident.move_to_end(key)
+        total = sum(buffer.frames.nbytes for (buffer, _) in self.resident.values())
+        while total > self.memory_budget and len(self.resident) > 1:
+            (_, (buffer, _)) = self.resident.popitem(last=False)
+            # Anyone still using the buffer, e.g. the audio player, keeps their own mapping.
+            buffer.frames.flush()
+            total -= buffer.frames.nbytes
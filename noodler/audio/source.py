@@ -0,0 +1,96 @@
+from threading import Thread, Event
+import audioread
+import audioread.exceptions
+import numpy
+from .pcm import PcmBuffer
+
+# StreamingDecoder decodes an audio file block by block on a background thread, writing each block
+# straight into a PcmBuffer. The buffer is sized from the duration reported by the file, so it can be
+# handed to the audio process and the waveform right away and played while the rest of the file is
+# still being decoded. Only one block is held in memory at a time; the decoded audio lives in the
+# buffer's file, which the OS can page out as needed.
+#
+# Until decoding reaches a frame, it plays and displays as silence. audioread can't seek, so there's no
+# way to decode the part at a later timestamp first: starting playback there plays silence until the
+# decoder, going through the file from the start, catches up.
+#
+# If decoding fails partway, e.g. because the file is corrupt, the error is kept (see error) and the
+# buffer stays incomplete; completed() tells whether it can be cached.
+#
+# If buffer_path is given, the buffer is written there and kept afterwards (see PcmCache.reserve);
+# otherwise it's a temporary file.
+class StreamingDecoder:
+    # What creating a StreamingDecoder raises for files that can't be streamed: those that don't report
+    # a duration, and those that audioread has no backend for, e.g. FLAC or float WAV files without
+    # ffmpeg. librosa.load can read many of them anyway, through soundfile.
+    UNSTREAMABLE = (ValueError, audioread.exceptions.DecodeError)
+
+    def __init__(self, path, buffer_path = None):
+        self.file = audioread.audio_open(path)
+        self.sampling_rate = self.file.samplerate
+        self.channels = self.file.channels
+        if not self.file.duration:
+            self.file.close()
+            raise ValueError("Can't stream {}: duration unknown".format(path))
+        frame_count = int(round(self.file.duration * self.sampling_rate))
+        if buffer_path is None:
+            self.buffer = PcmBuffer.allocate(frame_count, self.channels)
+        else:
+            self.buffer = PcmBuffer.allocate_at(buffer_path, frame_count, self.channels)
+        self.cancelled = Event()
+        self.done = Event()
+        # The exception decoding stopped with, if any.
+        self.error = None
+        self.thread = Thread(target=self._decode, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    # Blocks until decoding stopped, e.g. to decode a file without showing it. Raises the exception
+    # decoding failed with, if any.
+    def wait(self):
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    # Stops decoding after the current block, e.g. because another file is being opened.
+    def cancel(self):
+        self.cancelled.set()
+
+    def finished(self):
+        return self.done.is_set()
+
+    # True if decoding ran through the whole file without errors.
+    def completed(self):
+        return self.finished() and not self.cancelled.is_set() and self.error is None
+
+    def decoded_frames(self):
+        return self.buffer.available_frames()
+
+    def _decode(self):
+        frames = self.buffer.frames
+        frame_bytes = 2 * self.channels
+        position = 0
+        leftover = b""
+        try:
+            # audioread produces 16-bit little-endian signed integer PCM, in blocks that aren't necessarily
+            # a whole number of frames.
+            for block in self.file:
+                if self.cancelled.is_set():
+                    break
+                block = leftover + block
+                usable = len(block) - len(block) % frame_bytes
+                leftover = block[usable:]
+                samples = numpy.frombuffer(block[:usable], dtype="<i2").reshape(-1, self.channels)
+                # The reported duration can be off by a few milliseconds; anything past it is dropped.
+                count = min(len(samples), len(frames) - position)
+                frames[position:position + count] = samples[:count] / 32768.0
+                position += count
+                self.buffer.set_available_frames(position)
+                if position >= len(frames):
+                    break
+        except Exception as e:
+            self.error = e
+        finally:
+            self.file.close()
+            self.done.set()
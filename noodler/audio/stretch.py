@@ -0,0 +1,88 @@
+import numpy
+
+# TimeStretcher changes the speed of playback without changing its pitch, using a phase vocoder that
+# runs block by block in the audio process. It only ever looks at the frames around the current
+# position, so a rate change takes effect on the next buffer instead of requiring the whole song to
+# be re-rendered.
+#
+# Positions are in frames of the unstretched audio. Like extract_audio_data, the stretcher wraps
+# around the loop if loop is set, and otherwise produces silence once it reaches end_frame.
+class TimeStretcher:
+    def __init__(self, frames, start_frame, end_frame, loop, window_size = 2048, hop_size = 512):
+        self.frames = frames
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        self.loop = loop and end_frame > start_frame
+        self.window_size = window_size
+        self.hop_size = hop_size
+        # Periodic Hann window, applied both before analysis and after synthesis.
+        self.window = numpy.hanning(window_size + 1)[:-1].astype(numpy.float32)[:, numpy.newaxis]
+        self.normalization = numpy.sum(self.window ** 2) / hop_size
+        self.reset(start_frame)
+
+    # Starts stretching from position, discarding any output that hasn't been read yet.
+    def reset(self, position):
+        channels = self.frames.shape[1]
+        self.analysis_position = self._wrap(float(position))
+        self.phase = None
+        self.overlap = numpy.zeros((self.window_size, channels), dtype=numpy.float32)
+        # Output that has been synthesized but not read yet, and the position each of its frames
+        # corresponds to in the unstretched audio.
+        self.pending = numpy.zeros((0, channels), dtype=numpy.float32)
+        self.pending_positions = numpy.zeros(0)
+
+    # The position of the next frame that will be read.
+    def position(self):
+        if len(self.pending_positions) > 0:
+            return self.pending_positions[0]
+        return self.analysis_position
+
+    # True once playback without looping has gone past end_frame.
+    def finished(self):
+        return not self.loop and self.position() >= self.end_frame
+
+    # Returns (data, position): frame_count stretched frames, and the position of the first of them.
+    def read(self, frame_count, rate):
+        while len(self.pending) < frame_count:
+            self._synthesize_hop(rate)
+        data = self.pending[:frame_count]
+        position = self.pending_positions[0]
+        self.pending = self.pending[frame_count:]
+        self.pending_positions = self.pending_positions[frame_count:]
+        return (data, position)
+
+    # Synthesizes hop_size frames of output, advancing the analysis position by rate * hop_size.
+    def _synthesize_hop(self, rate):
+        segment = self._read_source(int(self.analysis_position), self.window_size + self.hop_size)
+        first = numpy.fft.rfft(self.window * segment[:self.window_size], axis=0)
+        second = numpy.fft.rfft(self.window * segment[self.hop_size:], axis=0)
+        if self.phase is None:
+            self.phase = numpy.angle(first)
+        frame = numpy.fft.irfft(numpy.abs(first) * numpy.exp(1j * self.phase), n=self.window_size, axis=0)
+        # The phase advance over exactly one synthesis hop, measured at the current position. Since
+        # phases only matter modulo 2 pi, the difference doesn't need to be unwrapped.
+        self.phase += numpy.angle(second) - numpy.angle(first)
+
+        self.overlap += self.window * frame / self.normalization
+        hop = self.overlap[:self.hop_size].copy()
+        self.overlap[:-self.hop_size] = self.overlap[self.hop_size:]
+        self.overlap[-self.hop_size:] = 0.0
+
+        positions = self._wrap(self.analysis_position + rate * numpy.arange(self.hop_size))
+        self.pending = numpy.concatenate((self.pending, hop))
+        self.pending_positions = numpy.concatenate((self.pending_positions, positions))
+        self.analysis_position = self._wrap(self.analysis_position + rate * self.hop_size)
+
+    def _read_source(self, position, frame_count):
+        indices = numpy.arange(position, position + frame_count)
+        if self.loop:
+            indices = self.start_frame + (indices - self.start_frame) % (self.end_frame - self.start_frame)
+            return self.frames.take(indices, axis=0)
+        segment = self.frames.take(numpy.minimum(indices, len(self.frames) - 1), axis=0)
+        segment[indices >= self.end_frame] = 0.0
+        return segment
+
+    def _wrap(self, position):
+        if not self.loop:
+            return position
+        return self.start_frame + (position - self.start_frame) % (self.end_frame - self.start_frame)
@@ -0,0 +1,184 @@
+from concurrent.futures import as_completed
+import librosa
+import numpy
+import os
+from . import notes
+from .pcm import PcmBuffer
+from ..utils import utils
+
+# Transcription turns a song into note events (piano key, onset, offset, velocity), from the constant-Q
+# analysis of the pitch tracking dock (see notes.ConstantQEngine). The song is split into segments of
+# SEGMENT_SECONDS that are transcribed in parallel in a process pool, and the resulting events are kept
+# in a NoteIndex.
+#
+# A key is sounding at a frame if its level, relative to a full scale sine of its pitch, is at least
+# MIN_DB, at least RELATIVE_LEVEL of the loudest key's at that frame, which leaves out most harmonics,
+# and at least that of the keys on either side, which a note's energy spills over to. Gaps of up to GAP_FRAMES are bridged, and events shorter than MIN_FRAMES are dropped.
+ENGINE = "cqt"
+WINDOW_WIDTH = 2048
+SEGMENT_SECONDS = 20.0
+MIN_DB = -50.0
+RELATIVE_LEVEL = 0.3
+GAP_FRAMES = 2
+MIN_FRAMES = 5
+# Velocities go from 1 at MIN_DB to 127 at full scale.
+MAX_VELOCITY = 127
+
+# A run of frames of a segment: the piano key, the frames [onset, offset) in which it sounds, and its
+# peak level relative to full scale.
+RUN_DTYPE = numpy.dtype([("key", numpy.int64), ("onset", numpy.int64), ("offset", numpy.int64), ("peak", numpy.float32)])
+
+# NoteIndex holds a song's note events in arrays sorted by onset, along with the latest offset of all
+# events up to each one. Queries for the events sounding at a time or overlapping a range thus take two
+# binary searches, plus time for the events that start before the range and end within the span of an
+# event overlapping it, which for music are few.
+class NoteIndex:
+    def __init__(self, keys, onsets, offsets, velocities):
+        order = numpy.argsort(onsets, kind="stable")
+        self.keys = numpy.asarray(keys, dtype=numpy.int64)[order]
+        self.onsets = numpy.asarray(onsets, dtype=numpy.float64)[order]
+        self.offsets = numpy.asarray(offsets, dtype=numpy.float64)[order]
+        self.velocities = numpy.asarray(velocities, dtype=numpy.int64)[order]
+        # reaches[i] is the latest offset of events 0 to i.
+        self.reaches = numpy.maximum.accumulate(self.offsets) if len(self.offsets) > 0 else self.offsets
+
+    @staticmethod
+    def load(path):
+        with numpy.load(path) as data:
+            return NoteIndex(data["keys"], data["onsets"], data["offsets"], data["velocities"])
+
+    def save(self, path):
+        # Write to a temporary file first so that a crash can't leave a half-written index behind.
+        with open(path + ".tmp", "wb") as f:
+            numpy.savez(f, keys=self.keys, onsets=self.onsets, offsets=self.offsets, velocities=self.velocities)
+        os.replace(path + ".tmp", path)
+
+    def __len__(self):
+        return len(self.onsets)
+
+    # Returns the indices of the events that overlap [start, end), in order of their onsets.
+    def overlapping(self, start, end):
+        # Events before first end by start; events from last on start at end or later.
+        first = numpy.searchsorted(self.reaches, start, side="right")
+        last = numpy.searchsorted(self.onsets, end, side="left")
+        candidates = numpy.arange(first, max(first, last))
+        return candidates[self.offsets[candidates] > start]
+
+    # Returns the indices of the events sounding at timestamp.
+    def active_at(self, timestamp):
+        first = numpy.searchsorted(self.reaches, timestamp, side="right")
+        last = numpy.searchsorted(self.onsets, timestamp, side="right")
+        candidates = numpy.arange(first, max(first, last))
+        return candidates[self.offsets[candidates] > timestamp]
+
+    # Returns the first onset after timestamp, or None.
+    def next_onset(self, timestamp):
+        i = numpy.searchsorted(self.onsets, timestamp, side="right")
+        return float(self.onsets[i]) if i < len(self.onsets) else None
+
+    # Returns the last onset before timestamp, or None.
+    def previous_onset(self, timestamp):
+        i = numpy.searchsorted(self.onsets, timestamp, side="left")
+        return float(self.onsets[i - 1]) if i > 0 else None
+
+# Splits frame_count analysis frames into (first, last) segments of about SEGMENT_SECONDS. They're all
+# about the same length, since the constant-Q transform of a very short segment is unreliable.
+def plan_segments(frame_count, sampling_rate):
+    hop = notes.ENGINES[ENGINE].hop_length(WINDOW_WIDTH)
+    segment_count = max(int(round(frame_count * hop / sampling_rate / SEGMENT_SECONDS)), 1)
+    boundaries = numpy.linspace(0, frame_count, segment_count + 1).astype(numpy.int64)
+    return list(zip(boundaries[:-1].tolist(), boundaries[1:].tolist()))
+
+# The constant-Q magnitude of a full scale sine at each piano key: librosa scales each bin by the square
+# root of its filter's length.
+def full_scale(sampling_rate):
+    frequencies = librosa.midi_to_hz(utils.piano_key_to_midi(numpy.arange(88)))
+    (lengths, _) = librosa.filters.wavelet_lengths(freqs=frequencies, sr=sampling_rate)
+    return numpy.sqrt(lengths)[:, numpy.newaxis] / 2
+
+# Finds the runs of frames [first, last) in which each key sounds. Runs that touch either end of the
+# segment are kept regardless of their length, so that they can be joined with those of the neighbouring
+# segments. This runs in a worker process, which maps the source buffer itself.
+def transcribe_segment(path, shape, sampling_rate, first, last):
+    audio_data = PcmBuffer.open(path, shape, numpy.float32).samples()
+    (magnitudes, _) = notes.ENGINES[ENGINE].analyze(audio_data, sampling_rate, 0.0, WINDOW_WIDTH, first, last)
+    levels = magnitudes / full_scale(sampling_rate)
+    sounding = (levels >= 10.0 ** (MIN_DB / 20.0)) & (levels >= RELATIVE_LEVEL * levels.max(axis=0))
+    sounding[1:] &= levels[1:] >= levels[:-1]
+    sounding[:-1] &= levels[:-1] >= levels[1:]
+    # Bridge short gaps: a frame between two sounding frames at most GAP_FRAMES + 1 apart sounds too.
+    for gap in range(1, GAP_FRAMES + 1):
+        bridged = sounding[:, :-gap - 1] & sounding[:, gap + 1:]
+        for offset in range(1, gap + 1):
+            sounding[:, offset:offset + bridged.shape[1]] |= bridged
+    # Runs start where a key starts sounding and end where it stops.
+    edges = numpy.diff(numpy.pad(sounding, ((0, 0), (1, 1))).astype(numpy.int8), axis=1)
+    (keys, onsets) = numpy.nonzero(edges == 1)
+    (_, offsets) = numpy.nonzero(edges == -1)
+    runs = numpy.zeros(len(keys), dtype=RUN_DTYPE)
+    runs["key"] = keys
+    runs["onset"] = onsets + first
+    runs["offset"] = offsets + first
+    # Both are in order of key, then frame, so the i-th onset and offset belong to the same run, and the
+    # runs' ranges in the flattened levels are in order. A trailing 0 makes room for a run that ends at
+    # the very end.
+    flat = numpy.append(levels.ravel(), 0.0)
+    boundaries = numpy.stack([keys * levels.shape[1] + onsets, keys * levels.shape[1] + offsets], axis=1).ravel()
+    runs["peak"] = numpy.maximum.reduceat(flat, boundaries)[0::2] if len(keys) > 0 else []
+    return runs
+
+# Joins runs of the same key that were split by a segment boundary, drops those shorter than
+# MIN_FRAMES, and returns the result as a NoteIndex.
+def merge_runs(runs, sampling_rate):
+    hop = notes.ENGINES[ENGINE].hop_length(WINDOW_WIDTH)
+    runs = numpy.sort(runs, order=["key", "onset"])
+    if len(runs) > 0:
+        continued = (runs["key"][1:] == runs["key"][:-1]) & (runs["onset"][1:] == runs["offset"][:-1])
+        starts = numpy.flatnonzero(numpy.concatenate([[True], ~continued]))
+        ends = numpy.append(starts[1:], len(runs)) - 1
+        merged = runs[starts].copy()
+        merged["offset"] = runs["offset"][ends]
+        merged["peak"] = numpy.maximum.reduceat(runs["peak"], starts)
+        runs = merged[merged["offset"] - merged["onset"] >= MIN_FRAMES]
+    decibels = 20.0 * numpy.log10(numpy.maximum(runs["peak"], 1e-10))
+    velocities = numpy.clip(numpy.round(1 + (MAX_VELOCITY - 1) * (1.0 - decibels / MIN_DB)), 1, MAX_VELOCITY)
+    # Frame t is centered on sample t * hop; a run covers from its first frame's center to its last's.
+    return NoteIndex(
+        runs["key"],
+        runs["onset"] * hop / sampling_rate,
+        (runs["offset"] - 1) * hop / sampling_rate,
+        velocities,
+    )
+
+# Transcribes source, a PcmBuffer, using a process pool (e.g. a ProcessPoolExecutor). Returns a
+# NoteIndex, or None if cancelled through token. If a segment fails, the rest are cancelled and its
+# exception is raised.
+def transcribe(pool, source, sampling_rate, token):
+    frame_count = notes.frame_count(ENGINE, source.shape[0], WINDOW_WIDTH)
+    futures = [
+        pool.submit(transcribe_segment, source.path, source.shape, sampling_rate, first, last)
+        for (first, last) in plan_segments(frame_count, sampling_rate)
+    ]
+    runs = []
+    for future in as_completed(futures):
+        if token.cancelled():
+            for f in futures:
+                f.cancel()
+            return None
+        try:
+            runs.append(future.result())
+        except Exception:
+            for f in futures:
+                f.cancel()
+            raise
+    return merge_runs(numpy.concatenate(runs), sampling_rate)
+
+# Transcribes source, a PcmBuffer, in this process, one segment after the other, e.g. in a worker
+# process that already is one of many. Returns a NoteIndex.
+def transcribe_in_process(source, sampling_rate):
+    frame_count = notes.frame_count(ENGINE, source.shape[0], WINDOW_WIDTH)
+    runs = [
+        transcribe_segment(source.path, source.shape, sampling_rate, first, last)
+        for (first, last) in plan_segments(frame_count, sampling_rate)
+    ]
+    return merge_runs(numpy.concatenate(runs), sampling_rate)
@@ -3,33 +3,42 @@ from PyQt6.QtWidgets import (
     QGraphicsScene,
     QGraphicsSceneMouseEvent,
     QGraphicsView,
-    QGraphicsScale,
 )
 from PyQt6.QtCore import (
     Qt, 
     QTimer,
 )
 from PyQt6 import QtGui
+from PyQt6.QtGui import QGuiApplication
 import librosa
-import math
 print(__name__)
 from ..audio import audio 
-from ..utils import utils
+from .piano_roll import PianoRollItem
+from .ruler import RulerItem
+from .spectrogram import SpectrogramItem
+from .waveform import WaveformItem
+
+# The interval between redraws while something is moving, matching the display's refresh rate.
+def refresh_interval():
+    screen = QGuiApplication.primaryScreen()
+    rate = screen.refreshRate() if screen is not None else 60.0
+    return max(int(1000 / rate), 1)
 
 class AudioWaveformView(QGraphicsView):
     # audio_data must be mono
-    def __init__(self, audio_data, audio_player, on_loop_change, *args, **kargs):
+    def __init__(self, audio_data, peaks, audio_player, on_loop_change, on_cursor_change, *args, **kargs):
         super(AudioWaveformView, self).__init__(*args, **kargs)
         self.audio_player = audio_player
 
-        self.audio_waveform_scene = AudioWaveformScene(audio_data, audio_player, on_loop_change)
+        self.audio_waveform_scene = AudioWaveformScene(audio_data, peaks, audio_player, on_loop_change, on_cursor_change)
         self.setScene(self.audio_waveform_scene)
 
         self.setFrameShape(QFrame.Shape.NoFrame)
         self.horizontalScrollBar().setValue(1)
         self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
         self.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-        self.setViewportUpdateMode(QGraphicsView.ViewportUpdateMode.FullViewportUpdate)
+        # Only repaint what changed, e.g. the columns the cursor moved between while playing.
+        self.setViewportUpdateMode(QGraphicsView.ViewportUpdateMode.MinimalViewportUpdate)
         self.show()
 
         self.dragging = False
@@ -49,7 +58,7 @@ class AudioWaveformView(QGraphicsView):
         new_width = self.audio_waveform_scene.width()
         new_center = current_center * (new_width / current_width)
         new_scroll = new_center - self.width() / 2
-        self.horizontalScrollBar().setValue(new_scroll)
+        self.horizontalScrollBar().setValue(round(new_scroll))
 
     def set_timestamp(self, timestamp):
         self.audio_waveform_scene.set_timestamp(timestamp)
@@ -73,19 +82,26 @@ class AudioWaveformView(QGraphicsView):
         return super().mouseReleaseEvent(event)
 
 class AudioWaveformScene(QGraphicsScene):
-    def __init__(self, audio_data, audio_player: audio.AudioPlayer, on_loop_change, *args, **kargs):
+    def __init__(self, audio_data, peaks, audio_player: audio.AudioPlayer, on_loop_change, on_cursor_change, *args, **kargs):
         super(AudioWaveformScene, self).__init__(*args, **kargs)
         self.setBackgroundBrush(Qt.GlobalColor.gray)
         self.audio_player = audio_player
-        self.data = librosa.to_mono(y=audio_data)
+        self.audio_data = audio_data
         self.total_height = 180
         self.waveform_height = 150
+        self.waveform_width = 1200
         self.scale = 1.0
-        self.duration = librosa.get_duration(y=self.data, sr=audio_player.audio_state.sampling_rate)
+        self.max_scale = max(audio_data.shape[-1] / self.waveform_width, 1.0)
+        self.duration = librosa.get_duration(y=audio_data, sr=audio_player.audio_state.sampling_rate)
         self.timestamp = 0.0
-        self.waveform = self.create_waveform(1200, self.waveform_height, self.data)
+        self.waveform = self.create_waveform(self.waveform_width, self.waveform_height, peaks)
         self.waveform.setY(30)
-        self.timeline = self.create_timeline(1200, 30, self.duration)
+        self.spectrogram = SpectrogramItem(peaks, audio_data, audio_player.audio_state.sampling_rate, self.waveform_width)
+        self.spectrogram.setY(self.total_height)
+        self.spectrogram.setVisible(False)
+        self.addItem(self.spectrogram)
+        self.timeline = self.create_timeline(self.waveform_width, 30, self.duration)
+        self.piano_roll = None
         self.add_cursor_to_scene()
 
         self.loop_start = 0.0
@@ -95,17 +111,29 @@ class AudioWaveformScene(QGraphicsScene):
 
         self.setting_loop = False
         self.on_loop_change = on_loop_change
+        self.on_cursor_change = on_cursor_change
 
         self.placing_cursor = False
         self.placing_cursor_initial_x = 0.0
 
+        # Only runs while something is moving, see start_tracking.
         self.timer = QTimer()
+        self.timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self.timer.setInterval(refresh_interval())
         self.timer.timeout.connect(self.on_timeout)
-        self.timer.start(15)
 
+    # Makes the cursor follow the audio player, once per display refresh, until playback stops. Also picks
+    # up changes to the player's timestamp made while paused.
+    def start_tracking(self):
+        if not self.timer.isActive():
+            self.timer.start()
 
     def on_timeout(self):
+        if self.setting_loop:
+            self.update_loop()
         self.set_timestamp(self.audio_player.current_timestamp)
+        if not self.audio_player.playing and not self.setting_loop:
+            self.timer.stop()
 
     def shift_loop(self, amount):
         loop_width = self.loop_end - self.loop_start
@@ -134,53 +162,60 @@ class AudioWaveformScene(QGraphicsScene):
         self.timestamp = timestamp
         self.update_timestamp()
 
+    # The scene's width per second of the song. An empty song is drawn as if it were a second long.
+    def seconds_to_px(self):
+        return self.width() / self.duration if self.duration > 0 else self.width()
+
     def update_timestamp(self):
-        new_pos = self.width() * self.timestamp / self.duration
+        new_pos = self.timestamp * self.seconds_to_px()
         self.timestamp_cursor.setPos(new_pos, 0.0)
         # a bit dirty...while audio is playing, the current timestamp is controlled
         # by the audio player, and read by the GUI. When audio is not playing, the current
         # timestamp is controlled by the GUI and read by the audio player.
         if not self.audio_player.playing:
             self.audio_player.set_current_timestamp(self.timestamp)
+            if self.on_cursor_change is not None:
+                self.on_cursor_change(self.timestamp)
 
     def zoom(self, factor):
         self.scale_waveform(self.scale * factor) 
 
     def scale_waveform(self, scale):
-        self.scale = scale
-        if self.scale < 1.0:
-            self.scale = 1.0
-        scale_transform = QGraphicsScale()
-        scale_transform.setXScale(self.scale)
-        self.waveform.setTransformations([scale_transform])
+        # Zooming in stops at one pixel per frame.
+        self.scale = min(max(scale, 1.0), self.max_scale)
+        # The waveform is redrawn at its new width rather than stretched, see WaveformItem.
+        self.waveform.set_width(round(self.waveform_width * self.scale))
+        self.spectrogram.set_width(self.waveform.width)
         self.update_rect()
 
-        if self.timeline != None:
-            self.removeItem(self.timeline)
-        self.timeline = self.create_timeline(self.width(), 30, self.duration)
+        self.timeline.set_width(self.waveform.width)
+        if self.piano_roll is not None:
+            self.piano_roll.set_width(self.waveform.width)
 
         self.update_loop()
         self.update_timestamp()
 
     def update_rect(self):
-        self.setSceneRect(0, 0, self.waveform.boundingRect().width() * self.scale, self.total_height)
+        self.setSceneRect(0, 0, self.waveform.width, self.total_height)
 
     # should add at x = 0
     def add_cursor_to_scene(self):
-        cursor_x = self.width() * self.timestamp / self.duration + 1
+        cursor_x = self.timestamp * self.seconds_to_px() + 1
         cursor_height = self.total_height
         self.timestamp_cursor = self.addLine(cursor_x, 0, cursor_x, cursor_height, Qt.GlobalColor.red)
+        self.timestamp_cursor.setZValue(2)
 
     def add_loop_to_scene(self):
         brush = QtGui.QBrush(QtGui.QColor(0, 0, 0, 100))
         pen = QtGui.QPen(QtGui.QColor(0, 0, 0, 100))
         pen.setStyle(Qt.PenStyle.NoPen)
         self.loop_rect = self.addRect(0, 0, self.width(), self.height(), pen, brush)
+        self.loop_rect.setZValue(1)
         self.update_loop()
 
     def update_loop(self):
-        loop_start_in_px = self.width() * self.loop_start / self.duration
-        loop_end_in_px = self.width() * self.loop_end / self.duration
+        loop_start_in_px = self.loop_start * self.seconds_to_px()
+        loop_end_in_px = self.loop_end * self.seconds_to_px()
         self.loop_rect.setRect(loop_start_in_px, 30, loop_end_in_px - loop_start_in_px, self.total_height - 30)
         self.update_rect()
 
@@ -197,9 +232,12 @@ class AudioWaveformScene(QGraphicsScene):
         return super().mousePressEvent(event)
 
     def mouseReleaseEvent(self, event: QGraphicsSceneMouseEvent) -> None:
-        self.setting_loop = False
+        if self.setting_loop:
+            self.setting_loop = False
+            self.update_loop()
         if self.timestamp < self.loop_start or self.timestamp > self.loop_end:
             self.audio_player.set_current_timestamp(self.loop_start)
+            self.start_tracking()
         if self.on_loop_change is not None:
             self.on_loop_change(self.loop_start, self.loop_end)
 
@@ -217,71 +255,45 @@ class AudioWaveformScene(QGraphicsScene):
             if timestamp < self.loop_start:
                 timestamp = self.loop_start
             self.loop_end = timestamp
-            self.update_loop()
+            # Redrawn on the next tick, so that fast mouse movements don't redraw more often than the
+            # display refreshes.
+            self.start_tracking()
         # capture the move event for efficiency
         return None
 
-    def create_waveform(self, width, height, audio_data):
-        vertical_margin = 0
-        effective_height = height - vertical_margin * 2
-        chunks = int(len(audio_data) / 2000)
-        chunk_pixel_width = float(width) / chunks
-        chunk_sample_width = int(len(audio_data) / chunks)
-        items = []
-        pen = QtGui.QPen(Qt.PenStyle.NoPen)
-        for chunk in range(0, chunks):
-            chunk_start = int(chunk * chunk_sample_width)
-            chunk_end = int((chunk + 1) * chunk_sample_width)
-            if chunk_start < 0:
-                chunk_start = 0
-            if chunk_end > len(audio_data):
-                chunk_end = len(audio_data)
-            chunk_data = audio_data[chunk_start:chunk_end]
-            (max, rms) = self.max_and_rms(chunk_data)
-            max_line_height = effective_height * max / 1.0
-            max_line_start = vertical_margin + (effective_height - max_line_height) / 2
-            rms_line_height = effective_height * rms / 1.0
-            rms_line_start = vertical_margin + (effective_height - rms_line_height) / 2
-            chunk_pixel_start = chunk * chunk_pixel_width
-            items.append(self.addRect(chunk_pixel_start, max_line_start, chunk_pixel_width, max_line_height, pen, Qt.GlobalColor.blue))
-            items.append(self.addRect(chunk_pixel_start, rms_line_start, chunk_pixel_width, rms_line_height, pen, Qt.GlobalColor.darkBlue))
-        waveform = self.createItemGroup(items)
+    # Creates the waveform for a song summarized by peaks, which may still be filling up. See
+    # update_waveform.
+    def create_waveform(self, width, height, peaks):
+        waveform = WaveformItem(peaks, self.audio_data, width, height)
+        self.addItem(waveform)
         return waveform
 
+    # Redraws the waveform, e.g. after more of the song was summarized.
+    def update_waveform(self):
+        self.waveform.update_peaks()
+        self.spectrogram.update_audio()
+
+    # Shows or hides the spectrogram below the waveform.
+    def set_spectrogram_visible(self, visible):
+        self.spectrogram.setVisible(visible)
+        self.total_height = 180 + (self.spectrogram.height if visible else 0)
+        line = self.timestamp_cursor.line()
+        self.timestamp_cursor.setLine(line.x1(), 0, line.x2(), self.total_height)
+        self.update_loop()
+
+    # Shows note events, a NoteIndex, over the waveform, or none if notes is None.
+    def set_notes(self, notes):
+        if self.piano_roll is not None:
+            self.removeItem(self.piano_roll)
+            self.piano_roll = None
+        if notes is not None:
+            self.piano_roll = PianoRollItem(notes, self.duration, self.waveform.width, self.waveform_height)
+            self.piano_roll.setY(30)
+            # Above the waveform, below the loop and the cursor.
+            self.piano_roll.setZValue(0.5)
+            self.addItem(self.piano_roll)
+
     def create_timeline(self, width, height, duration):
-        line = self.addLine(0.0, height, width, height, Qt.GlobalColor.black)
-        # handle case where no resolution works?
-        # ms
-        possible_resolutions = [10, 100, 1000, 5000, 20000, 600000, 300000]
-        min_tick_spacing = 10
-        ticks = [r for r in possible_resolutions if width * r / (duration * 1000) > min_tick_spacing]
-        smaller_tick = ticks[0]
-        bigger_tick = ticks[1]
-        ms = 0
-        while ms < duration * 1000:
-            second = ms / 1000
-            x = width * second / duration
-            if ms % bigger_tick == 0:
-                tick = self.addLine(x, 0, x, height, Qt.GlobalColor.black)
-                time_str = utils.seconds_to_time_str(second)
-                font = QtGui.QFont("Courier New", 9)
-                text = self.addText(time_str, font)
-                text.setDefaultTextColor(Qt.GlobalColor.black)
-                text.setPos(x, height - 28)
-                text.setParentItem(line)
-            else:
-                tick = self.addLine(x, height - 6, x, height, Qt.GlobalColor.black)
-            tick.setParentItem(line)
-            ms += smaller_tick
-        return line
-
-    def max_and_rms(self, samples):
-        total = 0
-        max = 0
-        for sample in samples:
-            total += sample * sample
-            if sample > max:
-                max = sample
-        total /= len(samples)
-        rms = math.sqrt(total)
-        return (max, rms)
\ No newline at end of file
+        timeline = RulerItem(duration, width, height)
+        self.addItem(timeline)
+        return timeline
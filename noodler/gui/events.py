@@ -56,3 +56,131 @@ class BackEvent(QEvent):
 
     def __init__(self):
         super(BackEvent, self).__init__(BackEvent.TYPE)
+
+# The following events are posted by a LoadPipeline, or one of the other jobs in loading.py, from its
+# worker thread. Each carries the CancellationToken of the job it belongs to, so that results of a job
+# that has since been superseded can be ignored.
+
+class PeaksUpdatedEvent(QEvent):
+    TYPE = QEvent.registerEventType()
+
+    def __init__(self, token):
+        super(PeaksUpdatedEvent, self).__init__(PeaksUpdatedEvent.TYPE)
+
+        self.token = token
+
+    def get_token(self):
+        return self.token
+
+class DecodeFinishedEvent(QEvent):
+    TYPE = QEvent.registerEventType()
+
+    def __init__(self, token, key):
+        super(DecodeFinishedEvent, self).__init__(DecodeFinishedEvent.TYPE)
+
+        self.token = token
+        self.key = key
+
+    def get_token(self):
+        return self.token
+
+    # The key the song's file was hashed to, or None if it wasn't (see LoadPipeline).
+    def get_key(self):
+        return self.key
+
+class TranscriptionEvent(QEvent):
+    TYPE = QEvent.registerEventType()
+
+    def __init__(self, token, index):
+        super(TranscriptionEvent, self).__init__(TranscriptionEvent.TYPE)
+
+        self.token = token
+        self.index = index
+
+    def get_token(self):
+        return self.token
+
+    def get_index(self):
+        return self.index
+
+class RenderProgressEvent(QEvent):
+    TYPE = QEvent.registerEventType()
+
+    def __init__(self, token, complete):
+        super(RenderProgressEvent, self).__init__(RenderProgressEvent.TYPE)
+
+        self.token = token
+        self.complete = complete
+
+    def get_token(self):
+        return self.token
+
+    def get_complete(self):
+        return self.complete
+
+# Posted by a background job (see loading.py) that stopped with an exception.
+class JobFailedEvent(QEvent):
+    TYPE = QEvent.registerEventType()
+
+    def __init__(self, token, error):
+        super(JobFailedEvent, self).__init__(JobFailedEvent.TYPE)
+
+        self.token = token
+        self.error = error
+
+    def get_token(self):
+        return self.token
+
+    def get_error(self):
+        return self.error
+
+# Posted by the background workers of a WaveformItem or SpectrogramItem with a tile. If rendering the
+# tile failed, error is the exception, and image is None.
+class TileRenderedEvent(QEvent):
+    TYPE = QEvent.registerEventType()
+
+    def __init__(self, key, image, complete, error = None):
+        super(TileRenderedEvent, self).__init__(TileRenderedEvent.TYPE)
+
+        self.key = key
+        self.image = image
+        self.complete = complete
+        self.error = error
+
+    def get_key(self):
+        return self.key
+
+    def get_image(self):
+        return self.image
+
+    def get_complete(self):
+        return self.complete
+
+    def get_error(self):
+        return self.error
+
+# Posted by a VerticalPitchTrackingScene's background workers with a block of pitch tracking, see
+# notes.analyze_block. If pitch-tracking the block failed, error is the exception, and notes and maxima
+# are None.
+class NoteBlockEvent(QEvent):
+    TYPE = QEvent.registerEventType()
+
+    def __init__(self, key, notes, maxima, error = None):
+        super(NoteBlockEvent, self).__init__(NoteBlockEvent.TYPE)
+
+        self.key = key
+        self.notes = notes
+        self.maxima = maxima
+        self.error = error
+
+    def get_key(self):
+        return self.key
+
+    def get_notes(self):
+        return self.notes
+
+    def get_maxima(self):
+        return self.maxima
+
+    def get_error(self):
+        return self.error
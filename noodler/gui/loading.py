@@ -0,0 +1,146 @@
+from threading import Event, Thread
+import time
+from PyQt6.QtWidgets import QApplication
+from ..audio import cache, render, transcription
+from . import events
+
+# CancellationToken is handed to every stage of a load. Cancelling it makes the stages stop at the
+# next opportunity, and tells the receiver to ignore anything they already posted.
+class CancellationToken:
+    def __init__(self):
+        self.event = Event()
+
+    def cancel(self):
+        self.event.set()
+
+    def cancelled(self):
+        return self.event.is_set()
+
+# LoadPipeline does the expensive parts of opening a song on a worker thread, so that the window stays
+# responsive. Each stage posts its results to the receiver as soon as they're ready:
+#
+# 1. peaks, following the decoder as it goes. (The audio itself is playable before the pipeline even
+#    starts, see StreamingDecoder.) If peaks is already complete, e.g. because it came from the cache,
+#    this only posts a single PeaksUpdatedEvent.
+# 2. DecodeFinishedEvent, once the whole song is decoded. By then, peaks is complete. If path is given,
+#    its key (see cache.content_key) is computed first, so that the song can be cached without reading
+#    the whole file on the GUI thread; the event carries it.
+class LoadPipeline:
+    def __init__(self, receiver, audio_buffer, sampling_rate, decoder, peaks, path = None):
+        self.receiver = receiver
+        self.audio_buffer = audio_buffer
+        self.sampling_rate = sampling_rate
+        self.decoder = decoder
+        self.peaks = peaks
+        self.path = path
+        self.token = CancellationToken()
+        self.thread = Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def cancel(self):
+        self.token.cancel()
+        if self.decoder is not None:
+            self.decoder.cancel()
+
+    def _post(self, event):
+        if not self.token.cancelled():
+            QApplication.postEvent(self.receiver, event)
+
+    def _run(self):
+        audio_data = self.audio_buffer.samples()
+
+        frames_done = 0
+        while not self.token.cancelled():
+            finished = self.decoder is None or self.decoder.finished()
+            self.peaks.update(audio_data, self.audio_buffer.available_frames())
+            if self.peaks.complete_frames > frames_done:
+                self._post(events.PeaksUpdatedEvent(self.token))
+                frames_done = self.peaks.complete_frames
+            if finished:
+                break
+            time.sleep(0.1)
+        key = None
+        if self.path is not None and not self.token.cancelled():
+            try:
+                key = cache.content_key(self.path)
+            except OSError:
+                # The file went away; the song just won't be cached.
+                pass
+        if self.token.cancelled():
+            return
+        self._post(events.DecodeFinishedEvent(self.token, key))
+
+# RenderJob renders an effect over a whole song on a worker thread, which farms the actual rendering
+# out to a process pool (see render.render_segmented). It posts a RenderProgressEvent once the
+# selection has been rendered, so that it can be played while the rest of the song is rendered, and
+# another once the whole song has. If rendering fails, it posts a JobFailedEvent instead.
+class RenderJob:
+    def __init__(self, receiver, pool, source, output, effect, params, sampling_rate, priority_start, priority_end):
+        self.receiver = receiver
+        self.pool = pool
+        self.source = source
+        self.output = output
+        self.effect = effect
+        self.params = params
+        self.sampling_rate = sampling_rate
+        self.priority_start = priority_start
+        self.priority_end = priority_end
+        self.token = CancellationToken()
+        self.thread = Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def cancel(self):
+        self.token.cancel()
+
+    def _post(self, event):
+        if not self.token.cancelled():
+            QApplication.postEvent(self.receiver, event)
+
+    def _run(self):
+        try:
+            render.render_segmented(
+                self.pool,
+                self.source,
+                self.output,
+                self.effect,
+                self.params,
+                self.sampling_rate,
+                self.priority_start,
+                self.priority_end,
+                self.token,
+                lambda complete: self._post(events.RenderProgressEvent(self.token, complete)),
+            )
+        except Exception as e:
+            self._post(events.JobFailedEvent(self.token, e))
+
+# TranscriptionJob transcribes a whole song into note events on a worker thread, which farms the
+# analysis out to a process pool (see transcription.transcribe), and posts a TranscriptionEvent with
+# the resulting NoteIndex. If transcribing fails, it posts a JobFailedEvent instead.
+class TranscriptionJob:
+    def __init__(self, receiver, pool, source, sampling_rate):
+        self.receiver = receiver
+        self.pool = pool
+        self.source = source
+        self.sampling_rate = sampling_rate
+        self.token = CancellationToken()
+        self.thread = Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def cancel(self):
+        self.token.cancel()
+
+    def _run(self):
+        try:
+            index = transcription.transcribe(self.pool, self.source, self.sampling_rate, self.token)
+        except Exception as e:
+            if not self.token.cancelled():
+                QApplication.postEvent(self.receiver, events.JobFailedEvent(self.token, e))
+            return
+        if index is not None and not self.token.cancelled():
+            QApplication.postEvent(self.receiver, events.TranscriptionEvent(self.token, index))
@@ -3,6 +3,7 @@ from PyQt6.QtWidgets import (
     QFileDialog,
     QInputDialog,
     QMainWindow,
+    QMessageBox,
     QWidget,
     QBoxLayout,
     QDockWidget,
@@ -14,6 +15,7 @@ from PyQt6.QtWidgets import (
     QFrame,
     QDoubleSpinBox,
     QSpinBox,
+    QComboBox,
     QDialog,
     QGraphicsView,
     QGraphicsScene,
@@ -27,10 +29,13 @@ from PyQt6.QtCore import (
 )
 from PyQt6 import QtGui
 from pytube import YouTube
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import librosa
+import numpy
 import os
-from . import audio_view, events
-from ..audio import audio
+from . import audio_view, events, loading, overview
+from ..audio import audio, cache, library, notes, pcm, peaks, render, source, transcription
 from ..utils import utils
 
 MUSIC_PATH = "music"
@@ -63,14 +68,27 @@ class VerticalPitchTrackingWidget(QWidget):
         self.threshold_input.setMaximum(1.0)
         self.threshold_input.setMinimum(0.0)
         self.threshold_input.setSingleStep(0.1)
+        # Parameters apply as soon as they're changed, since recomputing happens in the background; but
+        # not while a value is still being typed.
+        self.threshold_input.setKeyboardTracking(False)
+        self.threshold_input.valueChanged.connect(lambda value: self.on_refresh())
         controls_layout.addWidget(self.threshold_input)
 
+        self.engine_label = QLabel("Engine:")
+        controls_layout.addWidget(self.engine_label)
+        self.engine_input = QComboBox()
+        self.engine_input.addItems(notes.ENGINES.keys())
+        self.engine_input.currentTextChanged.connect(lambda engine: self.on_refresh())
+        controls_layout.addWidget(self.engine_input)
+
         self.window_width_label = QLabel("Window size:")
         controls_layout.addWidget(self.window_width_label)
         self.window_width_input = QSpinBox()
         self.window_width_input.setValue(2048)
         self.window_width_input.setMinimum(1024)
         self.window_width_input.setMaximum(10000)
+        self.window_width_input.setKeyboardTracking(False)
+        self.window_width_input.valueChanged.connect(lambda value: self.on_refresh())
         controls_layout.addWidget(self.window_width_input)
 
         refresh_button = QPushButton("Refresh")
@@ -87,8 +105,9 @@ class VerticalPitchTrackingWidget(QWidget):
         self.sr = None
         self.timestamp = 0.0
 
+        # Only runs while playing, see start_tracking.
         self.timer = QTimer()
-        self.timer.start(30)
+        self.timer.setInterval(30)
         self.timer.timeout.connect(self.on_timeout)
 
     def on_set_timestamp(self):
@@ -96,9 +115,16 @@ class VerticalPitchTrackingWidget(QWidget):
         self.update_scene()
     
     def on_refresh(self):
+        engine = self.engine_input.currentText()
         threshold = self.threshold_input.value()
         window_width = self.window_width_input.value()
-        self.view.vertical_pitch_tracking_scene.update_params(threshold, window_width)
+        self.view.vertical_pitch_tracking_scene.update_params(engine, threshold, window_width)
+
+    # Follows the audio player until playback stops. Also picks up changes to the player's timestamp made
+    # while paused.
+    def start_tracking(self):
+        if not self.timer.isActive():
+            self.timer.start()
 
     def on_timeout(self):
         if self.lock_to_timestamp_checkbox.isChecked():
@@ -106,17 +132,23 @@ class VerticalPitchTrackingWidget(QWidget):
                 self.timestamp = self.audio_player.current_timestamp
                 self.timestamp_input.setText(utils.seconds_to_time_str(self.timestamp))
                 self.update_scene()
+        if not self.audio_player.playing:
+            self.timer.stop()
 
     def update_scene(self):
         self.view.vertical_pitch_tracking_scene.set_timestamp(self.timestamp)
+        if self.audio_player.audio_state is not None:
+            self.view.vertical_pitch_tracking_scene.set_loop(self.audio_player.start_timestamp, self.audio_player.end_timestamp)
         self.view.vertical_pitch_tracking_scene.update()
 
-    def set_audio_data(self, audio_data, sr):
+    # Pitch-tracks audio_data, which identity tells apart from other audio, e.g. its key in the PcmCache.
+    def set_audio_data(self, identity, audio_data, sr):
         self.audio_data = audio_data
         self.sr = sr
+        engine = self.engine_input.currentText()
         threshold = self.threshold_input.value()
         window_width = self.window_width_input.value()
-        self.view.vertical_pitch_tracking_scene.set_data(self.audio_data, self.sr, threshold, window_width)
+        self.view.vertical_pitch_tracking_scene.set_data(identity, self.audio_data, self.sr, engine, threshold, window_width)
 
 class VerticalPitchTrackingView(QGraphicsView):
     def __init__(self, *args, **kargs):
@@ -137,77 +169,221 @@ class VerticalPitchTrackingView(QGraphicsView):
 
 
 
+# Blocks of pitch tracking are computed here, so that the GUI never waits for them.
+NOTE_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+
+# VerticalPitchTrackingScene shows a bar per piano key for how loud that note is at the current
+# timestamp. Pitch tracking is computed in blocks of frames (see notes.analyze_block) by the
+# selected engine, only where it's shown: the block at the timestamp, the blocks ahead of it and
+# those of the loop. Changing the parameters thus only costs a block, regardless of the length of
+# the song.
+#
+# Blocks are always computed in the background. While the block at the timestamp is missing, e.g.
+# right after the parameters changed, the bars keep showing what they did before, marked as being
+# recomputed, and switch over once it arrives. Each block is requested under the parameters it's
+# computed with, so results that arrive after the parameters changed again never show up in their
+# place, and requests that haven't started yet when the parameters change are cancelled. A block
+# that fails shows its error instead, and isn't requested again until the parameters are set again,
+# e.g. by Refresh.
+#
+# Blocks are kept per (audio identity, engine, threshold, window size, block index), up to
+# MAX_BLOCKS, least recently used first out, so that going back to earlier parameters doesn't
+# pitch-track again.
 class VerticalPitchTrackingScene(QGraphicsScene):
+    MAX_BLOCKS = 256
+    # Blocks after the one at the timestamp to compute in the background.
+    PREFETCH_BLOCKS = 4
+    # Blocks from the start of the loop to compute in the background, since playback returns there.
+    PREFETCH_LOOP_BLOCKS = 8
+    KEY_WIDTH = 20
+    KEY_HEIGHT = 100
+
     def __init__(self, *args, **kargs):
         super(VerticalPitchTrackingScene, self).__init__(*args, **kargs)
 
+        self.identity = None
         self.audio_data = None
         self.sr = None
-        self.piptrack = None
+        self.engine = None
+        self.threshold = None
+        self.window_width = None
         self.timestamp = 0.0
+        self.loop_start = None
+        self.loop_end = None
+        # The frame that the bars show, and their heights.
+        self.frame = None
+        self.heights = numpy.zeros(88)
+        # (identity, engine, threshold, window width, block index) -> (notes, maxima), least recently
+        # used first.
+        self.blocks = OrderedDict()
+        # Same keys -> Future for blocks that are being computed.
+        self.pending = {}
+        # Same keys -> the exception for blocks that failed, so that they aren't tried again and again
+        # until update_params.
+        self.failed = {}
 
         self.setBackgroundBrush(Qt.GlobalColor.lightGray)
 
         self.rects = [None] * 88
+        self.recomputing_text = None
 
-    def set_data(self, audio_data, sr, threshold, window_width):
-        self.pitches, self.magnitudes = librosa.piptrack(
-            y=librosa.to_mono(y=audio_data), 
-            sr=sr,
-            threshold=threshold, 
-            n_fft=window_width, 
-            win_length=window_width,
-        )
+    # Shows pitch tracking for audio_data, which identity tells apart from other audio.
+    def set_data(self, identity, audio_data, sr, engine, threshold, window_width):
+        self.identity = identity
         self.audio_data = audio_data
         self.sr = sr
-        self.create_chart()
-
-    def update_params(self, threshold, window_width):
-        self.pitches, self.magnitudes = librosa.piptrack(
-            y=librosa.to_mono(y=self.audio_data), 
-            sr=self.sr,
-            threshold=threshold, 
-            n_fft=window_width, 
-            win_length=window_width,
-        )
+        if self.rects[0] is None:
+            self.create_chart()
+        self.update_params(engine, threshold, window_width)
+
+    def update_params(self, engine, threshold, window_width):
+        self.engine = engine
+        self.threshold = threshold
+        self.window_width = window_width
+        # Blocks for other parameters or audio that haven't been started on aren't needed anymore.
+        for (key, future) in list(self.pending.items()):
+            if key[:4] != (self.identity, engine, threshold, window_width) and future.cancel():
+                del self.pending[key]
+        # Failures may have been passing, e.g. running out of memory, so they're given another try.
+        self.failed = {}
+        self.frame = None
         self.update()
 
+    def set_loop(self, loop_start, loop_end):
+        self.loop_start = loop_start
+        self.loop_end = loop_end
+
+    def block_key(self, index):
+        return (self.identity, self.engine, self.threshold, self.window_width, index)
+
+    # Requests block index ahead of any blocks that are only being prefetched.
+    def request(self, index):
+        if self.block_key(index) in self.pending:
+            return
+        # The prefetches that haven't started yet are requested again once this block is shown.
+        for (key, future) in list(self.pending.items()):
+            if future.cancel():
+                del self.pending[key]
+        self.prefetch(index)
+
+    def add_block(self, key, block):
+        self.blocks[key] = block
+        while len(self.blocks) > VerticalPitchTrackingScene.MAX_BLOCKS:
+            self.blocks.popitem(last=False)
+
+    def prefetch(self, index):
+        key = self.block_key(index)
+        if key in self.blocks or key in self.pending or key in self.failed:
+            return
+        future = NOTE_EXECUTOR.submit(
+            notes.analyze_block, self.engine, self.audio_data, self.sr, self.threshold, self.window_width, index)
+        future.add_done_callback(lambda future: self._post_block(key, future))
+        self.pending[key] = future
+
+    def _post_block(self, key, future):
+        if future.cancelled():
+            return
+        try:
+            (block_notes, maxima) = future.result()
+            event = events.NoteBlockEvent(key, block_notes, maxima)
+        except Exception as e:
+            event = events.NoteBlockEvent(key, None, None, e)
+        try:
+            QApplication.postEvent(self, event)
+        except RuntimeError:
+            # The scene was deleted in the meantime, e.g. because the application is closing.
+            pass
+
+    def prefetch_around(self, index):
+        block_count = notes.block_count(self.engine, self.audio_data.shape[-1], self.window_width)
+        indices = list(range(index + 1, index + 1 + VerticalPitchTrackingScene.PREFETCH_BLOCKS))
+        if self.loop_start is not None and self.loop_end is not None:
+            first = notes.frame_at(self.engine, self.loop_start, self.sr, self.window_width) // notes.BLOCK_FRAMES
+            last = notes.frame_at(self.engine, self.loop_end, self.sr, self.window_width) // notes.BLOCK_FRAMES
+            indices += range(first, min(last + 1, first + VerticalPitchTrackingScene.PREFETCH_LOOP_BLOCKS))
+        for i in indices:
+            if 0 <= i < block_count:
+                self.prefetch(i)
+
+    def customEvent(self, event: QEvent):
+        if event.type() == events.NoteBlockEvent.TYPE:
+            key = event.get_key()
+            if self.pending.pop(key, None) is not None:
+                if event.get_error() is not None:
+                    self.failed[key] = event.get_error()
+                else:
+                    self.add_block(key, (event.get_notes(), event.get_maxima()))
+                if self.recomputing_text.isVisible():
+                    # Possibly the block the bars are waiting for.
+                    self.update()
+            return
+        return super().customEvent(event)
+
     def create_chart(self):
         self.clear()
-        key_width = 20
-        key_height = 100
         pen = QtGui.QPen(Qt.GlobalColor.black)
         brush = QtGui.QBrush(Qt.GlobalColor.white)
+        key_width = VerticalPitchTrackingScene.KEY_WIDTH
+        key_height = VerticalPitchTrackingScene.KEY_HEIGHT
         for key in range(0, 88):
-            self.rects[key] = self.addRect(key * key_width, 0, key_width, key_height, pen, brush)
+            self.rects[key] = self.addRect(key * key_width, key_height, key_width, 0, pen, brush)
             text = self.addText(utils.piano_key_to_note(key), QtGui.QFont("Courier New"))
             text.setDefaultTextColor(Qt.GlobalColor.black)
             text.setPos(key * key_width, key_height + 5)
-        self.update()
+        self.heights = numpy.zeros(88)
+        self.recomputing_text = self.addSimpleText("Recomputing...", QtGui.QFont("Courier New"))
+        self.recomputing_text.setPos(5, 5)
+        self.recomputing_text.setZValue(1)
+        self.recomputing_text.hide()
 
     def set_timestamp(self, timestamp):
         self.timestamp = timestamp
 
     def update(self):
-        duration = librosa.get_duration(y=self.audio_data, sr=self.sr)
-        t = int(self.pitches.shape[1] * self.timestamp / duration)
-        pitches = self.pitches[:,t]
-        magnitudes = self.magnitudes[:,t]
-        magnitudes_by_note = utils.group_by_note(pitches, magnitudes)
-        max_magnitude = max(max(magnitudes), 50)
-        #redunant, fix
-        key_width = 20
-        key_height = 100
-        for key in range(0, 88):
-            ms = magnitudes_by_note[key]
-            h = key_height * (ms / max_magnitude)
+        if self.audio_data is None:
+            # Still loading.
+            return
+        frame_count = notes.frame_count(self.engine, self.audio_data.shape[-1], self.window_width)
+        t = min(max(notes.frame_at(self.engine, self.timestamp, self.sr, self.window_width), 0), frame_count - 1)
+        if t == self.frame:
+            return
+        index = t // notes.BLOCK_FRAMES
+        key = self.block_key(index)
+        if key in self.failed:
+            self.frame = None
+            self.recomputing_text.setText("Pitch tracking failed: {}".format(self.failed[key]))
+            self.recomputing_text.show()
+            return
+        if key not in self.blocks:
+            # Keep showing the previous frame until the block arrives, see customEvent.
+            self.request(index)
+            self.recomputing_text.setText("Recomputing...")
+            self.recomputing_text.show()
+            return
+        self.blocks.move_to_end(key)
+        (block_notes, maxima) = self.blocks[key]
+        self.frame = t
+        self.recomputing_text.hide()
+        column = t - index * notes.BLOCK_FRAMES
+        # Magnitudes are shown relative to the loudest bin at the time, unless that's quiet.
+        maximum = max(float(maxima[column]), notes.ENGINES[self.engine].QUIET)
+        heights = VerticalPitchTrackingScene.KEY_HEIGHT * block_notes[:, column] / maximum
+        # Leave bars alone that would move by less than a pixel.
+        changed = numpy.flatnonzero(numpy.abs(heights - self.heights) >= 0.5)
+        key_width = VerticalPitchTrackingScene.KEY_WIDTH
+        key_height = VerticalPitchTrackingScene.KEY_HEIGHT
+        for key in changed.tolist():
+            h = float(heights[key])
             self.rects[key].setRect(key * key_width, key_height - h, key_width, h)
+            self.heights[key] = h
+        self.prefetch_around(index)
 
 class MainView(QWidget):
     def __init__(self, audio_player, open_action, import_action, *args, **kargs):
         super(MainView, self).__init__(*args, **kargs)
 
         self.audio_view = None
+        self.overview = None
         self.audio_player = audio_player
         layout = QBoxLayout(QBoxLayout.Direction.Down)
 
@@ -223,10 +399,16 @@ class MainView(QWidget):
 
         self.setLayout(layout)
 
-    def show_audio(self, audio_data, on_loop_change):
+    def show_audio(self, audio_data, peaks, on_loop_change, on_cursor_change):
         while self.layout().count() > 0:
-            self.layout().takeAt(0)
-        self.audio_view = audio_view.AudioWaveformView(audio_data, self.audio_player, on_loop_change, self)
+            item = self.layout().takeAt(0)
+            if item.widget() is not None:
+                # E.g. the previous song's views, which would otherwise stay around.
+                item.widget().hide()
+                item.widget().deleteLater()
+        self.audio_view = audio_view.AudioWaveformView(audio_data, peaks, self.audio_player, on_loop_change, on_cursor_change, self)
+        self.overview = overview.OverviewWidget(peaks, audio_data, self.audio_view, self)
+        self.layout().addWidget(self.overview)
         self.layout().addWidget(self.audio_view)
 
     def zoom_in(self):
@@ -269,12 +451,32 @@ class EffectsDialog(QDialog):
         self.setLayout(layout)
 
 class MainWindow(QMainWindow):
+    # Keys that act for as long as they're held down, see handle_key_presses.
+    HELD_KEYS = [Qt.Key.Key_A, Qt.Key.Key_D, Qt.Key.Key_E, Qt.Key.Key_Q]
 
     def __init__(self, audio_player: audio.AudioPlayer):
         super().__init__()
 
         self.audio_player = audio_player
         self.audio_data = None
+        self.decoder = None
+        self.load_pipeline = None
+        self.pcm_cache = cache.PcmCache()
+        self.render_cache = render.RenderCache(self.pcm_cache)
+        # Started the first time effects are rendered or notes are transcribed, since the workers take a
+        # while to start up.
+        self.render_pool = None
+        self.render_job = None
+        self.render_job_key = None
+        # The open song's note events, once they've been transcribed.
+        self.note_index = None
+        self.transcription_job = None
+        # The unprocessed audio of the open song, its file, and the key it's cached under. The key is
+        # provisional until the file has been hashed (see load).
+        self.source_buffer = None
+        self.source_path = None
+        self.source_key = None
+        self.source_key_provisional = False
 
         self.main_view = None
         self.key_pressed = dict()
@@ -371,19 +573,39 @@ class MainWindow(QMainWindow):
         self.importAction = fileMenu.addAction("Import From YouTube...", QtGui.QKeySequence("Ctrl+Y"))
 
         self.importAction.triggered.connect(self.import_from_youtube)
+        fileMenu.addSeparator()
+        self.pruneCacheAction = fileMenu.addAction("Prune Audio Cache...")
+        self.pruneCacheAction.triggered.connect(self.prune_cache)
 
         viewMenu = self.menuBar().addMenu("View")
         self.zoomInAction = viewMenu.addAction("Zoom In", QtGui.QKeySequence.StandardKey.ZoomIn)
         self.zoomOutAction = viewMenu.addAction("Zoom Out", QtGui.QKeySequence.StandardKey.ZoomOut)
+        viewMenu.addSeparator()
+        self.spectrogramAction = viewMenu.addAction("Spectrogram", QtGui.QKeySequence("Ctrl+G"))
+        self.spectrogramAction.setCheckable(True)
+        self.spectrogramAction.toggled.connect(self.set_spectrogram_visible)
+        self.pianoRollAction = viewMenu.addAction("Piano Roll", QtGui.QKeySequence("Ctrl+T"))
+        self.pianoRollAction.setCheckable(True)
+        self.pianoRollAction.toggled.connect(self.set_piano_roll_visible)
+
+        notesMenu = self.menuBar().addMenu("Notes")
+        self.nextNoteAction = notesMenu.addAction("Next Note", QtGui.QKeySequence("Alt+Right"))
+        self.nextNoteAction.triggered.connect(lambda: self.jump_to_note(1))
+        self.previousNoteAction = notesMenu.addAction("Previous Note", QtGui.QKeySequence("Alt+Left"))
+        self.previousNoteAction.triggered.connect(lambda: self.jump_to_note(-1))
+        self.loopNotesAction = notesMenu.addAction("Loop Notes at Cursor", QtGui.QKeySequence("Ctrl+L"))
+        self.loopNotesAction.triggered.connect(self.loop_notes_at_cursor)
+        self.set_note_actions_enabled(False)
 
         toolsMenu = self.menuBar().addMenu("Tools")
         setPlaybackRateAction = toolsMenu.addAction("Set Playback Rate", QtGui.QKeySequence("Ctrl+R"))
         setPlaybackRateAction.triggered.connect(self.set_playback_rate)
-        effectsAction = toolsMenu.addAction("Effects...", QtGui.QKeySequence("Ctrl+E"))
-        effectsAction.triggered.connect(self.set_effects)
+        self.effectsAction = toolsMenu.addAction("Effects...", QtGui.QKeySequence("Ctrl+E"))
+        self.effectsAction.triggered.connect(self.set_effects)
 
+        # Only runs while one of the keys handled by handle_key_presses is held down.
         self.timer = QTimer()
-        self.timer.start(15)
+        self.timer.setInterval(15)
         self.timer.timeout.connect(self.handle_key_presses)
 
         self.main_view = MainView(self.audio_player, self.openAction, self.importAction, self)
@@ -397,6 +619,9 @@ class MainWindow(QMainWindow):
         return key in self.key_pressed and self.key_pressed[key]
 
     def handle_key_presses(self):
+        if not any(self.is_key_pressed(key) for key in MainWindow.HELD_KEYS):
+            self.timer.stop()
+            return
         if self.audio_player.ready and not self.audio_player.playing:
 
             if self.is_key_pressed(Qt.Key.Key_D):
@@ -411,6 +636,9 @@ class MainWindow(QMainWindow):
                 else:
                     self.audio_player.set_current_timestamp(self.audio_player.current_timestamp - 0.01)
 
+            if self.is_key_pressed(Qt.Key.Key_D) or self.is_key_pressed(Qt.Key.Key_A):
+                self.start_playback_tracking()
+
             if self.main_view != None:
                 if self.is_key_pressed(Qt.Key.Key_E):
                     if self.is_key_pressed(Qt.Key.Key_Shift):
@@ -464,37 +692,301 @@ class MainWindow(QMainWindow):
         self.load(path)
 
     def load(self, path):
-        self.audio_data, sampling_rate = librosa.load(path, sr=None, mono=False)
-        self.audio_player.set_audio_state(self.audio_data, sampling_rate, 1.0)
-        self.main_view.show_audio(self.audio_data, self.on_loop_change)
-        self.vertical_pitch_tracking_widget.set_audio_data(self.audio_data, sampling_rate)
+        # Abandon whatever is left of loading the previous song.
+        if self.load_pipeline is not None:
+            self.load_pipeline.cancel()
+            self.load_pipeline = None
+        self.cancel_render_job()
+        self.cancel_transcription_job()
+        self.note_index = None
+        self.set_note_actions_enabled(False)
+        self.decoder = None
+        self.source_path = path
+        self.source_key = self.pcm_cache.known_key(path)
+        # Hashing a file for its key reads all of it, so for files that weren't opened before, that's left
+        # to the load pipeline. Until it's done, a provisional key stands in.
+        self.source_key_provisional = self.source_key is None
+        self.harmonic_only = False
+        cached = self.pcm_cache.open(self.source_key) if self.source_key is not None else None
+        source_peaks = None
+        if self.source_key_provisional:
+            self.source_key = self.pcm_cache.provisional_key(path)
+        if cached is not None:
+            (self.source_buffer, sampling_rate) = cached
+            peaks_path = self.pcm_cache.attachment(self.source_key, library.PEAKS_ATTACHMENT)
+            if peaks_path is not None:
+                source_peaks = peaks.PeakPyramid.load(peaks_path)
+        else:
+            try:
+                # Decode in the background so that the song can be shown and played right away.
+                self.decoder = source.StreamingDecoder(path, self.pcm_cache.reserve(self.source_key))
+            except source.StreamingDecoder.UNSTREAMABLE:
+                audio_data, sampling_rate = librosa.load(path, sr=None, mono=False)
+                # Loading blocks anyway, so the file might as well be hashed right away.
+                self.source_key = self.pcm_cache.key(path)
+                self.source_key_provisional = False
+                self.source_buffer = pcm.PcmBuffer.create_at(self.pcm_cache.reserve(self.source_key), audio_data)
+                self.pcm_cache.store(self.source_key, self.source_buffer, sampling_rate)
+            else:
+                self.decoder.start()
+                self.source_buffer = self.decoder.buffer
+                sampling_rate = self.decoder.sampling_rate
+        self.audio_player.set_audio_buffer(self.source_buffer, sampling_rate, self.play_rate)
+        # Keep using the mapped buffer so that the decoded song is only held in memory once.
+        self.audio_data = self.source_buffer.samples()
+        if source_peaks is None:
+            source_peaks = peaks.PeakPyramid(self.source_buffer.shape[0])
+        self.main_view.show_audio(self.audio_data, source_peaks, self.on_loop_change, self.on_cursor_change)
+        self.set_spectrogram_visible(self.spectrogramAction.isChecked())
+        # Effects need the whole song.
+        self.effectsAction.setEnabled(False)
+        # The song is playable at this point; everything else is computed in the background.
+        self.load_pipeline = loading.LoadPipeline(
+            self,
+            self.audio_player.audio_buffer,
+            self.audio_player.audio_state.sampling_rate,
+            self.decoder,
+            source_peaks,
+            path if self.source_key_provisional else None,
+        )
+        self.load_pipeline.start()
+
+    def prune_cache(self):
+        (megabytes, result) = QInputDialog.getInt(
+            None, 
+            "Prune Audio Cache", 
+            "Keep at most (MB):", 
+            value=int(self.pcm_cache.size() / (1024 * 1024)), 
+            min=0, 
+            max=1024 * 1024,
+        )
+        if not result:
+            return
+        self.pcm_cache.prune(megabytes * 1024 * 1024, self.source_key)
+
+    def on_decode_finished(self, key):
+        if self.source_key_provisional and key is not None:
+            self.pcm_cache.remember_key(self.source_path, key)
+            self.source_key = key
+            self.source_key_provisional = False
+        if self.decoder is not None and self.decoder.error is not None:
+            # Keep playing what was decoded, but don't cache it or analyze it as if it were the whole song.
+            error = self.decoder.error
+            self.decoder = None
+            self.show_error("Decoding Failed", error)
+            return
+        # If the key is still provisional, the file couldn't be hashed, and its audio isn't cached.
+        if self.decoder is not None and self.decoder.completed() and not self.source_key_provisional:
+            self.pcm_cache.store(self.source_key, self.decoder.buffer, self.decoder.sampling_rate)
+            if self.audio_player.audio_buffer is self.decoder.buffer:
+                # Storing moved the buffer's file, which the audio process may not have mapped yet.
+                self.audio_player.audio_buffer_moved()
+        self.decoder = None
+        if self.pcm_cache.attachment(self.source_key, library.PEAKS_ATTACHMENT) is None:
+            peaks_path = self.pcm_cache.attach(self.source_key, library.PEAKS_ATTACHMENT)
+            if peaks_path is not None:
+                self.load_pipeline.peaks.save(peaks_path)
+        self.effectsAction.setEnabled(True)
+        self.vertical_pitch_tracking_widget.set_audio_data(self.source_key, self.audio_data, self.audio_player.audio_state.sampling_rate)
+        notes_path = self.pcm_cache.attachment(self.source_key, library.NOTES_ATTACHMENT)
+        if notes_path is not None:
+            self.set_note_index(transcription.NoteIndex.load(notes_path))
+        elif self.pianoRollAction.isChecked():
+            self.transcribe()
+
+    def show_error(self, title, error):
+        QMessageBox.warning(self, title, str(error))
+
+    def set_spectrogram_visible(self, visible):
+        if self.main_view.audio_view is not None:
+            self.main_view.audio_view.audio_waveform_scene.set_spectrogram_visible(visible)
+
+    # Shows or hides the open song's notes over its waveform, transcribing them first if necessary.
+    def set_piano_roll_visible(self, visible):
+        if self.main_view.audio_view is None:
+            return
+        if not visible:
+            self.main_view.audio_view.audio_waveform_scene.set_notes(None)
+        elif self.note_index is not None:
+            self.main_view.audio_view.audio_waveform_scene.set_notes(self.note_index)
+        elif self.load_pipeline is None:
+            # Otherwise, transcription starts once the song is decoded, see on_decode_finished.
+            self.transcribe()
+
+    # Transcribes the open song's notes in the background, see TranscriptionJob.
+    def transcribe(self):
+        if self.transcription_job is not None:
+            return
+        if self.render_pool is None:
+            self.render_pool = ProcessPoolExecutor()
+        self.transcription_job = loading.TranscriptionJob(
+            self,
+            self.render_pool,
+            self.source_buffer,
+            self.audio_player.audio_state.sampling_rate,
+        )
+        self.transcription_job.start()
+
+    def cancel_transcription_job(self):
+        if self.transcription_job is not None:
+            self.transcription_job.cancel()
+            self.transcription_job = None
+
+    def set_note_index(self, note_index):
+        self.note_index = note_index
+        self.set_note_actions_enabled(True)
+        if self.pianoRollAction.isChecked():
+            self.main_view.audio_view.audio_waveform_scene.set_notes(note_index)
+
+    def set_note_actions_enabled(self, enabled):
+        self.nextNoteAction.setEnabled(enabled)
+        self.previousNoteAction.setEnabled(enabled)
+        self.loopNotesAction.setEnabled(enabled)
+
+    # Moves playback to the next note onset after the current timestamp if direction is positive, or the
+    # last one before it otherwise.
+    def jump_to_note(self, direction):
+        if self.note_index is None:
+            return
+        timestamp = self.audio_player.current_timestamp
+        if direction > 0:
+            onset = self.note_index.next_onset(timestamp)
+        else:
+            onset = self.note_index.previous_onset(timestamp)
+        if onset is None:
+            return
+        playing = self.audio_player.playing
+        if playing:
+            self.audio_player.stop()
+        self.audio_player.set_current_timestamp(onset)
+        if playing:
+            self.audio_player.play()
+        self.start_playback_tracking()
+
+    # Selects the notes sounding at the current timestamp, or if there are none, those at the next onset.
+    def loop_notes_at_cursor(self):
+        if self.note_index is None or self.main_view.audio_view is None:
+            return
+        timestamp = self.audio_player.current_timestamp
+        shown = self.note_index.active_at(timestamp)
+        if len(shown) == 0:
+            onset = self.note_index.next_onset(timestamp)
+            if onset is None:
+                return
+            shown = self.note_index.active_at(onset)
+        loop_start = float(self.note_index.onsets[shown].min())
+        loop_end = float(self.note_index.offsets[shown].max())
+        playing = self.audio_player.playing
+        if playing:
+            self.audio_player.stop()
+        self.main_view.audio_view.audio_waveform_scene.set_loop(loop_start, loop_end)
+        self.audio_player.set_current_timestamp(loop_start)
+        if playing:
+            self.audio_player.play()
+        self.start_playback_tracking()
+
+    def on_cursor_change(self, timestamp):
+        self.vertical_pitch_tracking_widget.start_tracking()
+
+    # Makes the cursor and pitch tracking follow the audio player, e.g. after starting playback or
+    # moving the playback position while paused.
+    def start_playback_tracking(self):
+        if self.main_view.audio_view is not None:
+            self.main_view.audio_view.audio_waveform_scene.start_tracking()
+        self.vertical_pitch_tracking_widget.start_tracking()
 
     def on_loop_change(self, loop_start, loop_end):
+        if self.main_view.overview is not None:
+            self.main_view.overview.update()
         self.audio_player.set_start_timestamp(loop_start)
         self.audio_player.set_end_timestamp(loop_end)
         self.range_start_widget.setText(utils.seconds_to_time_str(loop_start))
         self.range_end_widget.setText(utils.seconds_to_time_str(loop_end))
 
     def set_playback_rate(self):
-        (rate, _) = QInputDialog.getDouble(None, "Set Playback Rate", "Rate", value=1.0)
-        # todo: handle the waiting period gracefully
-        new_data = librosa.effects.time_stretch(y=self.audio_data, rate=rate)
-        self.audio_player.set_audio_state(new_data, self.audio_player.audio_state.sampling_rate, rate)
+        if self.audio_player.audio_state is None:
+            return
+        (rate, result) = QInputDialog.getDouble(None, "Set Playback Rate", "Rate", value=self.play_rate, min=0.1, max=2.0)
+        if not result:
+            return
+        # The audio process stretches the audio as it plays, so this takes effect immediately.
+        self.play_rate = rate
+        self.audio_player.set_play_rate(rate)
 
     def set_effects(self):
+        if self.audio_player.audio_state is None:
+            return
         effects_dialog = EffectsDialog(self.play_rate, self.harmonic_only)
         result = effects_dialog.exec()
         if result == 1:
             self.play_rate = effects_dialog.rate_input.value()
-            self.harmonic_only = effects_dialog.harmonic_checkbox.isChecked()
-            new_data = self.audio_data
-            if abs(self.play_rate- 1) > 0.01:
-                new_data = librosa.effects.time_stretch(y=self.audio_data, sr=self.play_rate)
-            if self.harmonic_only:
-                new_data = librosa.effects.harmonic(y=new_data)
-            self.audio_player.set_audio_state(new_data, self.audio_player.audio_state.sampling_rate, self.play_rate)
-            self.vertical_pitch_tracking_widget.set_audio_data(self.audio_data, self.audio_player.audio_state.sampling_rate)
-
+            # Right away, even if the other effects take a while to render, and to the stream that's
+            # already playing.
+            self.audio_player.set_play_rate(self.play_rate)
+            harmonic_only = effects_dialog.harmonic_checkbox.isChecked()
+            if harmonic_only != self.harmonic_only:
+                self.harmonic_only = harmonic_only
+                self.render_effects()
+
+    # Switches playback to the open song with the current effects applied. If they weren't rendered
+    # before, they're rendered in the background, starting with the selection; playback switches over
+    # as soon as that's done.
+    def render_effects(self):
+        self.cancel_render_job()
+        sampling_rate = self.audio_player.audio_state.sampling_rate
+        if not self.harmonic_only:
+            self.audio_player.replace_audio_buffer(self.source_buffer, sampling_rate, self.play_rate)
+            return
+        key = render.render_key(self.source_key, harmonic_only=self.harmonic_only)
+        cached = self.render_cache.get(key)
+        if cached is not None:
+            self.audio_player.replace_audio_buffer(cached[0], sampling_rate, self.play_rate)
+            return
+        if self.render_pool is None:
+            self.render_pool = ProcessPoolExecutor()
+        self.render_job = loading.RenderJob(
+            self,
+            self.render_pool,
+            self.source_buffer,
+            self.render_cache.reserve(key, self.source_buffer.shape),
+            "harmonic",
+            {},
+            sampling_rate,
+            int(self.audio_player.start_timestamp * sampling_rate),
+            int(self.audio_player.end_timestamp * sampling_rate),
+        )
+        self.render_job_key = key
+        self.render_job.start()
+
+    def cancel_render_job(self):
+        if self.render_job is not None:
+            # The partially rendered buffer is removed by the next prune (see PcmCache.reserve).
+            self.render_job.cancel()
+            self.render_job = None
+            self.render_job_key = None
+
+    def on_render_progress(self, complete):
+        output = self.render_job.output
+        sampling_rate = self.audio_player.audio_state.sampling_rate
+        if complete:
+            self.render_cache.commit(self.render_job_key, output, sampling_rate)
+            self.render_job = None
+            self.render_job_key = None
+            if self.audio_player.audio_buffer is output:
+                # Committing moved the buffer's file, which the audio process may not have mapped yet.
+                self.audio_player.audio_buffer_moved()
+        if self.audio_player.audio_buffer is not output:
+            self.audio_player.replace_audio_buffer(output, sampling_rate, self.play_rate)
+
+    # Switches back to the unprocessed audio after rendering failed.
+    def on_render_failed(self, error):
+        output = self.render_job.output
+        self.render_job = None
+        self.render_job_key = None
+        self.harmonic_only = False
+        if self.audio_player.audio_buffer is output:
+            self.audio_player.replace_audio_buffer(self.source_buffer, self.audio_player.audio_state.sampling_rate, self.play_rate)
+        self.show_error("Rendering Effects Failed", error)
 
     def keyReleaseEvent(self, a0: QtGui.QKeyEvent) -> None:
         self.key_pressed[a0.key()] = False 
@@ -502,6 +994,8 @@ class MainWindow(QMainWindow):
 
     def keyPressEvent(self, a0: QtGui.QKeyEvent) -> None:
         self.key_pressed[a0.key()] = True
+        if a0.key() in MainWindow.HELD_KEYS and not self.timer.isActive():
+            self.timer.start()
         if not self.audio_player.ready:
             return super().keyPressEvent(a0)
         if a0.key() == Qt.Key.Key_Space:
@@ -526,6 +1020,7 @@ class MainWindow(QMainWindow):
                 if self.start_from_beginning_checkbox.isChecked():
                     self.audio_player.set_current_timestamp(self.audio_player.start_timestamp)
                 self.audio_player.play()
+                self.start_playback_tracking()
             return
         elif event.type() == events.PauseEvent.TYPE:
             self.audio_player.stop()
@@ -538,7 +1033,42 @@ class MainWindow(QMainWindow):
                     self.audio_player.play()
                 else:
                     self.audio_player.set_current_timestamp(self.main_view.audio_view.audio_waveform_scene.loop_start)
+                self.start_playback_tracking()
         elif event.type() == events.SetLoopConfiguration.TYPE:
             self.audio_player.set_loop(event.get_loop_enabled())
+        elif event.type() in (events.PeaksUpdatedEvent.TYPE, events.DecodeFinishedEvent.TYPE):
+            if self.load_pipeline is None or event.get_token() is not self.load_pipeline.token:
+                # Left over from a song that is no longer open.
+                return
+            if event.type() == events.PeaksUpdatedEvent.TYPE:
+                self.main_view.audio_view.audio_waveform_scene.update_waveform()
+                self.main_view.overview.update_summary()
+            else:
+                self.on_decode_finished(event.get_key())
+                self.load_pipeline = None
+            return
+        elif event.type() == events.RenderProgressEvent.TYPE:
+            if self.render_job is None or event.get_token() is not self.render_job.token:
+                # Left over from a render that was cancelled.
+                return
+            self.on_render_progress(event.get_complete())
+            return
+        elif event.type() == events.JobFailedEvent.TYPE:
+            if self.render_job is not None and event.get_token() is self.render_job.token:
+                self.on_render_failed(event.get_error())
+            elif self.transcription_job is not None and event.get_token() is self.transcription_job.token:
+                self.transcription_job = None
+                self.show_error("Transcribing Notes Failed", event.get_error())
+            return
+        elif event.type() == events.TranscriptionEvent.TYPE:
+            if self.transcription_job is None or event.get_token() is not self.transcription_job.token:
+                # Left over from a song that is no longer open.
+                return
+            self.transcription_job = None
+            notes_path = self.pcm_cache.attach(self.source_key, library.NOTES_ATTACHMENT)
+            if notes_path is not None:
+                event.get_index().save(notes_path)
+            self.set_note_index(event.get_index())
+            return
         return super().customEvent(event)
  
\ No newline at end of file
@@ -0,0 +1,91 @@
+from PyQt6.QtWidgets import QWidget
+from PyQt6.QtCore import (
+    Qt,
+    QRectF,
+)
+from PyQt6 import QtGui
+from .waveform import draw_peaks
+
+# OverviewWidget is a strip above an AudioWaveformView that always shows the whole song, with the
+# part that's visible in the view and the selected loop marked on it. Clicking or dragging on it
+# scrolls the view there.
+#
+# The song is drawn once per size, from the coarsest levels of its PeakPyramid, so drawing it takes the
+# same time regardless of the song's length. Scrolling and zooming only move the markers; they don't
+# redraw the song, here or in the view.
+class OverviewWidget(QWidget):
+    HEIGHT = 40
+
+    def __init__(self, peaks, audio_data, audio_view, *args, **kargs):
+        super(OverviewWidget, self).__init__(*args, **kargs)
+        self.peaks = peaks
+        self.audio_data = audio_data
+        self.audio_view = audio_view
+        self.summary = None
+        self.setFixedHeight(OverviewWidget.HEIGHT)
+        scroll_bar = audio_view.horizontalScrollBar()
+        scroll_bar.valueChanged.connect(lambda value: self.update())
+        scroll_bar.rangeChanged.connect(lambda minimum, maximum: self.update())
+
+    # Draws the song again, e.g. after more of it was summarized.
+    def update_summary(self):
+        self.summary = None
+        self.update()
+
+    def resizeEvent(self, event: QtGui.QResizeEvent) -> None:
+        self.summary = None
+        return super().resizeEvent(event)
+
+    def paintEvent(self, event: QtGui.QPaintEvent) -> None:
+        if self.summary is None or self.summary.size() != self.size():
+            self.summary = self.draw_summary()
+        painter = QtGui.QPainter(self)
+        painter.drawPixmap(0, 0, self.summary)
+
+        scene = self.audio_view.audio_waveform_scene
+        # An empty song has no loop or visible part to mark.
+        if scene.duration > 0 and scene.width() > 0:
+            seconds_to_px = self.width() / scene.duration
+            painter.fillRect(
+                QRectF(scene.loop_start * seconds_to_px, 0, (scene.loop_end - scene.loop_start) * seconds_to_px, self.height()),
+                QtGui.QColor(0, 0, 0, 100),
+            )
+            scene_to_px = self.width() / scene.width()
+            painter.setPen(QtGui.QPen(Qt.GlobalColor.red))
+            painter.drawRect(QRectF(
+                self.audio_view.horizontalScrollBar().value() * scene_to_px,
+                0,
+                min(self.audio_view.viewport().width(), scene.width()) * scene_to_px - 1,
+                self.height() - 1,
+            ))
+        painter.end()
+
+    def draw_summary(self):
+        summary = QtGui.QPixmap(self.size())
+        summary.fill(Qt.GlobalColor.gray)
+        width = self.width()
+        # Leave out the part that isn't summarized yet.
+        drawn = int(width * self.peaks.complete_frames / self.peaks.frame_count) if self.peaks.frame_count > 0 else 0
+        if drawn > 0:
+            (mins, maxes, rmses) = self.peaks.query(
+                self.audio_data,
+                0,
+                min(int(drawn * self.peaks.frame_count / width), self.peaks.frame_count),
+                drawn,
+            )
+            painter = QtGui.QPainter(summary)
+            draw_peaks(painter, mins, maxes, rmses, self.height())
+            painter.end()
+        return summary
+
+    def mousePressEvent(self, event: QtGui.QMouseEvent) -> None:
+        self.jump_to(event.position().x())
+
+    def mouseMoveEvent(self, event: QtGui.QMouseEvent) -> None:
+        if event.buttons() & Qt.MouseButton.LeftButton:
+            self.jump_to(event.position().x())
+
+    # Scrolls the view so that it's centered on the part of the song at x.
+    def jump_to(self, x):
+        scene_x = x / self.width() * self.audio_view.audio_waveform_scene.width()
+        self.audio_view.horizontalScrollBar().setValue(round(scene_x - self.audio_view.viewport().width() / 2))
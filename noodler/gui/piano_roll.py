@@ -0,0 +1,66 @@
+from PyQt6.QtWidgets import QGraphicsItem
+from PyQt6.QtCore import (
+    Qt,
+    QRectF,
+)
+from PyQt6 import QtGui
+import numpy
+
+# PianoRollItem draws a song's note events (see transcription.NoteIndex) over its waveform, one row
+# per piano key from the lowest to the highest key in the song, lowest at the bottom. Louder notes are
+# drawn more opaque. Like RulerItem, it only looks up and draws the notes in the exposed part, so
+# neither zooming nor the length of the song affect the cost of a repaint.
+class PianoRollItem(QGraphicsItem):
+    # Notes are drawn in this many steps of opacity, to keep the number of brush changes down.
+    VELOCITY_STEPS = 4
+
+    def __init__(self, index, duration, width, height, *args, **kargs):
+        super(PianoRollItem, self).__init__(*args, **kargs)
+        self.index = index
+        self.duration = duration
+        self.width = width
+        self.height = height
+        # Needed for option.exposedRect in paint.
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption)
+        if len(index) > 0:
+            self.lowest_key = int(index.keys.min())
+            self.highest_key = int(index.keys.max())
+        else:
+            self.lowest_key = 0
+            self.highest_key = 87
+        self.brushes = [
+            QtGui.QBrush(QtGui.QColor(255, 140, 0, 255 * (step + 1) // PianoRollItem.VELOCITY_STEPS))
+            for step in range(PianoRollItem.VELOCITY_STEPS)
+        ]
+
+    def boundingRect(self):
+        return QRectF(0, 0, self.width, self.height)
+
+    def set_width(self, width):
+        self.prepareGeometryChange()
+        self.width = width
+
+    def paint(self, painter, option, widget = None):
+        exposed = option.exposedRect
+        if self.duration <= 0:
+            return
+        seconds_to_px = self.width / self.duration
+        shown = self.index.overlapping(exposed.left() / seconds_to_px, exposed.right() / seconds_to_px)
+        if len(shown) == 0:
+            return
+        row_height = self.height / (self.highest_key - self.lowest_key + 1)
+        lefts = self.index.onsets[shown] * seconds_to_px
+        # Keep short notes visible when zoomed out.
+        widths = numpy.maximum(self.index.offsets[shown] * seconds_to_px - lefts, 1.0)
+        tops = (self.highest_key - self.index.keys[shown]) * row_height
+        steps = (self.index.velocities[shown] - 1) * PianoRollItem.VELOCITY_STEPS // 127
+        painter.setPen(Qt.PenStyle.NoPen)
+        for step in range(PianoRollItem.VELOCITY_STEPS):
+            selected = steps == step
+            if not selected.any():
+                continue
+            painter.setBrush(self.brushes[step])
+            painter.drawRects([
+                QRectF(left, top, width, row_height)
+                for (left, top, width) in zip(lefts[selected].tolist(), tops[selected].tolist(), widths[selected].tolist())
+            ])
@@ -0,0 +1,85 @@
+from collections import OrderedDict
+from PyQt6.QtWidgets import QGraphicsItem
+from PyQt6.QtCore import (
+    Qt,
+    QLineF,
+    QPointF,
+    QRectF,
+)
+from PyQt6 import QtGui
+from ..utils import utils
+
+# RulerItem draws the timeline above the waveform. Ticks are computed for the exposed part only, when
+# it's painted, so zooming just changes the ruler's width instead of rebuilding an item per tick, and
+# costs the same regardless of how long the song is. Labels are laid out once per distinct text and
+# kept as QStaticTexts.
+class RulerItem(QGraphicsItem):
+    # Tick resolutions to choose from, in ms.
+    RESOLUTIONS = [10, 100, 1000, 5000, 20000, 60000, 300000]
+    MIN_TICK_SPACING = 10
+    MAX_LABELS = 512
+
+    def __init__(self, duration, width, height, *args, **kargs):
+        super(RulerItem, self).__init__(*args, **kargs)
+        self.duration = duration
+        self.width = width
+        self.height = height
+        # Needed for option.exposedRect in paint.
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption)
+        self.font = QtGui.QFont("Courier New", 9)
+        self.pen = QtGui.QPen(Qt.GlobalColor.black)
+        # Label text -> QStaticText, least recently used first.
+        self.labels = OrderedDict()
+
+    def boundingRect(self):
+        return QRectF(0, 0, self.width, self.height)
+
+    def set_width(self, width):
+        self.prepareGeometryChange()
+        self.width = width
+
+    # Returns (smaller, bigger): the resolutions of unlabeled and labeled ticks, in ms.
+    def tick_resolutions(self):
+        ticks = [r for r in RulerItem.RESOLUTIONS if self.width * r / (self.duration * 1000) > RulerItem.MIN_TICK_SPACING]
+        if len(ticks) < 2:
+            # Very long songs: make do with the coarsest ticks.
+            ticks = RulerItem.RESOLUTIONS[-2:]
+        return (ticks[0], ticks[1])
+
+    def paint(self, painter, option, widget = None):
+        exposed = option.exposedRect
+        painter.setPen(self.pen)
+        if self.duration <= 0 or self.width <= 0:
+            # Nothing to put ticks on.
+            painter.drawLine(QLineF(exposed.left(), self.height, exposed.right(), self.height))
+            return
+        (smaller_tick, bigger_tick) = self.tick_resolutions()
+        ms_per_pixel = self.duration * 1000 / self.width
+        # Include the ticks just left of the exposed part, whose labels may reach into it.
+        first_ms = max(int((exposed.left() - 100) * ms_per_pixel) // smaller_tick * smaller_tick, 0)
+        last_ms = min(int(exposed.right() * ms_per_pixel) + smaller_tick, int(self.duration * 1000))
+
+        lines = [QLineF(exposed.left(), self.height, exposed.right(), self.height)]
+        labels = []
+        for ms in range(first_ms, last_ms, smaller_tick):
+            x = ms / ms_per_pixel
+            if ms % bigger_tick == 0:
+                lines.append(QLineF(x, 0, x, self.height))
+                labels.append((x, utils.seconds_to_time_str(ms / 1000)))
+            else:
+                lines.append(QLineF(x, self.height - 6, x, self.height))
+        painter.drawLines(lines)
+        painter.setFont(self.font)
+        for (x, text) in labels:
+            painter.drawStaticText(QPointF(x + 4, self.height - 26), self.label(text))
+
+    def label(self, text):
+        if text in self.labels:
+            self.labels.move_to_end(text)
+            return self.labels[text]
+        label = QtGui.QStaticText(text)
+        label.prepare(QtGui.QTransform(), self.font)
+        self.labels[text] = label
+        while len(self.labels) > RulerItem.MAX_LABELS:
+            self.labels.popitem(last=False)
+        return label
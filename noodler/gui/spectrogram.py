@@ -0,0 +1,180 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PyQt6.QtWidgets import QApplication, QGraphicsItem, QGraphicsObject
+from PyQt6.QtCore import (
+    Qt,
+    QEvent,
+    QRectF,
+)
+from PyQt6 import QtGui
+import librosa
+import math
+import numpy
+from . import events
+from ..audio.peaks import mono
+from ..utils import utils
+
+# Spectrogram tiles are computed here. NumPy's FFTs release the GIL, so the workers run in parallel
+# with each other and with the GUI.
+TILE_EXECUTOR = ThreadPoolExecutor(max_workers=2)
+
+# SpectrogramItem draws a song's spectrogram, lined up with its WaveformItem: it's drawn at the same
+# width and shares the scene, and with it the zoom and scroll position. Frequencies are on a log axis
+# with ROWS_PER_KEY rows per piano key, lowest key at the bottom.
+#
+# Like the waveform, it's drawn in tiles of TILE_WIDTH pixels, but these are always computed by
+# background workers, since they take an FFT per column. Until a tile arrives, its area is left blank.
+# Tiles are kept as QImages keyed by (width, tile index), at most MAX_TILES of them, so memory use
+# doesn't depend on the length of the song.
+#
+# While the song is still being decoded, tiles that reach past the decoded part are only shown until
+# update_audio is called, and are then computed again. Tiles that failed to compute are left blank
+# until then too.
+class SpectrogramItem(QGraphicsObject):
+    TILE_WIDTH = 256
+    MAX_TILES = 128
+    ROWS_PER_KEY = 3
+    WINDOW_SIZE = 8192
+    # The range of levels shown, in dB relative to a full scale sine.
+    MIN_DB = -80.0
+
+    def __init__(self, peaks, audio_data, sampling_rate, width, *args, **kargs):
+        super(SpectrogramItem, self).__init__(*args, **kargs)
+        self.peaks = peaks
+        self.audio_data = audio_data
+        self.sampling_rate = sampling_rate
+        self.width = width
+        self.height = 88 * SpectrogramItem.ROWS_PER_KEY
+        # Needed for option.exposedRect in paint.
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption)
+        # (width, tile index) -> QImage, least recently used first.
+        self.tiles = OrderedDict()
+        # (width, tile index) -> QImage for tiles that were computed before all their audio was decoded.
+        self.partial_tiles = {}
+        # (width, tile index) -> Future for tiles that are being computed.
+        self.pending = {}
+        # Same keys -> the exception for tiles that failed to compute.
+        self.failed = {}
+
+    def boundingRect(self):
+        return QRectF(0, 0, self.width, self.height)
+
+    # Recomputes tiles that were missing audio, e.g. after more of the song was decoded.
+    def update_audio(self):
+        if len(self.partial_tiles) > 0 or len(self.failed) > 0:
+            self.partial_tiles = {}
+            self.failed = {}
+            self.update()
+
+    def set_width(self, width):
+        self.prepareGeometryChange()
+        self.width = width
+        # Tiles for the previous width aren't needed anymore, unless they're already being computed.
+        for (key, future) in list(self.pending.items()):
+            if key[0] != width and future.cancel():
+                del self.pending[key]
+
+    def paint(self, painter, option, widget = None):
+        exposed = option.exposedRect
+        tile_count = int(math.ceil(self.width / SpectrogramItem.TILE_WIDTH))
+        first_tile = max(int(exposed.left() // SpectrogramItem.TILE_WIDTH), 0)
+        last_tile = min(int(exposed.right() // SpectrogramItem.TILE_WIDTH) + 1, tile_count)
+        painter.fillRect(exposed, Qt.GlobalColor.black)
+        for index in range(first_tile, last_tile):
+            key = (self.width, index)
+            if key in self.tiles:
+                self.tiles.move_to_end(key)
+                painter.drawImage(index * SpectrogramItem.TILE_WIDTH, 0, self.tiles[key])
+            elif key in self.partial_tiles:
+                painter.drawImage(index * SpectrogramItem.TILE_WIDTH, 0, self.partial_tiles[key])
+            elif key not in self.pending and key not in self.failed:
+                future = TILE_EXECUTOR.submit(
+                    render_tile, self.peaks, self.audio_data, self.sampling_rate, self.width, self.height, index)
+                future.add_done_callback(lambda future, key=key: self._post_tile(key, future))
+                self.pending[key] = future
+
+    def _post_tile(self, key, future):
+        if future.cancelled():
+            return
+        try:
+            (image, complete) = future.result()
+            event = events.TileRenderedEvent(key, image, complete)
+        except Exception as e:
+            event = events.TileRenderedEvent(key, None, False, e)
+        try:
+            QApplication.postEvent(self, event)
+        except RuntimeError:
+            # The item was deleted in the meantime, e.g. because another song was opened.
+            pass
+
+    def customEvent(self, event: QEvent):
+        if event.type() == events.TileRenderedEvent.TYPE:
+            key = event.get_key()
+            self.pending.pop(key, None)
+            if event.get_error() is not None:
+                self.failed[key] = event.get_error()
+                return
+            if event.get_complete():
+                self.tiles[key] = event.get_image()
+                while len(self.tiles) > SpectrogramItem.MAX_TILES:
+                    self.tiles.popitem(last=False)
+            else:
+                self.partial_tiles[key] = event.get_image()
+            if key[0] == self.width:
+                self.update(QRectF(key[1] * SpectrogramItem.TILE_WIDTH, 0, SpectrogramItem.TILE_WIDTH, self.height))
+            return
+        return super().customEvent(event)
+
+# Returns (bins, weights): for each row of the spectrogram, from the top, the FFT bin just below its
+# frequency and how much of the next bin to mix in.
+def frequency_rows(sampling_rate, window_size):
+    rows = 88 * SpectrogramItem.ROWS_PER_KEY
+    # The middle of each row, from the highest key down.
+    keys = (rows - 1 - numpy.arange(rows) + 0.5) / SpectrogramItem.ROWS_PER_KEY - 0.5
+    frequencies = librosa.midi_to_hz(utils.piano_key_to_midi(keys))
+    bins = frequencies * window_size / sampling_rate
+    lower = numpy.floor(bins).astype(numpy.int64)
+    return (lower, (bins - lower).astype(numpy.float32))
+
+# 256 colors from black through purple and orange to pale yellow.
+def color_table():
+    anchors = numpy.array([[0, 0, 0], [80, 18, 123], [182, 54, 121], [251, 136, 97], [252, 253, 191]])
+    positions = numpy.linspace(0, 255, len(anchors))
+    channels = [numpy.interp(numpy.arange(256), positions, anchors[:, c]).astype(int) for c in range(3)]
+    return [QtGui.qRgb(int(r), int(g), int(b)) for (r, g, b) in zip(*channels)]
+
+COLOR_TABLE = color_table()
+
+# Computes tile index of a spectrogram drawn width pixels wide, with one windowed FFT per pixel column
+# centered on it. Returns (image, complete), where complete is False if part of the audio the tile
+# needs isn't decoded yet. Runs on a worker thread.
+def render_tile(peaks, audio_data, sampling_rate, width, height, index):
+    window_size = SpectrogramItem.WINDOW_SIZE
+    frame_count = audio_data.shape[-1]
+    frames_per_pixel = frame_count / width
+    first = index * SpectrogramItem.TILE_WIDTH
+    last = min(first + SpectrogramItem.TILE_WIDTH, width)
+    centers = ((numpy.arange(first, last) + 0.5) * frames_per_pixel).astype(numpy.int64)
+    complete = peaks.complete() or peaks.complete_frames >= centers[-1] + window_size // 2
+
+    # Only read the frames that the columns' windows cover.
+    start = max(centers[0] - window_size // 2, 0)
+    end = min(centers[-1] + window_size // 2, frame_count)
+    samples = numpy.zeros(end - start + window_size, dtype=numpy.float32)
+    samples[window_size // 2:window_size // 2 + end - start] = mono(audio_data[..., start:end])
+    # samples[i] is frame start + i - window_size / 2, so a column's window starts at its center - start.
+    indices = (centers - start)[:, numpy.newaxis] + numpy.arange(window_size)
+    window = numpy.hanning(window_size).astype(numpy.float32)
+    magnitudes = numpy.abs(numpy.fft.rfft(samples[indices] * window, axis=1))
+
+    (lower, weights) = frequency_rows(sampling_rate, window_size)
+    rows = magnitudes[:, lower] * (1.0 - weights) + magnitudes[:, lower + 1] * weights
+    # A full scale sine peaks at half the window's sum.
+    decibels = 20.0 * numpy.log10(numpy.maximum(rows / (window.sum() / 2), 1e-10))
+    levels = numpy.clip((decibels - SpectrogramItem.MIN_DB) / -SpectrogramItem.MIN_DB * 255, 0, 255)
+    pixels = numpy.zeros((height, SpectrogramItem.TILE_WIDTH), dtype=numpy.uint8)
+    pixels[:, :last - first] = levels.T
+    image = QtGui.QImage(pixels.data, SpectrogramItem.TILE_WIDTH, height, SpectrogramItem.TILE_WIDTH, QtGui.QImage.Format.Format_Indexed8)
+    image.setColorTable(COLOR_TABLE)
+    # The image doesn't own pixels' memory until it's copied.
+    return (image.copy(), complete)
@@ -0,0 +1,176 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PyQt6.QtWidgets import QApplication, QGraphicsItem, QGraphicsObject
+from PyQt6.QtCore import (
+    Qt,
+    QEvent,
+    QLineF,
+    QRectF,
+)
+from PyQt6 import QtGui
+import math
+import numpy
+from . import events
+
+# Tiles are rendered on this thread ahead of being scrolled into view. QPixmaps can only be used on the
+# GUI thread, so tiles are rendered as QImages and converted once they arrive.
+PREFETCH_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+
+# WaveformItem draws a song's waveform from its PeakPyramid. Unlike one item per chunk, it only ever
+# draws what's exposed, so neither the number of items in the scene nor the cost of a repaint grows
+# with the length of the song.
+#
+# The waveform is drawn at its actual width on screen (see set_width), from the pyramid level that
+# matches it, so zooming in reveals more detail down to individual samples. It's drawn in tiles of
+# TILE_WIDTH pixels, which are kept as QPixmaps keyed by (width, tile index), up to MAX_TILES of them,
+# least recently used first out. Tiles next to the exposed ones are rendered in the background, so
+# that scrolling doesn't have to wait for them.
+#
+# The pyramid may still be filling up (see LoadPipeline); call update_peaks when it has grown. Until
+# then, the part that isn't summarized yet is left blank, and tiles touching it aren't kept. Tiles that
+# fail to render are left blank as well, and only tried again once the pyramid has grown.
+class WaveformItem(QGraphicsObject):
+    TILE_WIDTH = 256
+    MAX_TILES = 256
+    # Tiles on either side of the exposed ones to render in the background.
+    PREFETCH_TILES = 4
+
+    def __init__(self, peaks, audio_data, width, height, *args, **kargs):
+        super(WaveformItem, self).__init__(*args, **kargs)
+        self.peaks = peaks
+        self.audio_data = audio_data
+        self.width = width
+        self.height = height
+        # Needed for option.exposedRect in paint.
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption)
+        # (width, tile index) -> QPixmap, least recently used first.
+        self.tiles = OrderedDict()
+        # Keys of tiles that are being rendered in the background.
+        self.prefetching = set()
+        # Same keys -> the exception for tiles that failed to render.
+        self.failed = {}
+
+    def boundingRect(self):
+        return QRectF(0, 0, self.width, self.height)
+
+    # Redraws the waveform after more of the song was summarized.
+    def update_peaks(self):
+        self.failed = {}
+        self.update()
+
+    # Changes the width the waveform is drawn at, e.g. when zooming. Tiles drawn at other widths are kept,
+    # so zooming back is cheap.
+    def set_width(self, width):
+        self.prepareGeometryChange()
+        self.width = width
+
+    def tile_count(self):
+        return int(math.ceil(self.width / WaveformItem.TILE_WIDTH))
+
+    def paint(self, painter, option, widget = None):
+        exposed = option.exposedRect
+        first_tile = max(int(exposed.left() // WaveformItem.TILE_WIDTH), 0)
+        last_tile = min(int(exposed.right() // WaveformItem.TILE_WIDTH) + 1, self.tile_count())
+        for index in range(first_tile, last_tile):
+            painter.drawPixmap(index * WaveformItem.TILE_WIDTH, 0, self.tile(index))
+        for index in range(first_tile - WaveformItem.PREFETCH_TILES, last_tile + WaveformItem.PREFETCH_TILES):
+            if 0 <= index < self.tile_count():
+                self.prefetch(index)
+
+    # Returns the tile at index for the current width, rendering it if it isn't cached.
+    def tile(self, index):
+        key = (self.width, index)
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+        if key not in self.failed:
+            try:
+                (image, complete) = render_tile(self.peaks, self.audio_data, self.width, self.height, index)
+            except Exception as e:
+                self.failed[key] = e
+        if key in self.failed:
+            pixmap = QtGui.QPixmap(WaveformItem.TILE_WIDTH, self.height)
+            pixmap.fill(Qt.GlobalColor.transparent)
+            return pixmap
+        pixmap = QtGui.QPixmap.fromImage(image)
+        if complete:
+            self._add_tile(key, pixmap)
+        return pixmap
+
+    def prefetch(self, index):
+        key = (self.width, index)
+        if key in self.tiles or key in self.prefetching or key in self.failed:
+            return
+        self.prefetching.add(key)
+        future = PREFETCH_EXECUTOR.submit(render_tile, self.peaks, self.audio_data, self.width, self.height, index)
+        future.add_done_callback(lambda future: self._post_tile(key, future))
+
+    def _post_tile(self, key, future):
+        try:
+            (image, complete) = future.result()
+            event = events.TileRenderedEvent(key, image, complete)
+        except Exception as e:
+            event = events.TileRenderedEvent(key, None, False, e)
+        try:
+            QApplication.postEvent(self, event)
+        except RuntimeError:
+            # The item was deleted in the meantime, e.g. because another song was opened.
+            pass
+
+    def _add_tile(self, key, pixmap):
+        self.tiles[key] = pixmap
+        self.tiles.move_to_end(key)
+        while len(self.tiles) > WaveformItem.MAX_TILES:
+            self.tiles.popitem(last=False)
+
+    def customEvent(self, event: QEvent):
+        if event.type() == events.TileRenderedEvent.TYPE:
+            self.prefetching.discard(event.get_key())
+            if event.get_error() is not None:
+                self.failed[event.get_key()] = event.get_error()
+            elif event.get_complete():
+                self._add_tile(event.get_key(), QtGui.QPixmap.fromImage(event.get_image()))
+            return
+        return super().customEvent(event)
+
+# Renders tile index of a waveform drawn width pixels wide. Returns (image, complete), where complete
+# is False if part of the tile isn't summarized by peaks yet. This doesn't use anything that's tied to
+# the GUI thread, so it can run in the background.
+def render_tile(peaks, audio_data, width, height, index):
+    image = QtGui.QImage(WaveformItem.TILE_WIDTH, height, QtGui.QImage.Format.Format_ARGB32_Premultiplied)
+    image.fill(Qt.GlobalColor.transparent)
+    frames_per_pixel = peaks.frame_count / width
+    first = index * WaveformItem.TILE_WIDTH
+    last = min(first + WaveformItem.TILE_WIDTH, int(math.ceil(width)))
+    complete = peaks.complete_frames >= min(int(math.ceil(last * frames_per_pixel)), peaks.frame_count)
+    if not complete:
+        last = min(last, int(peaks.complete_frames / frames_per_pixel))
+    if last <= first or peaks.frame_count == 0:
+        return (image, complete)
+    (mins, maxes, rmses) = peaks.query(
+        audio_data,
+        int(first * frames_per_pixel),
+        min(int(math.ceil(last * frames_per_pixel)), peaks.frame_count),
+        last - first,
+    )
+    painter = QtGui.QPainter(image)
+    # The RMS of a single frame is just its magnitude, which would hide the samples themselves.
+    draw_peaks(painter, mins, maxes, rmses if frames_per_pixel >= 2 else None, height)
+    painter.end()
+    return (image, complete)
+
+# Draws one vertical line per value from x = 0, for values from PeakPyramid.query, in a band height
+# pixels high. rmses may be None to leave them out.
+def draw_peaks(painter, mins, maxes, rmses, height):
+    xs = numpy.arange(len(mins)) + 0.5
+    middle = height / 2
+    max_tops = middle * (1.0 - maxes)
+    # Keep silent parts visible as a thin line.
+    max_bottoms = numpy.maximum(middle * (1.0 - mins), max_tops + 1.0)
+    painter.setPen(QtGui.QPen(Qt.GlobalColor.blue))
+    painter.drawLines([QLineF(x, top, x, bottom) for (x, top, bottom) in zip(xs.tolist(), max_tops.tolist(), max_bottoms.tolist())])
+    if rmses is not None:
+        rms_tops = middle * (1.0 - rmses)
+        rms_bottoms = middle * (1.0 + rmses)
+        painter.setPen(QtGui.QPen(Qt.GlobalColor.darkBlue))
+        painter.drawLines([QLineF(x, top, x, bottom) for (x, top, bottom) in zip(xs.tolist(), rms_tops.tolist(), rms_bottoms.tolist())])
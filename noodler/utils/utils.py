@@ -33,35 +33,33 @@ def note_to_piano_key(note):
 def piano_key_to_note(piano_key):
     return librosa.midi_to_note(piano_key_to_midi(piano_key))
 
+# Converts frequencies in Hz to the nearest piano keys. Works on arrays of any shape. Pitches off the
+# keyboard give keys outside 0 - 87.
+def hz_to_piano_key(hz):
+    midi = numpy.round(librosa.hz_to_midi(numpy.maximum(hz, 1e-6)))
+    return midi_to_piano_key(midi).astype(numpy.int64)
+
+# Sums magnitudes by the piano key nearest to their pitch, for bins that have both and whose pitch is on
+# the keyboard. For one frame (1-d pitches and magnitudes, one value per frequency bin), the result is
+# an array of 88 values; for a matrix of frames like piptrack's, arr[k, t] is the magnitude of note k
+# (0 - 87) at time t.
 def group_by_note(pitches, magnitudes):
-    rows = len(pitches)
-    result = numpy.zeros(88)
-    for b in range(0, rows):
-        magnitude = magnitudes[b]
-        pitch = pitches[b]
-        if pitch > 0.0 and magnitude > 0.0:
-            note = librosa.hz_to_note(pitch)
-            piano_key = note_to_piano_key(note)
-            result[piano_key] += magnitude
-    return result
+    pitches = numpy.asarray(pitches)
+    magnitudes = numpy.asarray(magnitudes)
+    keys = hz_to_piano_key(pitches)
+    voiced = (pitches > 0.0) & (magnitudes > 0.0) & (keys >= 0) & (keys <= 87)
+    if pitches.ndim == 1:
+        return numpy.bincount(keys[voiced], weights=magnitudes[voiced], minlength=88)
+    # Give each frame its own 88 bins so that a single bincount covers the whole matrix.
+    frames = pitches.shape[1]
+    indices = keys * frames + numpy.arange(frames)
+    result = numpy.bincount(indices[voiced], weights=magnitudes[voiced], minlength=88 * frames)
+    return result.reshape(88, frames)
 
 # Performs librosa pitch-tracking and then groups the results by note.
 # The result is an array for which arr[k, t] is the magnitude of note k (0 - 87)
 # at time t.
-# def piptrack_by_note(y, sr, **kargs):
-#     y = librosa.to_mono(y=y)
-#     pitches, magnitudes = librosa.piptrack(y=y, sr=sr, threshold=0.00, **kargs)
-#     rows = magnitudes.shape[0]
-#     cols = magnitudes.shape[1]
-#     result = numpy.zeros((88, cols))
-#     for t in range(0, cols):
-#         if t % 100 == 0:
-#             print(t)
-#         for b in range(0, rows):
-#             magnitude = magnitudes[b,t]
-#             pitch = pitches[b,t]
-#             if pitch > 0.0:
-#                 note = librosa.hz_to_note(pitch)
-#                 piano_key = note_to_piano_key(note)
-#                 result[piano_key, t] += magnitude
-#     return result
\ No newline at end of file
+def piptrack_by_note(y, sr, threshold=0.0, **kargs):
+    y = librosa.to_mono(y=y)
+    pitches, magnitudes = librosa.piptrack(y=y, sr=sr, threshold=threshold, **kargs)
+    return group_by_note(pitches, magnitudes)
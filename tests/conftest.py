@@ -0,0 +1,25 @@
+import os
+import sys
+import time
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# The window's tests run without a display.
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+@pytest.fixture(scope="session")
+def qapp():
+    from PyQt6.QtWidgets import QApplication
+    return QApplication.instance() or QApplication([])
+
+# Returns a function that processes events until condition() holds, or fails after timeout seconds.
+@pytest.fixture
+def wait_until(qapp):
+    def wait(condition, timeout = 10.0):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            assert time.monotonic() < deadline, "timed out"
+            qapp.processEvents()
+            time.sleep(0.01)
+    return wait
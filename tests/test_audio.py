@@ -0,0 +1,120 @@
+import queue
+import numpy
+import pytest
+from noodler.audio import audio
+
+FRAME_COUNT = 10000
+
+def frames():
+    return numpy.arange(FRAME_COUNT * 2, dtype=numpy.float32).reshape(FRAME_COUNT, 2)
+
+# Plays from current_frame buffer by buffer, like the PortAudio callback, and returns everything played.
+def play(frames, start_frame, end_frame, current_frame, buffer_count, loop = True):
+    wrap = audio.create_wrap_region(frames, start_frame, end_frame, audio.FRAMES_PER_BUFFER) if loop else None
+    played = []
+    for _ in range(buffer_count):
+        (data, current_frame) = audio.extract_audio_data(frames, wrap, start_frame, end_frame, current_frame, audio.FRAMES_PER_BUFFER)
+        played.append(data)
+        if current_frame >= end_frame:
+            break
+    return numpy.concatenate(played)
+
+@pytest.mark.parametrize("start_frame, end_frame, current_frame", [
+    # Loops longer than a buffer, starting at the start or in the middle.
+    (1000, 7000, 1000),
+    (1000, 7000, 6500),
+    # A buffer ending exactly at the loop boundary.
+    (0, 4 * audio.FRAMES_PER_BUFFER, 0),
+    # Up to the end of the song.
+    (2000, FRAME_COUNT, 9000),
+    # Loops shorter than a buffer, which wrap more than once per buffer.
+    (3000, 3300, 3100),
+    (0, 1, 0),
+])
+def test_looping_matches_wrapped_indices(start_frame, end_frame, current_frame):
+    data = frames()
+    played = play(data, start_frame, end_frame, current_frame, 20)
+    indices = start_frame + (numpy.arange(current_frame, current_frame + len(played)) - start_frame) % (end_frame - start_frame)
+    assert len(played) == 20 * audio.FRAMES_PER_BUFFER
+    numpy.testing.assert_array_equal(played, numpy.take(data, indices, axis=0))
+
+def test_playing_without_looping_stops_at_the_end():
+    data = frames()
+    played = play(data, 1000, 5000, 1500, 20, loop=False)
+    numpy.testing.assert_array_equal(played, data[1500:5000])
+
+def test_empty_loop_has_no_wrap_region():
+    assert audio.create_wrap_region(frames(), 5000, 5000, audio.FRAMES_PER_BUFFER) is None
+
+def test_published_position_reads_back():
+    position = audio.PlaybackPosition()
+    position.publish(3, 44100, True, 0.05)
+    values = position.read()
+    assert values[audio.PlaybackPosition.SEQUENCE] % 2 == 0
+    assert values[audio.PlaybackPosition.GENERATION] == 3
+    assert values[audio.PlaybackPosition.FRAME] == 44100
+    assert values[audio.PlaybackPosition.PLAYING] == 1.0
+    assert values[audio.PlaybackPosition.OUTPUT_LATENCY] == 0.05
+    position.publish(4, 0, False, 0.0)
+    values = position.read()
+    assert values[audio.PlaybackPosition.GENERATION] == 4
+    assert values[audio.PlaybackPosition.PLAYING] == 0.0
+
+# A player that's playing [start_timestamp, end_timestamp) at play_rate, as far as the GUI process knows,
+# without an audio process.
+def playing_player(start_timestamp, end_timestamp, loop, play_rate):
+    player = audio.AudioPlayer()
+    player.audio_state = audio.AudioState("", (44100 * 10, 2), "<f4", 44100, play_rate, 1)
+    player.start_timestamp = start_timestamp
+    player.end_timestamp = end_timestamp
+    player.current_timestamp = start_timestamp
+    player.loop = loop
+    player.playing = True
+    player.playback_generation = 1
+    player.playback_command = audio.PlayAudioCommand(start_timestamp, end_timestamp, start_timestamp, loop, 1)
+    return player
+
+# Publishes frame at time published_at, with output_latency, and returns the timestamp extrapolated at now.
+def extrapolate(monkeypatch, player, frame, published_at, output_latency, now):
+    monkeypatch.setattr(audio.time, "monotonic", lambda: published_at)
+    player.playback_position.publish(1, frame, True, output_latency)
+    monkeypatch.setattr(audio.time, "monotonic", lambda: now)
+    return player.current_timestamp
+
+def test_extrapolation_follows_the_play_rate(monkeypatch):
+    player = playing_player(1.0, 5.0, True, 2.0)
+    # Audible 0.1 s after publishing, and 0.5 s after that at twice the speed.
+    assert extrapolate(monkeypatch, player, 2 * 44100, 100.0, 0.1, 100.6) == pytest.approx(3.0)
+
+def test_extrapolation_past_the_loop_end_wraps_to_the_loop_start(monkeypatch):
+    player = playing_player(1.0, 2.0, True, 1.0)
+    assert extrapolate(monkeypatch, player, int(1.75 * 44100), 100.0, 0.0, 100.5) == pytest.approx(1.25)
+    # More than a whole loop later.
+    assert extrapolate(monkeypatch, player, int(1.75 * 44100), 100.0, 0.0, 102.5) == pytest.approx(1.25)
+
+def test_extrapolation_past_the_end_stops_there_without_looping(monkeypatch):
+    player = playing_player(1.0, 2.0, False, 1.0)
+    assert extrapolate(monkeypatch, player, int(1.75 * 44100), 100.0, 0.0, 100.5) == 2.0
+
+def test_positions_of_an_earlier_playback_are_ignored(monkeypatch):
+    player = playing_player(1.0, 2.0, True, 1.0)
+    player.playback_position.publish(0, int(1.5 * 44100), True, 0.0)
+    assert player.current_timestamp == 1.0
+
+def queued_commands(player):
+    commands = []
+    while True:
+        try:
+            commands.append(player.audio_command_queue.get(timeout=0.5))
+        except queue.Empty:
+            return [command.type() for command in commands]
+
+def test_replacing_the_buffer_at_another_rate_changes_the_rate_of_the_open_stream(tmp_path):
+    player = audio.AudioPlayer()
+    buffer = audio.PcmBuffer.create(numpy.zeros((2, 1000), dtype=numpy.float32), str(tmp_path))
+    player.set_audio_buffer(buffer, 44100, 1.0)
+    player.replace_audio_buffer(buffer, 44100, 1.0)
+    assert queued_commands(player) == [audio.SetAudioStateCommand.TYPE] * 2
+    player.replace_audio_buffer(buffer, 44100, 1.5)
+    assert queued_commands(player) == [audio.SetAudioStateCommand.TYPE, audio.SetPlayRateCommand.TYPE]
+    buffer.delete()
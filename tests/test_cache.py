@@ -0,0 +1,78 @@
+import os
+import threading
+import numpy
+from noodler.audio import render
+from noodler.audio.cache import PcmCache
+from noodler.audio.pcm import PcmBuffer
+
+def store(pcm_cache, key, frame_count):
+    buffer = PcmBuffer.create_at(pcm_cache.reserve(key), numpy.zeros((2, frame_count), dtype=numpy.float32))
+    pcm_cache.store(key, buffer, 44100)
+    return buffer
+
+def test_storing_a_render_keeps_its_source(tmp_path):
+    pcm_cache = PcmCache(str(tmp_path))
+    source = store(pcm_cache, "a" * 64, 1000)
+    # Only room for one entry.
+    pcm_cache.max_bytes = pcm_cache.size()
+    store(pcm_cache, render.render_key("a" * 64, harmonic_only=True), 1000)
+    assert pcm_cache.open("a" * 64) is not None
+    assert pcm_cache.open(render.render_key("a" * 64, harmonic_only=True)) is not None
+
+def test_storing_evicts_least_recently_used_other_songs(tmp_path):
+    pcm_cache = PcmCache(str(tmp_path))
+    store(pcm_cache, "a" * 64, 1000)
+    pcm_cache.max_bytes = pcm_cache.size()
+    store(pcm_cache, "b" * 64, 1000)
+    assert pcm_cache.open("a" * 64) is None
+    assert pcm_cache.open("b" * 64) is not None
+
+# E.g. the window and a library analysis.
+def test_caches_sharing_a_directory_keep_each_others_entries(tmp_path):
+    window_cache = PcmCache(str(tmp_path))
+    analysis_cache = PcmCache(str(tmp_path))
+    store(window_cache, "a" * 64, 1000)
+    store(analysis_cache, "b" * 64, 1000)
+    assert analysis_cache.attach("a" * 64, "peaks.npz") is not None
+    window_cache.prune(window_cache.max_bytes)
+    for pcm_cache in [window_cache, analysis_cache, PcmCache(str(tmp_path))]:
+        assert pcm_cache.open("a" * 64) is not None
+        assert pcm_cache.open("b" * 64) is not None
+        assert pcm_cache.index["entries"]["a" * 64]["attachments"] == ["peaks.npz"]
+
+def test_storing_leaves_audio_reserved_by_other_caches_alone(tmp_path):
+    window_cache = PcmCache(str(tmp_path))
+    analysis_cache = PcmCache(str(tmp_path))
+    reserved_path = window_cache.reserve("a" * 64)
+    store(analysis_cache, "b" * 64, 1000)
+    assert os.path.exists(reserved_path)
+    # Until it's left behind for too long.
+    os.utime(reserved_path, (0, 0))
+    analysis_cache.prune(analysis_cache.max_bytes)
+    assert not os.path.exists(reserved_path)
+
+def test_prune_removes_audio_reserved_but_not_stored(tmp_path):
+    pcm_cache = PcmCache(str(tmp_path))
+    reserved_path = pcm_cache.reserve("a" * 64)
+    pcm_cache.prune(pcm_cache.max_bytes)
+    assert not os.path.exists(reserved_path)
+
+def test_lock_left_behind_does_not_block(tmp_path):
+    pcm_cache = PcmCache(str(tmp_path))
+    lock_path = str(tmp_path / PcmCache.LOCK_FILE)
+    open(lock_path, "w").close()
+    os.utime(lock_path, (0, 0))
+    store(pcm_cache, "a" * 64, 1000)
+    assert pcm_cache.open("a" * 64) is not None
+
+def test_index_changes_wait_for_the_lock(tmp_path):
+    window_cache = PcmCache(str(tmp_path))
+    analysis_cache = PcmCache(str(tmp_path))
+    stored = threading.Event()
+    with window_cache._index_lock():
+        thread = threading.Thread(target=lambda: (store(analysis_cache, "a" * 64, 1000), stored.set()))
+        thread.start()
+        assert not stored.wait(0.2)
+    thread.join()
+    assert stored.is_set()
+    assert window_cache.open("a" * 64) is not None
@@ -0,0 +1,55 @@
+import audioread.exceptions
+import numpy
+import soundfile
+from noodler.audio import audio, source
+from noodler.gui import main_window
+
+def test_opening_a_file_audioread_cant_stream(wait_until, tmp_path, monkeypatch):
+    # As for a float WAV without ffmpeg.
+    def no_backend(path):
+        raise audioread.exceptions.NoBackendError()
+    monkeypatch.setattr(source.audioread, "audio_open", no_backend)
+    monkeypatch.chdir(tmp_path)
+    data = numpy.random.default_rng(0).uniform(-0.5, 0.5, (44100, 2)).astype(numpy.float32)
+    soundfile.write(str(tmp_path / "song.wav"), data, 44100, subtype="FLOAT")
+    window = main_window.MainWindow(audio.AudioPlayer())
+    window.load(str(tmp_path / "song.wav"))
+    wait_until(lambda: window.load_pipeline is None)
+    assert window.decoder is None
+    numpy.testing.assert_array_equal(window.source_buffer.frames, data)
+    assert window.pcm_cache.open(window.source_key) is not None
+    window.close()
+
+def test_opening_an_empty_file(wait_until, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    soundfile.write(str(tmp_path / "empty.wav"), numpy.zeros((0, 2)), 44100, subtype="PCM_16")
+    window = main_window.MainWindow(audio.AudioPlayer())
+    window.show()
+    window.load(str(tmp_path / "empty.wav"))
+    wait_until(lambda: window.load_pipeline is None)
+    assert window.source_buffer.shape[0] == 0
+    # Draws the waveform, ruler, overview and spectrogram.
+    window.spectrogramAction.setChecked(True)
+    window.grab()
+    window.close()
+
+def test_refresh_requests_a_failed_block_again(wait_until, monkeypatch):
+    calls = []
+    def fail(engine, audio_data, sr, threshold, window_width, index):
+        calls.append(index)
+        raise MemoryError()
+    monkeypatch.setattr(main_window.notes, "analyze_block", fail)
+    widget = main_window.VerticalPitchTrackingWidget(audio.AudioPlayer())
+    scene = widget.view.vertical_pitch_tracking_scene
+    widget.set_audio_data("song", numpy.zeros((2, 44100), dtype=numpy.float32), 44100)
+    wait_until(lambda: scene.block_key(0) in scene.failed)
+    assert scene.recomputing_text.text().startswith("Pitch tracking failed")
+    # Not requested again while the parameters stay the same.
+    scene.update()
+    scene.prefetch(0)
+    assert scene.block_key(0) not in scene.pending
+    assert calls.count(0) == 1
+    widget.on_refresh()
+    wait_until(lambda: calls.count(0) == 2)
+    wait_until(lambda: scene.block_key(0) in scene.failed)
+    widget.close()
@@ -0,0 +1,57 @@
+import librosa
+import numpy
+import pytest
+from noodler.audio import notes
+from noodler.audio.peaks import mono
+from noodler.utils import utils
+
+SAMPLING_RATE = 22050
+
+# A few seconds of a low and a middle tone over a little noise, in stereo, long enough for several
+# blocks and not a whole number of them.
+def audio_data(seconds = 9.7):
+    generator = numpy.random.default_rng(0)
+    t = numpy.arange(int(seconds * SAMPLING_RATE)) / SAMPLING_RATE
+    y = 0.3 * numpy.sin(2 * numpy.pi * 220.0 * t) + 0.2 * numpy.sin(2 * numpy.pi * 55.0 * t)
+    return numpy.stack([y, 0.5 * y]).astype(numpy.float32) + generator.uniform(-0.05, 0.05, (2, len(t))).astype(numpy.float32)
+
+# Analyzes the whole song a block at a time and puts the blocks back together.
+def analyze_in_blocks(engine, data, threshold, window_width):
+    blocks = [
+        notes.analyze_block(engine, data, SAMPLING_RATE, threshold, window_width, index)
+        for index in range(notes.block_count(engine, data.shape[-1], window_width))
+    ]
+    return (numpy.concatenate([block[0] for block in blocks], axis=1), numpy.concatenate([block[1] for block in blocks]))
+
+@pytest.mark.parametrize("window_width", [512, 2048])
+def test_piptrack_blocks_match_the_whole_song(window_width):
+    data = audio_data()
+    (pitches, magnitudes) = librosa.piptrack(
+        y=mono(data),
+        sr=SAMPLING_RATE,
+        threshold=0.1,
+        n_fft=window_width,
+        hop_length=window_width // 4,
+    )
+    (blocks, maxima) = analyze_in_blocks("piptrack", data, 0.1, window_width)
+    assert blocks.shape[1] == notes.frame_count("piptrack", data.shape[-1], window_width)
+    numpy.testing.assert_allclose(blocks, utils.group_by_note(pitches, magnitudes), rtol=1e-4, atol=1e-4)
+    numpy.testing.assert_allclose(maxima, magnitudes.max(axis=0), rtol=1e-4, atol=1e-4)
+
+@pytest.mark.parametrize("window_width", [512, 2048])
+def test_constant_q_blocks_match_the_whole_song(window_width):
+    data = audio_data()
+    hop = notes.ENGINES["cqt"].hop_length(window_width)
+    spectrum = numpy.abs(librosa.cqt(
+        mono(data),
+        sr=SAMPLING_RATE,
+        hop_length=hop,
+        fmin=librosa.midi_to_hz(utils.piano_key_to_midi(0)),
+        n_bins=88,
+        bins_per_octave=12,
+    ))
+    (blocks, maxima) = analyze_in_blocks("cqt", data, 0.0, window_width)
+    assert blocks.shape == spectrum.shape
+    # Including the frames at the ends of the song and at the edges of blocks.
+    numpy.testing.assert_allclose(blocks, spectrum, atol=1e-4)
+    numpy.testing.assert_allclose(maxima, spectrum.max(axis=0), atol=1e-4)
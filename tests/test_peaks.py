@@ -0,0 +1,69 @@
+import numpy
+import pytest
+from noodler.audio.peaks import PeakPyramid
+
+# Not a multiple of PeakPyramid.BASE_BLOCK, so that the last block is partial.
+FRAME_COUNT = 64 * 1000 + 37
+
+def audio_data():
+    generator = numpy.random.default_rng(0)
+    return generator.uniform(-1.0, 1.0, (2, FRAME_COUNT)).astype(numpy.float32)
+
+# The minimum, maximum and RMS of the mono mix over each of pixels equal ranges of frames, one at a time.
+def brute_force(audio_data, first_frame, last_frame, pixels):
+    samples = audio_data.mean(axis=0, dtype=numpy.float64)
+    edges = numpy.linspace(first_frame, last_frame, pixels + 1).astype(numpy.int64)
+    ranges = [samples[start:end] for (start, end) in zip(edges[:-1], edges[1:])]
+    return (
+        numpy.array([r.min() for r in ranges]),
+        numpy.array([r.max() for r in ranges]),
+        numpy.array([numpy.sqrt(numpy.mean(numpy.square(r))) for r in ranges]),
+    )
+
+def pyramid_of(audio_data):
+    pyramid = PeakPyramid(FRAME_COUNT)
+    pyramid.update(audio_data, FRAME_COUNT)
+    return pyramid
+
+@pytest.mark.parametrize("first_frame, last_frame, pixels", [
+    # Below a block per pixel, queried from the samples.
+    (1000, 3000, 400),
+    (0, 64 * 10, 64 * 10),
+    # Whole blocks per pixel, on levels 0 to 3.
+    (64 * 128, 64 * 128 + 64 * 200, 200),
+    (128 * 16, 128 * 16 + 128 * 300, 300),
+    (256 * 3, 256 * 3 + 256 * 100, 100),
+    (512 * 5, 512 * 5 + 512 * 50, 50),
+    # Up to the partial last block, on level 6.
+    (4096 * 14, FRAME_COUNT, 1),
+    # The whole song in one pixel, from the top level.
+    (0, FRAME_COUNT, 1),
+])
+def test_query_matches_brute_force(first_frame, last_frame, pixels):
+    data = audio_data()
+    (mins, maxes, rmses) = pyramid_of(data).query(data, first_frame, last_frame, pixels)
+    (expected_mins, expected_maxes, expected_rmses) = brute_force(data, first_frame, last_frame, pixels)
+    numpy.testing.assert_allclose(mins, expected_mins, atol=1e-6)
+    numpy.testing.assert_allclose(maxes, expected_maxes, atol=1e-6)
+    numpy.testing.assert_allclose(rmses, expected_rmses, rtol=1e-4)
+
+def test_incremental_updates_match_a_single_update():
+    data = audio_data()
+    pyramid = PeakPyramid(FRAME_COUNT)
+    for end_frame in [1000, 1001, 30000, 63999, FRAME_COUNT]:
+        pyramid.update(data, end_frame)
+    assert pyramid.complete()
+    whole = pyramid_of(data)
+    for level in range(len(whole.mins)):
+        numpy.testing.assert_array_equal(pyramid.mins[level], whole.mins[level])
+        numpy.testing.assert_array_equal(pyramid.maxes[level], whole.maxes[level])
+        numpy.testing.assert_allclose(pyramid.squares[level], whole.squares[level], rtol=1e-5)
+
+def test_saved_pyramid_loads_the_same(tmp_path):
+    data = audio_data()
+    pyramid = pyramid_of(data)
+    pyramid.save(str(tmp_path / "peaks.npz"))
+    loaded = PeakPyramid.load(str(tmp_path / "peaks.npz"))
+    assert loaded.complete()
+    for (a, b) in zip(loaded.query(data, 0, FRAME_COUNT, 37), pyramid.query(data, 0, FRAME_COUNT, 37)):
+        numpy.testing.assert_array_equal(a, b)
@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+import librosa
+import numpy
+import pytest
+from noodler.audio import render
+from noodler.audio.pcm import PcmBuffer
+
+SAMPLING_RATE = 22050
+
+class Token:
+    def cancelled(self):
+        return False
+
+# A few tones over a little noise, in stereo; 25 seconds make two segments.
+def source(seconds = 25):
+    generator = numpy.random.default_rng(0)
+    t = numpy.arange(seconds * SAMPLING_RATE) / SAMPLING_RATE
+    tones = sum(numpy.sin(2 * numpy.pi * frequency * t) for frequency in (220.0, 330.0, 440.0)) / 6
+    data = numpy.stack([tones, tones * 0.5]) + generator.uniform(-0.05, 0.05, (2, len(t)))
+    return PcmBuffer.create(data.astype(numpy.float32))
+
+def test_segmented_render_matches_a_single_pass():
+    buffer = source()
+    output = PcmBuffer.allocate(buffer.shape[0], buffer.shape[1])
+    progress = []
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        assert render.render_segmented(pool, buffer, output, "harmonic", {}, SAMPLING_RATE, 0, SAMPLING_RATE, Token(), progress.append)
+    assert progress == [False, True]
+    for channel in range(buffer.shape[1]):
+        single_pass = librosa.effects.harmonic(y=numpy.ascontiguousarray(buffer.frames[:, channel]))
+        numpy.testing.assert_allclose(output.frames[:, channel], single_pass, atol=1e-5)
+    buffer.delete()
+    output.delete()
+
+def test_crossfade_weights_sum_to_one():
+    total = 1000
+    segments = [(0, 300), (300, 600), (600, total)]
+    sums = numpy.zeros(total)
+    for (core_start, core_end) in segments:
+        start = max(core_start - 20, 0)
+        end = min(core_end + 20, total)
+        sums[start:end] += render.crossfade_weights(start, end, core_start, core_end, 20, total)
+    numpy.testing.assert_allclose(sums, 1.0, atol=1e-6)
+
+def test_failing_segment_raises(monkeypatch):
+    def fail(y, params):
+        raise RuntimeError("effect failed")
+    monkeypatch.setitem(render.EFFECTS, "fail", fail)
+    buffer = source(5)
+    output = PcmBuffer.allocate(buffer.shape[0], buffer.shape[1])
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        with pytest.raises(RuntimeError, match="effect failed"):
+            render.render_segmented(pool, buffer, output, "fail", {}, SAMPLING_RATE, 0, SAMPLING_RATE, Token(), lambda complete: None)
+    buffer.delete()
+    output.delete()
@@ -0,0 +1,35 @@
+import numpy
+from PyQt6 import QtGui
+from PyQt6.QtWidgets import QStyleOptionGraphicsItem
+from noodler.audio.peaks import PeakPyramid
+from noodler.gui import spectrogram
+
+def paint(item):
+    image = QtGui.QImage(item.width, item.height, QtGui.QImage.Format.Format_ARGB32)
+    option = QStyleOptionGraphicsItem()
+    option.exposedRect = item.boundingRect()
+    painter = QtGui.QPainter(image)
+    item.paint(painter, option)
+    painter.end()
+
+def test_failed_tile_is_not_computed_again_until_update_audio(wait_until, monkeypatch):
+    calls = []
+    def fail(peaks, audio_data, sampling_rate, width, height, index):
+        calls.append(index)
+        raise RuntimeError("tile failed")
+    monkeypatch.setattr(spectrogram, "render_tile", fail)
+    audio_data = numpy.zeros((2, 44100), dtype=numpy.float32)
+    peaks = PeakPyramid(44100)
+    peaks.update(audio_data, 44100)
+    item = spectrogram.SpectrogramItem(peaks, audio_data, 44100, spectrogram.SpectrogramItem.TILE_WIDTH)
+    paint(item)
+    wait_until(lambda: len(item.pending) == 0)
+    assert isinstance(item.failed[(item.width, 0)], RuntimeError)
+    assert len(item.tiles) == 0
+    paint(item)
+    assert len(item.pending) == 0
+    assert calls == [0]
+    item.update_audio()
+    paint(item)
+    wait_until(lambda: len(item.pending) == 0)
+    assert calls == [0, 0]
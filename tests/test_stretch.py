@@ -0,0 +1,62 @@
+import numpy
+import pytest
+from noodler.audio.stretch import TimeStretcher
+
+SAMPLING_RATE = 22050
+# Until the first window's worth of hops has been overlap-added, the output fades in.
+FADE_IN = 2048 - 512
+
+# Stereo sines, a little different per channel, seconds long.
+def sines(seconds = 4.0, frequency = 440.0):
+    t = numpy.arange(int(seconds * SAMPLING_RATE)) / SAMPLING_RATE
+    return numpy.stack([
+        0.5 * numpy.sin(2 * numpy.pi * frequency * t),
+        0.25 * numpy.sin(2 * numpy.pi * frequency * 1.5 * t),
+    ], axis=1).astype(numpy.float32)
+
+# Reads buffer_count buffers of 1024 frames, like the PortAudio callback. Returns the output and the
+# position of each buffer.
+def read(stretcher, buffer_count, rate):
+    reads = [stretcher.read(1024, rate) for _ in range(buffer_count)]
+    return (numpy.concatenate([data for (data, _) in reads]), [position for (_, position) in reads])
+
+def dominant_frequency(y):
+    spectrum = numpy.abs(numpy.fft.rfft(y * numpy.hanning(len(y))))
+    return numpy.argmax(spectrum) * SAMPLING_RATE / len(y)
+
+@pytest.mark.parametrize("rate", [0.5, 0.75, 1.5, 2.0])
+def test_output_length_matches_the_rate(rate):
+    frames = sines(10.0)
+    stretcher = TimeStretcher(frames, 0, len(frames), False)
+    (output, positions) = read(stretcher, 40, rate)
+    assert output.shape == (40 * 1024, 2)
+    # Each buffer moves on by the rate times its length, and so does the whole output.
+    numpy.testing.assert_allclose(numpy.diff(positions), rate * 1024)
+    assert stretcher.position() == pytest.approx(rate * len(output))
+    # Without changing the pitch.
+    assert dominant_frequency(output[FADE_IN:, 0]) == pytest.approx(440.0, abs=2.0)
+
+def test_rate_one_reproduces_the_input():
+    frames = sines()
+    stretcher = TimeStretcher(frames, 1000, len(frames), False)
+    (output, positions) = read(stretcher, 20, 1.0)
+    assert positions == [1000 + 1024 * i for i in range(20)]
+    numpy.testing.assert_allclose(output[FADE_IN:], frames[1000 + FADE_IN:1000 + len(output)], atol=1e-4)
+
+def test_looping_wraps_around_the_loop():
+    frames = sines()
+    (start_frame, end_frame) = (5000, 5000 + 3000)
+    stretcher = TimeStretcher(frames, start_frame, end_frame, True)
+    (output, positions) = read(stretcher, 20, 1.0)
+    assert all(start_frame <= position < end_frame for position in positions)
+    indices = start_frame + numpy.arange(len(output)) % (end_frame - start_frame)
+    numpy.testing.assert_allclose(output[FADE_IN:], frames[indices[FADE_IN:]], atol=1e-4)
+    assert not stretcher.finished()
+
+def test_playing_without_looping_finishes_at_the_end():
+    frames = sines()
+    stretcher = TimeStretcher(frames, 0, 8000, False)
+    read(stretcher, 4, 1.5)
+    assert not stretcher.finished()
+    read(stretcher, 2, 1.5)
+    assert stretcher.finished()
@@ -0,0 +1,69 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy
+import pytest
+from noodler.audio import transcription
+from noodler.audio.pcm import PcmBuffer
+from noodler.audio.transcription import NoteIndex
+
+# Many events of all lengths, some of them very long so that they overlap most of the others, and some
+# starting at the same time.
+def note_index():
+    generator = numpy.random.default_rng(0)
+    onsets = numpy.round(generator.uniform(0.0, 100.0, 500), 1)
+    lengths = numpy.where(generator.uniform(size=500) < 0.05, 50.0, generator.exponential(1.0, 500)) + 0.01
+    return NoteIndex(generator.integers(0, 88, 500), onsets, onsets + lengths, generator.integers(1, 5, 500))
+
+# Timestamps to query at: random ones, and those of the events' onsets and offsets themselves.
+def timestamps(index):
+    generator = numpy.random.default_rng(1)
+    return numpy.concatenate([generator.uniform(-1.0, 160.0, 200), index.onsets[:50], index.offsets[:50]])
+
+def test_overlapping_matches_brute_force():
+    index = note_index()
+    for start in timestamps(index):
+        for length in [0.0, 0.5, 10.0]:
+            end = start + length
+            expected = numpy.flatnonzero((index.onsets < end) & (index.offsets > start))
+            numpy.testing.assert_array_equal(index.overlapping(start, end), expected)
+
+def test_active_at_matches_brute_force():
+    index = note_index()
+    for timestamp in timestamps(index):
+        expected = numpy.flatnonzero((index.onsets <= timestamp) & (index.offsets > timestamp))
+        numpy.testing.assert_array_equal(index.active_at(timestamp), expected)
+
+def test_next_and_previous_onsets_match_brute_force():
+    index = note_index()
+    for timestamp in timestamps(index):
+        later = index.onsets[index.onsets > timestamp]
+        earlier = index.onsets[index.onsets < timestamp]
+        assert index.next_onset(timestamp) == (later.min() if len(later) > 0 else None)
+        assert index.previous_onset(timestamp) == (earlier.max() if len(earlier) > 0 else None)
+
+def test_empty_index():
+    index = NoteIndex([], [], [], [])
+    assert len(index.overlapping(0.0, 10.0)) == 0
+    assert len(index.active_at(1.0)) == 0
+    assert index.next_onset(0.0) is None
+    assert index.previous_onset(0.0) is None
+
+def test_saved_index_loads_the_same(tmp_path):
+    index = note_index()
+    index.save(str(tmp_path / "notes.npz"))
+    loaded = NoteIndex.load(str(tmp_path / "notes.npz"))
+    for name in ["keys", "onsets", "offsets", "velocities"]:
+        numpy.testing.assert_array_equal(getattr(loaded, name), getattr(index, name))
+
+class Token:
+    def cancelled(self):
+        return False
+
+def test_failing_segment_raises(monkeypatch):
+    def fail(path, shape, sampling_rate, first, last):
+        raise RuntimeError("segment failed")
+    monkeypatch.setattr(transcription, "transcribe_segment", fail)
+    buffer = PcmBuffer.create(numpy.zeros((2, 22050 * 5), dtype=numpy.float32))
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        with pytest.raises(RuntimeError, match="segment failed"):
+            transcription.transcribe(pool, buffer, 22050, Token())
+    buffer.delete()
@@ -0,0 +1,19 @@
+import numpy
+from noodler.utils import utils
+
+def test_group_by_note_leaves_out_pitches_off_the_keyboard():
+    # A0 and C8 are the lowest and highest keys; 20 Hz and 5 kHz are off the keyboard.
+    pitches = numpy.array([20.0, 27.5, 440.0, 4186.0, 5000.0, 0.0])
+    magnitudes = numpy.array([1.0, 2.0, 3.0, 4.0, 5.0, 6.0])
+    expected = numpy.zeros(88)
+    expected[[0, 48, 87]] = [2.0, 3.0, 4.0]
+    numpy.testing.assert_array_equal(utils.group_by_note(pitches, magnitudes), expected)
+
+def test_group_by_note_groups_each_frame_of_a_matrix():
+    pitches = numpy.array([[20.0, 440.0, 0.0], [5000.0, 27.5, 440.0]])
+    magnitudes = numpy.array([[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]])
+    expected = numpy.zeros((88, 3))
+    expected[48, 1] = 2.0
+    expected[0, 1] = 5.0
+    expected[48, 2] = 6.0
+    numpy.testing.assert_array_equal(utils.group_by_note(pitches, magnitudes), expected)
@@ -0,0 +1,36 @@
+import numpy
+from noodler.audio.peaks import PeakPyramid
+from noodler.gui import waveform
+
+def waveform_item(frame_count = 44100):
+    audio_data = numpy.zeros((2, frame_count), dtype=numpy.float32)
+    peaks = PeakPyramid(frame_count)
+    peaks.update(audio_data, frame_count)
+    return waveform.WaveformItem(peaks, audio_data, 1200, 150)
+
+def test_failed_prefetch_is_dropped_and_not_retried(wait_until, monkeypatch):
+    calls = []
+    def fail(peaks, audio_data, width, height, index):
+        calls.append(index)
+        raise RuntimeError("tile failed")
+    monkeypatch.setattr(waveform, "render_tile", fail)
+    item = waveform_item()
+    item.prefetch(2)
+    wait_until(lambda: len(item.prefetching) == 0)
+    assert isinstance(item.failed[(1200, 2)], RuntimeError)
+    item.prefetch(2)
+    assert len(item.prefetching) == 0
+    # Drawn blank rather than rendered again.
+    assert item.tile(2).width() == waveform.WaveformItem.TILE_WIDTH
+    assert calls == [2]
+    # Until the pyramid grows.
+    item.update_peaks()
+    item.prefetch(2)
+    wait_until(lambda: len(item.prefetching) == 0)
+    assert calls == [2, 2]
+
+def test_tiles_of_an_empty_song_are_blank(qapp):
+    item = waveform_item(0)
+    (image, complete) = waveform.render_tile(item.peaks, item.audio_data, item.width, item.height, 0)
+    assert complete
+    assert image.width() == waveform.WaveformItem.TILE_WIDTH